@@ -1,46 +1,1151 @@
+import asyncio
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import mimetypes
 import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import chain, count
+import click
 import psycopg
+from psycopg import sql
 from psycopg.rows import dict_row
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session
+from psycopg_pool import AsyncConnectionPool, ConnectionPool, PoolTimeout
+from datetime import date, datetime, timedelta
+from werkzeug.security import safe_join
+from flask import Flask, Response, make_response, render_template, request, redirect, url_for, session, g, jsonify, stream_with_context, has_request_context, before_render_template, template_rendered
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'sua_chave_secreta_aqui')  # Defina uma chave secreta no Render
 
-# Conexão com banco de dados
+# Conexão com banco de dados: "postgres" (DATABASE_URL) ou "sqlite" (arquivo
+# SQLITE_PATH), para lojas que rodam tudo num único servidor
+BANCO = os.environ.get('BANCO', 'postgres')
 DATABASE_URL = os.environ.get('DATABASE_URL')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'fidelidade.db')
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # leitores não bloqueiam o escritor (e vice-versa)
+    'synchronous': 'NORMAL',  # com WAL, só o último commit pode se perder numa queda de energia
+    'foreign_keys': 'ON',  # exclusão do histórico em cascata
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms esperando outro escritor
+    'cache_size': -20000,  # 20 MB por conexão
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+}
 
+# Pool de conexões (configurável por variáveis de ambiente)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # segundos esperando uma conexão livre
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))  # segundos até fechar conexões ociosas
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600))  # segundos até reciclar uma conexão
+DB_POOL_CHECK = os.environ.get('DB_POOL_CHECK', '1') == '1'  # testa a conexão antes de entregá-la
+
+# Réplicas de leitura do Postgres (opcional): DSNs separados por vírgula. As
+# funções só de leitura (listagens, histórico, relatórios) usam uma réplica
+# saudável; escritas e o que vem depois delas continuam no primário. Cada
+# réplica tem um pool com a mesma configuração DB_POOL_*.
+DATABASE_REPLICAS = [url.strip() for url in os.environ.get('DATABASE_REPLICAS', '').split(',') if url.strip()]
+REPLICA_ATRASO_MAX = float(os.environ.get('REPLICA_ATRASO_MAX', 5))  # segundos de atraso aceitos numa réplica
+REPLICA_VERIFICACAO = float(os.environ.get('REPLICA_VERIFICACAO', 2))  # segundos entre verificações
+
+# Listagens de clientes (/consulta e /excluir)
+TAMANHO_PAGINA = int(os.environ.get('TAMANHO_PAGINA', 100))
+TAMANHO_PAGINA_MAX = 1000
+TAMANHO_PAGINA_HISTORICO = int(os.environ.get('TAMANHO_PAGINA_HISTORICO', 50))
+
+# Busca de clientes para o autocompletar (/clientes/busca)
+BUSCA_LIMITE = 10
+BUSCA_LIMITE_MAX = 50
+
+# Partições mensais de pedidos (migração 0007)
+PARTICOES_FUTURAS = int(os.environ.get('PARTICOES_FUTURAS', 3))  # meses criados com antecedência
+RETENCAO_MESES = int(os.environ.get('RETENCAO_MESES', 24))  # meses mantidos no banco
+ARQUIVO_DIR = os.environ.get('ARQUIVO_DIR', 'arquivo')  # destino dos meses arquivados
+
+# Arquivos de static/: url_for('static', ...) acrescenta ?v=<hash do conteúdo>
+# e as URLs versionadas ficam no navegador por ESTATICOS_MAX_AGE segundos sem
+# revalidar; um arquivo alterado ganha outra URL. Os de texto acima de
+# ESTATICOS_GZIP_MIN bytes vão compactados com gzip para quem aceita.
+ESTATICOS_MAX_AGE = int(os.environ.get('ESTATICOS_MAX_AGE', 365 * 24 * 3600))
+ESTATICOS_GZIP_MIN = 512
+ESTATICOS_COMPACTAVEIS = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+# API JSON dos terminais: tokens aceitos no cabeçalho "Authorization: Bearer"
+API_TOKENS = [token.strip() for token in os.environ.get('API_TOKENS', '').split(',') if token.strip()]
+API_LOTE_MAX = 500  # transações por chamada de /api/sincronizar
+# Transações offline (com "horario") são aceitas até API_OFFLINE_MAX_DIAS
+# depois de feitas; horários mais de API_RELOGIO_TOLERANCIA segundos à frente
+# do servidor (relógio do terminal adiantado) são recusados.
+API_OFFLINE_MAX_DIAS = int(os.environ.get('API_OFFLINE_MAX_DIAS', 3))
+API_RELOGIO_TOLERANCIA = int(os.environ.get('API_RELOGIO_TOLERANCIA', 300))
+
+# Maior quantidade aceita numa dedução ou adição (telas e API); bem abaixo do
+# limite da coluna creditos (INTEGER)
+QUANTIDADE_MAX = int(os.environ.get('QUANTIDADE_MAX', 1000))
+
+# Métricas (texto no formato do Prometheus em /metrics). Cada worker acumula
+# as suas em memória; com METRICAS_DIR, uma thread do worker grava um retrato
+# a cada segundo nesse diretório e /metrics soma os de todos os workers. O diretório deve ser
+# esvaziado a cada deploy, como o de multiprocess do prometheus_client.
+METRICAS = os.environ.get('METRICAS', '1') == '1'
+METRICAS_DIR = os.environ.get('METRICAS_DIR')
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')  # exigido como "Authorization: Bearer"; sem ele, /metrics fica desligado
+CONSULTA_LENTA_MS = float(os.environ.get('CONSULTA_LENTA_MS', 500))  # limite do log de consultas lentas
+METRICAS_BALDES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICAS_DESCRICOES = {
+    'fidelidade_requisicao_segundos': ('histogram', "Duração das requisições por rota e ação."),
+    'fidelidade_requisicoes_total': ('counter', "Requisições por rota e status HTTP."),
+    'fidelidade_consulta_segundos': ('histogram', "Duração dos execute() no banco, pela função que os chamou."),
+    'fidelidade_consultas_lentas_total': ('counter', "Consultas acima de CONSULTA_LENTA_MS."),
+    'fidelidade_conexao_espera_segundos': ('histogram', "Espera por uma conexão do pool."),
+    'fidelidade_template_segundos': ('histogram', "Renderização dos templates."),
+}
+# Valores aceitos no rótulo "acao"; qualquer outro vira "outra", para que
+# formulários adulterados não criem séries novas.
+METRICAS_ACOES = ['buscar', 'buscar_historico', 'mostrar_empresas', 'selecionar_empresa', 'deduzir', 'recarregar',
+                  'adicionar_credito_manual', 'confirmar_adicao', 'mostrar_senha_exclusao', 'verificar_senha_exclusao',
+                  'verificar_senha', 'editar', 'confirmar_exclusao']
+
+class Metricas:
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.histogramas = {}  # (nome, rótulos) -> [contagem por balde..., +Inf, soma]
+        self.contadores = {}
+        self.pid = None
+
+    def observar(self, nome, rotulos, valor):
+        if METRICAS_DIR and self.pid != os.getpid():
+            self.iniciar_gravacao()
+        chave = (nome, rotulos)
+        with self.trava:
+            baldes = self.histogramas.get(chave)
+            if baldes is None:
+                baldes = self.histogramas[chave] = [0] * (len(METRICAS_BALDES) + 1) + [0.0]
+            baldes[bisect_left(METRICAS_BALDES, valor)] += 1
+            baldes[-1] += valor
+
+    def contar(self, nome, rotulos):
+        chave = (nome, rotulos)
+        with self.trava:
+            self.contadores[chave] = self.contadores.get(chave, 0) + 1
+
+    def retrato(self):
+        with self.trava:
+            return {
+                'histogramas': [[nome, list(rotulos), list(baldes)] for (nome, rotulos), baldes in self.histogramas.items()],
+                'contadores': [[nome, list(rotulos), valor] for (nome, rotulos), valor in self.contadores.items()],
+            }
+
+    def iniciar_gravacao(self):
+        with self.trava:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:  # valores herdados do processo pai via fork
+                self.histogramas.clear()
+                self.contadores.clear()
+            self.pid = os.getpid()
+        threading.Thread(target=self.gravar_periodicamente, name='metricas', daemon=True).start()
+
+    def gravar_periodicamente(self):
+        while True:
+            time.sleep(1)
+            try:
+                self.gravar()
+            except OSError as erro:
+                app.logger.warning("Falha ao gravar as métricas em %s: %s", METRICAS_DIR, erro)
+
+    # A troca por os.replace evita que /metrics leia um arquivo pela metade
+    def gravar(self):
+        os.makedirs(METRICAS_DIR, exist_ok=True)
+        caminho = os.path.join(METRICAS_DIR, f'{os.getpid()}.json')
+        with open(caminho + '.tmp', 'w') as arquivo:
+            json.dump(self.retrato(), arquivo)
+        os.replace(caminho + '.tmp', caminho)
+
+metricas = Metricas()
+
+def rotulos_metrica(**rotulos):
+    return tuple(sorted(rotulos.items()))
+
+def somar_retratos():
+    if not METRICAS_DIR:
+        retratos = [metricas.retrato()]
+    else:
+        metricas.gravar()
+        retratos = []
+        for nome_arquivo in os.listdir(METRICAS_DIR):
+            if nome_arquivo.endswith('.json'):
+                with open(os.path.join(METRICAS_DIR, nome_arquivo)) as arquivo:
+                    retratos.append(json.load(arquivo))
+    histogramas, contadores = {}, {}
+    for retrato in retratos:
+        for nome, rotulos, baldes in retrato['histogramas']:
+            chave = (nome, tuple(map(tuple, rotulos)))
+            atual = histogramas.setdefault(chave, [0] * len(baldes))
+            histogramas[chave] = [a + b for a, b in zip(atual, baldes)]
+        for nome, rotulos, valor in retrato['contadores']:
+            chave = (nome, tuple(map(tuple, rotulos)))
+            contadores[chave] = contadores.get(chave, 0) + valor
+    return histogramas, contadores
+
+def formatar_rotulos(rotulos, **extras):
+    pares = list(rotulos) + list(extras.items())
+    return '{' + ','.join(f'{nome}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for nome, valor in pares) + '}' if pares else ''
+
+def exportar_metricas():
+    histogramas, contadores = somar_retratos()
+    linhas = []
+    for nome, (tipo, descricao) in METRICAS_DESCRICOES.items():
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        if tipo == 'counter':
+            for (nome_serie, rotulos), valor in sorted(contadores.items()):
+                if nome_serie == nome:
+                    linhas.append(f'{nome}{formatar_rotulos(rotulos)} {valor}')
+            continue
+        for (nome_serie, rotulos), baldes in sorted(histogramas.items()):
+            if nome_serie != nome:
+                continue
+            acumulado = 0
+            for limite, quantidade in zip(METRICAS_BALDES + ('+Inf',), baldes):
+                acumulado += quantidade
+                linhas.append(f'{nome}_bucket{formatar_rotulos(rotulos, le=limite)} {acumulado}')
+            linhas.append(f'{nome}_sum{formatar_rotulos(rotulos)} {baldes[-1]:.6f}')
+            linhas.append(f'{nome}_count{formatar_rotulos(rotulos)} {acumulado}')
+    return '\n'.join(linhas) + '\n'
+
+# Tempo de cada execute(), rotulado pela função do app que o chamou (subindo
+# as chamadas internas do psycopg, como conn.execute). Os cursores medidos
+# entram no pool via cursor_factory.
+def registrar_consulta(cursor, query, duracao):
+    quadro = sys._getframe(2)
+    while quadro.f_globals.get('__name__', '').startswith('psycopg.'):
+        quadro = quadro.f_back
+    modulo = quadro.f_globals.get('__name__', '')
+    origem = 'verificacao_pool' if modulo.startswith('psycopg_pool') else quadro.f_code.co_name
+    metricas.observar('fidelidade_consulta_segundos', rotulos_metrica(origem=origem), duracao)
+    if duracao * 1000 >= CONSULTA_LENTA_MS:
+        metricas.contar('fidelidade_consultas_lentas_total', rotulos_metrica(origem=origem))
+        texto = query if isinstance(query, str) else query.as_string(cursor)
+        app.logger.warning("Consulta lenta (%.0f ms) em %s: %s", duracao * 1000, origem, ' '.join(texto.split())[:300])
+
+class CursorMedido(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            registrar_consulta(self, query, time.perf_counter() - inicio)
+
+class CursorMedidoAsync(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            registrar_consulta(self, query, time.perf_counter() - inicio)
+
+_pool = None
+_pool_pid = None
+_pool_trava = threading.Lock()
+
+# Cada worker do gunicorn cria o seu próprio pool na primeira utilização.
+# O pid é verificado para não reaproveitar um pool herdado via fork, e a trava
+# evita que threads do mesmo worker criem dois pools ao mesmo tempo.
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_trava:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_idle=DB_POOL_MAX_IDLE,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                check=ConnectionPool.check_connection if DB_POOL_CHECK else None,
+                kwargs={'row_factory': dict_row, 'cursor_factory': CursorMedido if METRICAS else psycopg.Cursor},
+                name='fidelidade',
+                open=True,
+            )
+            _pool_pid = os.getpid()
+    return _pool
+
+# Atraso da réplica em segundos: zero se ela já aplicou tudo o que recebeu
+# (sem isso, um primário parado faria a réplica parecer cada vez mais atrasada)
+SQL_ATRASO_REPLICA = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS atraso
+"""
+
+class Replica:
+    def __init__(self, indice, url):
+        self.nome = f'replica{indice}'
+        self.pool = ConnectionPool(
+            url,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            check=ConnectionPool.check_connection if DB_POOL_CHECK else None,
+            kwargs={'row_factory': dict_row, 'cursor_factory': CursorMedido if METRICAS else psycopg.Cursor},
+            name=f'fidelidade-{self.nome}',
+            open=True,
+        )
+        self.saudavel = False  # só recebe leituras depois da primeira verificação
+        self.atraso = None
+
+    def verificar(self):
+        try:
+            with self.pool.connection(timeout=REPLICA_VERIFICACAO) as conn:
+                self.atraso = float(conn.execute(SQL_ATRASO_REPLICA).fetchone()['atraso'])
+            saudavel = self.atraso <= REPLICA_ATRASO_MAX
+            motivo = f"atraso de {self.atraso:.1f} s"
+        except (psycopg.Error, PoolTimeout) as erro:
+            self.atraso = None
+            saudavel = False
+            motivo = erro
+        if self.saudavel and not saudavel:
+            app.logger.warning("Réplica %s indisponível, leituras voltam ao primário: %s", self.nome, motivo)
+        elif saudavel and not self.saudavel:
+            app.logger.info("Réplica %s disponível (atraso %.1f s).", self.nome, self.atraso)
+        self.saudavel = saudavel
+
+_replicas = None
+_replicas_pid = None
+_replicas_trava = threading.Lock()
+_replicas_rodizio = count()
+
+# Criadas por worker, como o pool do primário; uma thread do worker verifica
+# cada réplica a cada REPLICA_VERIFICACAO segundos.
+def get_replicas():
+    global _replicas, _replicas_pid
+    if _replicas is not None and _replicas_pid == os.getpid():
+        return _replicas
+    with _replicas_trava:
+        if _replicas is None or _replicas_pid != os.getpid():
+            _replicas = [Replica(indice, url) for indice, url in enumerate(DATABASE_REPLICAS, start=1)]
+            _replicas_pid = os.getpid()
+            threading.Thread(target=verificar_replicas, args=(_replicas,), name='replicas', daemon=True).start()
+    return _replicas
+
+def verificar_replicas(replicas):
+    while True:
+        for replica in replicas:
+            replica.verificar()
+        time.sleep(REPLICA_VERIFICACAO)
+
+# Modo SQLite: as funções do app usam a mesma interface de cursor do psycopg
+# (placeholders %s e %(nome)s, linhas como dict, rowcount); o SQL que difere
+# entre os bancos fica em BancoPostgres e BancoSQLite, logo abaixo.
+# Datas e horários são gravados como texto ISO e convertidos de volta pelo
+# tipo declarado da coluna (DATE, TIMESTAMP, BOOLEAN).
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda valor: valor.isoformat(' '))
+sqlite3.register_converter('DATE', lambda valor: date.fromisoformat(valor.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda valor: datetime.fromisoformat(valor.decode()))
+sqlite3.register_converter('BOOLEAN', lambda valor: valor not in (b'0', b''))
+
+PLACEHOLDERS = re.compile(r"%\((\w+)\)s|%s|%%")
+
+def traduzir_placeholders(query):
+    return PLACEHOLDERS.sub(lambda m: ':' + m.group(1) if m.group(1) else '?' if m.group(0) == '%s' else '%', query)
+
+def linha_como_dict(cursor, linha):
+    return {coluna[0]: valor for coluna, valor in zip(cursor.description, linha)}
+
+class CursorSQLite:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.itersize = None  # aceito como nos cursores nomeados; o SQLite já lê as linhas sob demanda
+
+    def execute(self, query, params=None):
+        if params is not None:
+            query = traduzir_placeholders(query)
+        inicio = time.perf_counter()
+        try:
+            self.cursor.execute(query, () if params is None else params)
+        finally:
+            if METRICAS:
+                registrar_consulta(self, query, time.perf_counter() - inicio)
+        return self
+
+    def executemany(self, query, params):
+        self.cursor.executemany(traduzir_placeholders(query), params)
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        self.cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ConexaoSQLite:
+    def __init__(self, caminho):
+        # isolation_level IMMEDIATE: a primeira escrita da transação já reserva
+        # o banco, então duas deduções simultâneas esperam (busy_timeout) em vez
+        # de falhar ao tentar promover uma leitura a escrita.
+        self.conexao = sqlite3.connect(caminho, isolation_level='IMMEDIATE', detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conexao.row_factory = linha_como_dict
+        for nome, valor in SQLITE_PRAGMAS.items():
+            self.conexao.execute(f"PRAGMA {nome} = {valor}")
+        # Usadas pelas colunas geradas celular_digitos e nome_busca
+        self.conexao.create_function('normalizar_celular', 1, normalizar_celular, deterministic=True)
+        self.conexao.create_function('normalizar_nome', 1, normalizar_nome, deterministic=True)
+
+    def cursor(self, name=None):
+        return CursorSQLite(self.conexao.cursor())
+
+    def execute(self, query, params=None):
+        return self.cursor().execute(query, params)
+
+    def commit(self):
+        self.conexao.commit()
+
+    def rollback(self):
+        self.conexao.rollback()
+
+# O que difere entre os bancos (conexão, recursos e os comandos que não têm
+# forma comum) fica num objeto por banco, com os mesmos métodos: "banco",
+# escolhido uma vez por BANCO. As funções do app abrem a transação, montam os
+# parâmetros e tratam o resultado; os métodos só executam o SQL de cada banco.
+class BancoPostgres:
+    nome = 'postgres'
+    replicas = True  # DATABASE_REPLICAS
+    notificacoes = True  # LISTEN/NOTIFY do cache
+    particionado = True  # pedidos particionada por mês (migração 0007)
+    assincrono = True  # rotas de asgi.ROTAS_ASYNC
+    cache_padrao = 'local'
+
+    def conectar(self):
+        inicio = time.perf_counter()
+        conn = get_pool().getconn()
+        if METRICAS:
+            metricas.observar('fidelidade_conexao_espera_segundos', rotulos_metrica(pool='sync'), time.perf_counter() - inicio)
+        return conn
+
+    def devolver(self, conn):
+        devolver_conexao(get_pool(), conn)
+
+    def estatisticas(self):
+        estatisticas = get_pool().get_stats()
+        if _pool_async is not None:
+            estatisticas['assincrono'] = _pool_async.get_stats()
+        if DATABASE_REPLICAS:
+            estatisticas['replicas'] = [dict(nome=replica.nome, saudavel=replica.saudavel, atraso=replica.atraso,
+                                             **replica.pool.get_stats()) for replica in get_replicas()]
+        return estatisticas
+
+    def pasta_migracoes(self):
+        return MIGRACOES_DIR
+
+    def aplicar_migracoes(self, conn):
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS schema_migracoes (
+            versao TEXT PRIMARY KEY,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+        conn.commit()
+        aplicadas = []
+        for versao in listar_migracoes():
+            with conn.transaction():
+                c.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRACOES_LOCK,))
+                c.execute("SELECT 1 FROM schema_migracoes WHERE versao = %s", (versao,))
+                if c.fetchone():
+                    continue
+                with open(os.path.join(self.pasta_migracoes(), versao + '.sql'), encoding='utf-8') as arquivo:
+                    c.execute(arquivo.read())
+                c.execute("INSERT INTO schema_migracoes (versao) VALUES (%s)", (versao,))
+            aplicadas.append(versao)
+        return aplicadas
+
+    # A transação abre sozinha no primeiro comando
+    def iniciar_transacao(self, conn):
+        pass
+
+    # Condição "coluna começa com o parâmetro" atendida pelo índice da coluna
+    # (LIKE 'x%' com collation "C"), e a ordem em que esse índice é lido
+    def condicao_prefixo(self, coluna, parametro):
+        return f'{coluna} COLLATE "C" LIKE %({parametro})s'
+
+    def valor_prefixo(self, texto):
+        return escapar_like(texto) + '%'
+
+    def ordem_binaria(self, coluna):
+        return f'{coluna} COLLATE "C"'
+
+    # OFFSET 0 impede que o planejador troque o índice GIN por uma varredura
+    # em ordem de nome_busca, filtrando a tabela inteira
+    def buscar_palavras(self, c, palavras, limite):
+        c.execute("""SELECT card_id, nome, celular, creditos FROM (
+            SELECT nome_busca, card_id, nome, celular, creditos FROM clientes
+            WHERE to_tsvector('simple', nome_busca) @@ to_tsquery('simple', %s) OFFSET 0) AS palavras
+            ORDER BY nome_busca LIMIT %s""", (' & '.join(palavra + ':*' for palavra in palavras), limite))
+
+    # Condição "coluna está na lista" com um único parâmetro
+    def condicao_lista(self, coluna):
+        return f"{coluna} = ANY(%s)"
+
+    def valor_lista(self, valores):
+        return list(valores)
+
+    def movimentar_creditos(self, c, parametros):
+        c.execute(SQL_MOVIMENTAR_CREDITOS, parametros)
+        return c.fetchone()
+
+    def carregar_importacao(self, c, registros):
+        c.execute("CREATE TEMP TABLE importacao_clientes (linha INTEGER PRIMARY KEY, nome TEXT, card_id TEXT, celular TEXT, erro TEXT) ON COMMIT DROP")
+        with c.copy("COPY importacao_clientes (linha, nome, card_id, celular) FROM STDIN") as copia:
+            for registro in registros:
+                copia.write_row(registro)
+
+    def inserir_importacao(self, c, hoje, expiracao):
+        c.execute("""WITH inseridos AS (
+                INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular)
+                SELECT nome, card_id, %s, %s, %s, celular FROM importacao_clientes WHERE erro IS NULL ORDER BY linha
+                ON CONFLICT (card_id) DO NOTHING
+                RETURNING card_id
+            )
+            UPDATE importacao_clientes SET erro = 'Erro: Este ID já está cadastrado.'
+            WHERE erro IS NULL AND card_id NOT IN (SELECT card_id FROM inseridos)""",
+                  (hoje, 10, expiracao))
+
+    # ON COMMIT DROP
+    def descartar_importacao(self, c):
+        pass
+
+    def consolidar_resumo_diario(self, conn):
+        c = conn.cursor()
+        c.execute("SELECT consolidar_resumo_diario() AS consolidados")
+        consolidados = c.fetchone()['consolidados']
+        conn.commit()
+        return consolidados
+
+    # Um só retrato dos pedidos e das pendências, tirado depois do LOCK (que
+    # espera uma consolidação em andamento): o que for confirmado depois fica
+    # de fora das duas coisas e entra pela próxima consolidação.
+    def recalcular_resumo_diario(self, conn, desde):
+        c = conn.cursor()
+        c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        c.execute("LOCK TABLE resumo_diario IN EXCLUSIVE MODE")
+        c.execute("DELETE FROM resumo_diario_pendente WHERE dia >= %s", (desde,))
+        c.execute("DELETE FROM resumo_diario_cartoes WHERE dia >= %s", (desde,))
+        c.execute("DELETE FROM resumo_diario WHERE dia >= %s", (desde,))
+        c.execute("""INSERT INTO resumo_diario_cartoes (dia, empresa, card_id)
+            SELECT DISTINCT horario::date, empresa, card_id FROM pedidos WHERE horario >= %s""", (desde,))
+        c.execute("""INSERT INTO resumo_diario (dia, empresa, registros, creditos, cartoes)
+            SELECT horario::date, empresa, count(*), sum(abs(quantidade_deduzida)), count(DISTINCT card_id)
+            FROM pedidos WHERE horario >= %s GROUP BY 1, 2""", (desde,))
+        conn.commit()
+
+    # Pendências ainda não consolidadas entram na soma; um cartão pendente só
+    # conta se ainda não foi contado no dia.
+    def obter_painel(self, c, desde):
+        c.execute("""SELECT dia, empresa, sum(registros)::integer AS registros, sum(creditos)::integer AS creditos,
+                   sum(cartoes)::integer AS cartoes
+            FROM (
+                SELECT dia, empresa, registros, creditos, cartoes FROM resumo_diario WHERE dia > %(desde)s
+                UNION ALL
+                SELECT dia, empresa, sum(registros), sum(creditos),
+                       count(DISTINCT card_id) FILTER (WHERE NOT EXISTS (
+                           SELECT 1 FROM resumo_diario_cartoes rc
+                           WHERE rc.dia = p.dia AND rc.empresa = p.empresa AND rc.card_id = p.card_id))
+                FROM resumo_diario_pendente p WHERE dia > %(desde)s
+                GROUP BY 1, 2
+            ) AS resumo
+            GROUP BY 1, 2
+            ORDER BY 1 DESC""", {'desde': desde})
+
+    def ler_exportacao(self, tabela, formato='csv', inicio=None, fim=None, empresa=None):
+        conn = get_db_connection_leitura()
+        c = conn.cursor()
+        with c.copy(montar_consulta_exportacao(tabela, formato, inicio, fim, empresa)) as copia:
+            yield from copia
+
+class BancoSQLite:
+    nome = 'sqlite'
+    replicas = False
+    notificacoes = False
+    particionado = False
+    assincrono = False  # sem driver assíncrono: tudo vai para o pool de threads
+    # Sem LISTEN/NOTIFY para avisar os outros workers, e a leitura do arquivo
+    # local já custa o mesmo que o cache
+    cache_padrao = 'desligado'
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.local = threading.local()
+
+    # Uma conexão por thread (e por processo), aberta no primeiro uso e mantida
+    # enquanto a thread viver: abrir o arquivo custa mais que a maioria das consultas.
+    def conectar(self):
+        conn = getattr(self.local, 'conexao', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = ConexaoSQLite(self.caminho)
+            self.local.conexao = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def devolver(self, conn):
+        conn.rollback()  # a conexão é da thread e continua aberta
+
+    def estatisticas(self):
+        return {'banco': self.nome, 'arquivo': self.caminho}  # sem pool: uma conexão por thread
+
+    def pasta_migracoes(self):
+        return os.path.join(MIGRACOES_DIR, 'sqlite')
+
+    # BEGIN IMMEDIATE faz o papel do advisory lock: dois deploys simultâneos
+    # aplicam cada migração uma vez só, inteira ou nada.
+    def aplicar_migracoes(self, conn):
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS schema_migracoes (
+            versao TEXT PRIMARY KEY,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )""")
+        aplicadas = []
+        for versao in listar_migracoes():
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute("SELECT 1 FROM schema_migracoes WHERE versao = %s", (versao,))
+                if c.fetchone():
+                    conn.rollback()
+                    continue
+                with open(os.path.join(self.pasta_migracoes(), versao + '.sql'), encoding='utf-8') as arquivo:
+                    for comando in separar_comandos_sqlite(arquivo.read()):
+                        c.execute(comando)
+                c.execute("INSERT INTO schema_migracoes (versao) VALUES (%s)", (versao,))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            aplicadas.append(versao)
+        c.execute("PRAGMA optimize")
+        return aplicadas
+
+    # O módulo sqlite3 não abre a transação antes de um SAVEPOINT, que viraria
+    # a transação externa (e o RELEASE a confirmaria): ela é aberta antes,
+    # como nas escritas.
+    def iniciar_transacao(self, conn):
+        if not conn.conexao.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+
+    # O LIKE do SQLite ignora maiúsculas e não usa esses índices: no lugar
+    # dele, o intervalo equivalente
+    def condicao_prefixo(self, coluna, parametro):
+        return f"{coluna} >= %({parametro})s AND {coluna} < %({parametro})s || char(1114111)"
+
+    def valor_prefixo(self, texto):
+        return texto
+
+    def ordem_binaria(self, coluna):
+        return coluna
+
+    # Sem índice de palavras: percorre nome_busca, o que numa loja só (alguns
+    # milhares de clientes) ainda leva poucos milissegundos
+    def buscar_palavras(self, c, palavras, limite):
+        condicoes = " AND ".join(["' ' || nome_busca LIKE %s ESCAPE '\\'"] * len(palavras))
+        c.execute(f"SELECT card_id, nome, celular, creditos FROM clientes WHERE {condicoes} ORDER BY nome_busca LIMIT %s",
+                  ['% ' + escapar_like(palavra) + '%' for palavra in palavras] + [limite])
+
+    def condicao_lista(self, coluna):
+        return f"{coluna} IN (SELECT value FROM json_each(%s))"
+
+    def valor_lista(self, valores):
+        return json.dumps(list(valores))
+
+    # O SQLite não aceita UPDATE/INSERT dentro de WITH: os mesmos passos vão em
+    # comandos separados, na transação aberta pelo UPDATE (BEGIN IMMEDIATE, que já
+    # serializa os escritores), e o resultado tem o mesmo formato.
+    def movimentar_creditos(self, c, parametros):
+        c.execute("""UPDATE clientes SET creditos = creditos + %(quantidade)s
+            WHERE card_id = %(card_id)s
+              AND creditos + %(quantidade)s >= 0
+              AND (NOT expirado OR %(offline)s)
+              AND (data_expiracao IS NULL OR data_expiracao >= %(hoje)s)
+            RETURNING creditos""", parametros)
+        atualizado = c.fetchone()
+        if atualizado:
+            c.execute("INSERT INTO pedidos (card_id, empresa, quantidade_deduzida, horario) VALUES (%(card_id)s, %(empresa)s, %(quantidade)s, %(horario)s)",
+                      {**parametros, 'horario': parametros['horario'] or datetime.now()})
+        c.execute("SELECT nome, creditos, data_expiracao, expirado FROM clientes WHERE card_id = %(card_id)s", parametros)
+        result = c.fetchone()
+        if result:
+            result['novo_creditos'] = atualizado['creditos'] if atualizado else None
+        return result
+
+    # As linhas entram por executemany, que faz o papel do COPY
+    def carregar_importacao(self, c, registros):
+        c.execute("DROP TABLE IF EXISTS temp.importacao_clientes")
+        c.execute("CREATE TEMP TABLE importacao_clientes (linha INTEGER PRIMARY KEY, nome TEXT, card_id TEXT, celular TEXT, erro TEXT)")
+        c.executemany("INSERT INTO importacao_clientes (linha, nome, card_id, celular) VALUES (%s, %s, %s, %s)", registros)
+
+    # Sem INSERT dentro de WITH; com o banco já reservado pela transação,
+    # ninguém cadastra o mesmo card_id entre os dois comandos
+    def inserir_importacao(self, c, hoje, expiracao):
+        c.execute("UPDATE importacao_clientes SET erro = 'Erro: Este ID já está cadastrado.' "
+                  "WHERE erro IS NULL AND card_id IN (SELECT card_id FROM clientes)")
+        c.execute("""INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular)
+            SELECT nome, card_id, %s, %s, %s, celular FROM importacao_clientes WHERE erro IS NULL ORDER BY linha""",
+                  (hoje, 10, expiracao))
+
+    def descartar_importacao(self, c):
+        c.execute("DROP TABLE temp.importacao_clientes")
+
+    # Com um escritor por vez, o gatilho atualiza resumo_diario direto: não há
+    # pendências a consolidar
+    def consolidar_resumo_diario(self, conn):
+        return 0
+
+    def recalcular_resumo_diario(self, conn, desde):
+        c = conn.cursor()
+        c.execute("DELETE FROM resumo_diario WHERE dia >= %s", (desde,))
+        c.execute("""INSERT INTO resumo_diario (dia, empresa, registros, creditos, cartoes)
+            SELECT date(horario), empresa, count(*), sum(abs(quantidade_deduzida)), count(DISTINCT card_id)
+            FROM pedidos WHERE horario >= %s GROUP BY 1, 2""", (desde,))
+        conn.commit()
+
+    def obter_painel(self, c, desde):
+        c.execute("SELECT dia, empresa, registros, creditos, cartoes FROM resumo_diario WHERE dia > %s ORDER BY dia DESC",
+                  (desde,))
+
+    # Sem COPY: o cursor lê as linhas sob demanda e cada uma é formatada aqui,
+    # no mesmo formato do COPY (booleanos t/f no CSV, datas ISO no JSON).
+    def ler_exportacao(self, tabela, formato='csv', inicio=None, fim=None, empresa=None):
+        filtros = []
+        parametros = []
+        if tabela == 'pedidos':
+            if inicio:
+                filtros.append("p.horario >= %s")
+                parametros.append(inicio)
+            if fim:
+                filtros.append("p.horario < %s")
+                parametros.append(fim + timedelta(days=1))
+            if empresa:
+                filtros.append("p.empresa = %s")
+                parametros.append(empresa)
+        consulta = EXPORTACAO_CONSULTAS[tabela]
+        if filtros:
+            consulta += " WHERE " + " AND ".join(filtros)
+        c = get_db_connection().cursor()
+        c.execute(consulta + " ORDER BY 1", parametros)
+        if formato == 'jsonl':
+            for row in c:
+                yield (json.dumps(row, ensure_ascii=False, separators=(',', ':'), default=lambda valor: valor.isoformat()) + '\n').encode()
+            return
+        texto = io.StringIO()
+        escritor = csv.writer(texto, lineterminator='\n')
+        escritor.writerow([coluna[0] for coluna in c.description])
+        for row in c:
+            escritor.writerow([valor_csv(valor) for valor in row.values()])
+            yield texto.getvalue().encode()
+            texto.seek(0)
+            texto.truncate()
+        yield texto.getvalue().encode()
+
+banco = BancoSQLite(SQLITE_PATH) if BANCO == 'sqlite' else BancoPostgres()
+
+# Conexão da requisição: todas as funções chamadas numa mesma requisição
+# compartilham a mesma conexão, devolvida ao pool ao final.
 def get_db_connection():
-    conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    if 'db_conn' not in g:
+        g.db_conn = banco.conectar()
+    return g.db_conn
+
+# Conexão para leituras que toleram o atraso de uma réplica. Fica no primário
+# quando não há réplica saudável, quando a requisição já usou o primário (para
+# ler o que acabou de escrever) e, pela sessão, até REPLICA_ATRASO_MAX
+# segundos depois da última escrita do usuário.
+def get_db_connection_leitura():
+    if not DATABASE_REPLICAS or not banco.replicas or 'db_conn' in g or escreveu_recentemente():
+        return get_db_connection()
+    if 'db_conn_leitura' in g:
+        return g.db_conn_leitura
+    saudaveis = [replica for replica in get_replicas() if replica.saudavel]
+    if not saudaveis:
+        return get_db_connection()
+    replica = saudaveis[next(_replicas_rodizio) % len(saudaveis)]
+    inicio = time.perf_counter()
+    try:
+        conn = replica.pool.getconn()
+    except PoolTimeout:
+        return get_db_connection()
+    if METRICAS:
+        metricas.observar('fidelidade_conexao_espera_segundos', rotulos_metrica(pool='replica'), time.perf_counter() - inicio)
+    g.replica_leitura = replica
+    g.db_conn_leitura = conn
     return conn
 
-# Cria tabelas de clientes, pedidos e usuarios
-conn = get_db_connection()
-c = conn.cursor()
-c.execute('''CREATE TABLE IF NOT EXISTS clientes (
-    id SERIAL PRIMARY KEY,
-    nome TEXT NOT NULL,
-    card_id TEXT UNIQUE NOT NULL,
-    ultimo_pagamento DATE,
-    creditos INTEGER NOT NULL,
-    data_expiracao DATE,
-    celular TEXT NOT NULL
-)''')
-c.execute('''CREATE TABLE IF NOT EXISTS pedidos (
-    id SERIAL PRIMARY KEY,
-    card_id TEXT NOT NULL,
-    nome_cliente TEXT NOT NULL,
-    empresa TEXT NOT NULL,
-    quantidade_deduzida INTEGER NOT NULL,
-    horario TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-)''')
-c.execute('''CREATE TABLE IF NOT EXISTS usuarios (
-    id SERIAL PRIMARY KEY,
-    login TEXT UNIQUE NOT NULL,
-    senha TEXT
-)''')
-conn.commit()
-conn.close()
+def escreveu_recentemente():
+    return has_request_context() and session.get('primario_ate', 0) > time.time()
+
+# Requisições que alteram dados e usaram o primário marcam a sessão, para que
+# as próximas leituras do mesmo usuário não venham de uma réplica atrasada.
+@app.after_request
+def marcar_escrita(resposta):
+    if DATABASE_REPLICAS and 'db_conn' in g and request.method not in ('GET', 'HEAD'):
+        session['primario_ate'] = time.time() + REPLICA_ATRASO_MAX
+    return resposta
+
+# Encerra transações de leitura abertas e devolve a conexão ao pool. Se o
+# servidor derrubou a conexão o rollback falha, mas ela volta ao pool mesmo
+# assim (que a descarta e abre outra), senão a vaga se perderia.
+def devolver_conexao(pool, conn):
+    try:
+        conn.rollback()
+    except psycopg.Error:
+        pass
+    finally:
+        pool.putconn(conn)
+
+async def devolver_conexao_async(pool, conn):
+    try:
+        await conn.rollback()
+    except psycopg.Error:
+        pass
+    finally:
+        await pool.putconn(conn)
+
+@app.teardown_appcontext
+def liberar_conexao(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        banco.devolver(conn)
+    conn = g.pop('db_conn_leitura', None)
+    if conn is not None:
+        devolver_conexao(g.pop('replica_leitura').pool, conn)
+
+@app.before_request
+def iniciar_medicao():
+    if METRICAS:
+        g.inicio_requisicao = time.perf_counter()
+
+# Respostas em streaming (listagens, exportação) são medidas até a visão
+# devolver o gerador; a renderização das listagens aparece no tempo do
+# template (renderizar_em_partes).
+@app.after_request
+def registrar_requisicao(resposta):
+    if METRICAS and 'inicio_requisicao' in g:
+        rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+        acao = request.form.get('action', '') if request.method == 'POST' else ''
+        if acao and acao not in METRICAS_ACOES:
+            acao = 'outra'
+        metricas.observar('fidelidade_requisicao_segundos', rotulos_metrica(rota=rota, metodo=request.method, acao=acao),
+                          time.perf_counter() - g.inicio_requisicao)
+        metricas.contar('fidelidade_requisicoes_total', rotulos_metrica(rota=rota, status=resposta.status_code))
+    return resposta
+
+def iniciar_template(sender, template, context, **extra):
+    g.inicio_template = time.perf_counter()
+
+def registrar_template(sender, template, context, **extra):
+    inicio = g.pop('inicio_template', None)
+    if inicio is not None:
+        metricas.observar('fidelidade_template_segundos', rotulos_metrica(template=template.name), time.perf_counter() - inicio)
+
+if METRICAS:
+    before_render_template.connect(iniciar_template, app)
+    template_rendered.connect(registrar_template, app)
+
+_estaticos = {}  # caminho -> versão e corpo gzip, recalculados se o arquivo mudar
+
+def info_estatico(nome):
+    caminho = safe_join(app.static_folder, nome)
+    if caminho is None or not os.path.isfile(caminho):
+        return None
+    modificado = os.stat(caminho).st_mtime_ns
+    info = _estaticos.get(caminho)
+    if info is None or info['modificado'] != modificado:
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+        mimetype = mimetypes.guess_type(caminho)[0] or 'application/octet-stream'
+        compactavel = mimetype.startswith(ESTATICOS_COMPACTAVEIS) and len(conteudo) >= ESTATICOS_GZIP_MIN
+        info = {
+            'modificado': modificado,
+            'versao': hashlib.sha256(conteudo).hexdigest()[:12],
+            'mimetype': mimetype,
+            'gzip': gzip.compress(conteudo, compresslevel=9, mtime=0) if compactavel else None,
+        }
+        _estaticos[caminho] = info
+    return info
+
+@app.url_defaults
+def versionar_estatico(endpoint, valores):
+    if endpoint == 'static' and 'v' not in valores:
+        info = info_estatico(valores.get('filename', ''))
+        if info:
+            valores['v'] = info['versao']
+
+def servir_estatico(filename):
+    info = info_estatico(filename)
+    if info and info['gzip'] and 'gzip' in request.accept_encodings:
+        resposta = Response(info['gzip'], mimetype=info['mimetype'])
+        resposta.headers['Content-Encoding'] = 'gzip'
+        resposta.set_etag(info['versao'] + '-gzip')
+        resposta.make_conditional(request)
+    else:
+        resposta = app.send_static_file(filename)
+    if info and info['gzip']:
+        resposta.vary.add('Accept-Encoding')
+    if info and request.args.get('v') == info['versao']:
+        resposta.cache_control.public = True
+        resposta.cache_control.max_age = ESTATICOS_MAX_AGE
+        resposta.cache_control.immutable = True
+        resposta.cache_control.no_cache = None
+    return resposta
+
+app.view_functions['static'] = servir_estatico
+
+# Cache de leitura dos dados de saldo do cliente, por card_id. Backends:
+# "local" (LRU com TTL em cada worker, invalidado entre workers por
+# LISTEN/NOTIFY), "redis" (compartilhado; requer o pacote redis e REDIS_URL)
+# ou "desligado". O TTL limita por quanto tempo um valor pode ficar defasado
+# se uma invalidação se perder; o saldo em si é sempre conferido no UPDATE.
+# No modo SQLite o padrão é "desligado": não há LISTEN/NOTIFY para avisar os
+# outros workers, e a leitura do arquivo local já custa o mesmo que o cache.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', banco.cache_padrao)
+CACHE_TAMANHO = int(os.environ.get('CACHE_TAMANHO', 10000))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 30))  # segundos
+CACHE_NOTIFY = os.environ.get('CACHE_NOTIFY', '1') == '1'
+CACHE_CANAL = 'cache_clientes'
+REDIS_URL = os.environ.get('REDIS_URL')
+
+class CacheLocal:
+    def __init__(self, tamanho, ttl):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self.itens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def obter(self, chave):
+        with self.lock:
+            item = self.itens.get(chave)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.itens[chave]
+                return None
+            self.itens.move_to_end(chave)
+            return item[1]
+
+    def guardar(self, chave, valor):
+        with self.lock:
+            self.itens[chave] = (time.monotonic() + self.ttl, valor)
+            self.itens.move_to_end(chave)
+            if len(self.itens) > self.tamanho:
+                self.itens.popitem(last=False)
+
+    def invalidar(self, chave):
+        with self.lock:
+            self.itens.pop(chave, None)
+
+    def limpar(self):
+        with self.lock:
+            self.itens.clear()
+
+    def tamanho_atual(self):
+        return len(self.itens)
+
+class CacheRedis:
+    def __init__(self, url, ttl):
+        import redis  # dependência opcional, só necessária com CACHE_BACKEND=redis
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def obter(self, chave):
+        valor = self.redis.get('cliente:' + chave)
+        if valor is None:
+            return None
+        dados = json.loads(valor)
+        if dados['data_expiracao']:
+            dados['data_expiracao'] = date.fromisoformat(dados['data_expiracao'])
+        return dados
+
+    def guardar(self, chave, valor):
+        self.redis.set('cliente:' + chave, json.dumps(valor, default=str), ex=self.ttl)
+
+    def invalidar(self, chave):
+        self.redis.delete('cliente:' + chave)
+
+    def limpar(self):
+        chaves = list(self.redis.scan_iter('cliente:*', count=1000))
+        if chaves:
+            self.redis.delete(*chaves)
+
+    def tamanho_atual(self):
+        return None
+
+_cache = None
+_cache_pid = None
+_cache_trava = threading.Lock()
+cache_contadores = {'acertos': 0, 'falhas': 0, 'invalidacoes': 0}
+cache_contadores_trava = threading.Lock()  # incrementados por várias threads
+
+def contar_cache(nome):
+    with cache_contadores_trava:
+        cache_contadores[nome] += 1
+
+# Assim como o pool, o cache é criado por worker na primeira utilização
+def get_cache():
+    global _cache, _cache_pid
+    if CACHE_BACKEND == 'desligado':
+        return None
+    if _cache is not None and _cache_pid == os.getpid():
+        return _cache
+    with _cache_trava:
+        if _cache is None or _cache_pid != os.getpid():
+            if CACHE_BACKEND == 'redis':
+                _cache = CacheRedis(REDIS_URL, CACHE_TTL)
+            else:
+                _cache = CacheLocal(CACHE_TAMANHO, CACHE_TTL)
+                if CACHE_NOTIFY and banco.notificacoes:
+                    threading.Thread(target=escutar_invalidacoes, args=(_cache,), name='cache-listen', daemon=True).start()
+            _cache_pid = os.getpid()
+    return _cache
+
+# Recebe os avisos do gatilho em clientes (migração 0005), inclusive os
+# gerados por outros workers, e invalida as entradas correspondentes.
+def escutar_invalidacoes(cache):
+    while True:
+        try:
+            with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                conn.execute(f"LISTEN {CACHE_CANAL}")
+                cache.limpar()  # avisos enviados enquanto estava desconectado se perderam
+                for aviso in conn.notifies():
+                    if aviso.payload == '*':
+                        cache.limpar()
+                    else:
+                        cache.invalidar(aviso.payload)
+        except psycopg.Error as erro:
+            app.logger.warning("Escuta de invalidações do cache interrompida: %s", erro)
+            time.sleep(5)
+
+def cache_obter_cliente(card_id):
+    cache = get_cache()
+    if cache is None:
+        return None
+    dados = cache.obter(card_id)
+    contar_cache('acertos' if dados is not None else 'falhas')
+    return dados
+
+def cache_guardar_cliente(card_id, dados):
+    cache = get_cache()
+    if cache is not None:
+        cache.guardar(card_id, dict(dados))
+
+# Chamada depois do commit de cada escrita; sem card_id, limpa o cache todo
+def invalidar_cache_cliente(card_id=None):
+    cache = get_cache()
+    if cache is None:
+        return
+    if card_id is None:
+        cache.limpar()
+    else:
+        cache.invalidar(card_id)
+    contar_cache('invalidacoes')
+
+# Migrações do banco de dados: arquivos .sql em migrations/, aplicados em ordem
+# pelo comando "flask --app app migrar" (uma vez por deploy, não na importação).
+# O modo SQLite tem as suas próprias, em migrations/sqlite/.
+MIGRACOES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRACOES_LOCK = 7240501  # chave do advisory lock que serializa deploys simultâneos
+
+def listar_migracoes():
+    return sorted(arquivo[:-4] for arquivo in os.listdir(banco.pasta_migracoes()) if arquivo.endswith('.sql'))
+
+def aplicar_migracoes():
+    return banco.aplicar_migracoes(get_db_connection())
+
+# O execute do SQLite aceita um comando por vez: o arquivo é dividido nos
+# pontos em que o texto acumulado forma um comando completo (o que respeita
+# os ";" dentro dos corpos de gatilhos).
+def separar_comandos_sqlite(texto):
+    comando = ''
+    for linha in texto.splitlines(keepends=True):
+        comando += linha
+        if sqlite3.complete_statement(comando):
+            yield comando
+            comando = ''
+
+@app.cli.command('migrar')
+def migrar():
+    """Aplica as migrações pendentes do banco de dados."""
+    aplicadas = aplicar_migracoes()
+    for versao in aplicadas:
+        click.echo(f"Aplicada: {versao}")
+    if not aplicadas:
+        click.echo("Banco de dados já está atualizado.")
+
+# Renderiza o template em partes enquanto os dados são lidos do banco. Envia
+# os mesmos sinais de render_template (e de flask.stream_template, que não
+# agrupa as partes), de modo que a métrica do template cubra a renderização
+# inteira, do primeiro ao último bloco enviado.
+def renderizar_em_partes(template, **contexto):
+    app.update_template_context(contexto)
+    modelo = app.jinja_env.get_template(template)
+
+    def gerar():
+        before_render_template.send(app, template=modelo, context=contexto)
+        partes = modelo.stream(contexto)
+        partes.enable_buffering(100)
+        yield from partes
+        template_rendered.send(app, template=modelo, context=contexto)
+
+    return stream_with_context(gerar())
+
+# Página de clientes pedida na query string (?apos=<id>&tamanho=<n>),
+# ou todos eles em streaming com ?completo=1
+def pagina_clientes():
+    if request.args.get('completo') == '1':
+        return {'clientes': iterar_clientes(), 'proximo_id': None, 'apos_id': 0, 'tamanho': TAMANHO_PAGINA, 'completo': True}
+    apos_id = request.args.get('apos', 0, type=int)
+    tamanho = max(1, min(request.args.get('tamanho', TAMANHO_PAGINA, type=int), TAMANHO_PAGINA_MAX))
+    clientes, proximo_id = listar_clientes(apos_id, tamanho)
+    return {'clientes': clientes, 'proximo_id': proximo_id, 'apos_id': apos_id, 'tamanho': tamanho, 'completo': False}
+
+def renderizar_pagina_clientes(template, **contexto):
+    pagina = pagina_clientes()
+    if pagina['completo']:
+        return renderizar_em_partes(template, **contexto, **pagina)
+    return render_template(template, **contexto, **pagina)
 
 # Função para verificar autenticação
 def usuario_autenticado():
@@ -52,7 +1157,6 @@ def validar_login(login, senha):
     c = conn.cursor()
     c.execute("SELECT senha FROM usuarios WHERE login = %s", (login,))
     result = c.fetchone()
-    conn.close()
     if result and result['senha'] and result['senha'] == senha:
         return True
     return False
@@ -69,13 +1173,10 @@ def configurar_senha(login, senha, confirmar_senha):
     result = c.fetchone()
     if result:
         if result['senha'] is not None:
-            conn.close()
             return False, "Erro: Este usuário já possui uma senha configurada!"
         c.execute("UPDATE usuarios SET senha = %s WHERE login = %s", (senha, login))
         conn.commit()
-        conn.close()
         return True, "Senha configurada com sucesso!"
-    conn.close()
     return False, "Erro: Login não encontrado!"
 
 def validar_id(card_id):
@@ -85,55 +1186,110 @@ def validar_id(card_id):
     c = conn.cursor()
     c.execute("SELECT card_id FROM clientes WHERE card_id = %s", (card_id,))
     result = c.fetchone()
-    conn.close()
     if result:
         return False, "Erro: Este ID já está cadastrado."
     return True, ""
 
 def buscar_nome_cliente(card_id):
-    conn = get_db_connection()
+    conn = get_db_connection_leitura()
     c = conn.cursor()
     c.execute("SELECT nome, celular FROM clientes WHERE card_id = %s", (card_id,))
     result = c.fetchone()
-    conn.close()
     if result:
         return True, result['nome'], result['celular']
     return False, "Cliente não encontrado", ""
 
-def listar_clientes():
-    conn = get_db_connection()
+# Paginação por keyset: cada página começa depois do último id exibido, então
+# o custo é o mesmo na primeira ou na milésima página (sem OFFSET).
+def listar_clientes(apos_id=0, limite=TAMANHO_PAGINA):
+    conn = get_db_connection_leitura()
     c = conn.cursor()
-    c.execute("SELECT card_id, nome FROM clientes ORDER BY id ASC")
+    c.execute("SELECT id, card_id, nome, creditos, data_expiracao FROM clientes WHERE id > %s ORDER BY id ASC LIMIT %s",
+              (apos_id, limite + 1))
     result = c.fetchall()
-    conn.close()
-    return [(row['card_id'], row['nome']) for row in result]
+    proximo_id = result[limite - 1]['id'] if len(result) > limite else None
+    return result[:limite], proximo_id
+
+# Mesma normalização da coluna nome_busca (migração 0011)
+ACENTOS = str.maketrans('ÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑáàâãäéèêëíìîïóòôõöúùûüçñ',
+                        'AAAAAEEEEIIIIOOOOOUUUUCNaaaaaeeeeiiiiooooouuuucn')
+
+def normalizar_nome(nome):
+    return nome.translate(ACENTOS).lower()
+
+def normalizar_celular(celular):
+    return ''.join(caractere for caractere in celular if '0' <= caractere <= '9')
+
+def escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Autocompletar: primeiro as buscas por prefixo, cada uma limitada pelo
+# próprio índice: card_id; celular (se o termo parece um telefone) ou início do
+# nome. Só se elas não enchem a lista vem a busca mais cara, pelo início de
+# qualquer palavra do nome, e apenas com termos de 3 caracteres ou mais. Os
+# resultados vêm nessa ordem de prioridade, sem repetições.
+def buscar_clientes(termo, limite=BUSCA_LIMITE):
+    termo = termo.strip()
+    digitos = normalizar_celular(termo)
+    nome = normalizar_nome(termo)
+    palavras = ''.join(caractere if caractere.isalnum() else ' ' for caractere in nome).split()
+    parecido_com_telefone = len(digitos) >= 3 and not termo.strip('0123456789()+-. ')
+    ordem_card_id = banco.ordem_binaria('card_id')
+    consultas = [f"""SELECT * FROM (SELECT 1 AS prioridade, {ordem_card_id} AS chave, card_id, nome, celular, creditos FROM clientes
+        WHERE {banco.condicao_prefixo('card_id', 'card_id')} ORDER BY {ordem_card_id} LIMIT %(limite)s) AS por_card_id"""]
+    if parecido_com_telefone:
+        consultas.append(f"""SELECT * FROM (SELECT 2, celular_digitos, card_id, nome, celular, creditos FROM clientes
+            WHERE {banco.condicao_prefixo('celular_digitos', 'celular')} ORDER BY celular_digitos LIMIT %(limite)s) AS por_celular""")
+    else:
+        consultas.append(f"""SELECT * FROM (SELECT 2, nome_busca, card_id, nome, celular, creditos FROM clientes
+            WHERE {banco.condicao_prefixo('nome_busca', 'nome')} ORDER BY nome_busca LIMIT %(limite)s) AS por_nome""")
+    conn = get_db_connection_leitura()
+    c = conn.cursor()
+    c.execute(" UNION ALL ".join(consultas) + " ORDER BY prioridade, chave", {
+        'card_id': banco.valor_prefixo(termo),
+        'celular': banco.valor_prefixo(digitos),
+        'nome': banco.valor_prefixo(nome),
+        'limite': limite,
+    })
+    clientes = {}
+    linhas = c.fetchall()
+    if len(linhas) < limite and not parecido_com_telefone and len(nome) >= 3 and palavras:
+        banco.buscar_palavras(c, palavras, limite)
+        linhas += c.fetchall()
+    for row in linhas:
+        if row['card_id'] not in clientes and len(clientes) < limite:
+            clientes[row['card_id']] = {'card_id': row['card_id'], 'nome': row['nome'], 'celular': row['celular'], 'creditos': row['creditos']}
+    return list(clientes.values())
+
+# Percorre todos os clientes com um cursor no servidor, trazendo um lote por
+# vez: a memória do worker não cresce com o tamanho da tabela.
+def iterar_clientes(tamanho_lote=500):
+    conn = get_db_connection_leitura()
+    with conn.cursor(name='iterar_clientes') as c:
+        c.itersize = tamanho_lote
+        c.execute("SELECT id, card_id, nome, creditos, data_expiracao FROM clientes ORDER BY id ASC")
+        yield from c
 
 def excluir_cliente(card_id):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT nome FROM clientes WHERE card_id = %s", (card_id,))
-    result = c.fetchone()
-    if result:
-        c.execute("DELETE FROM clientes WHERE card_id = %s", (card_id,))
-        c.execute("DELETE FROM pedidos WHERE card_id = %s", (card_id,))
-        conn.commit()
-        conn.close()
+    c.execute("DELETE FROM clientes WHERE card_id = %s", (card_id,))  # o histórico sai em cascata
+    excluido = c.rowcount
+    conn.commit()
+    if excluido:
+        invalidar_cache_cliente(card_id)
         return "Cliente excluído com sucesso!"
-    conn.close()
     return "Cliente não encontrado."
 
 def atualizar_nome_cliente(card_id, novo_nome, novo_celular):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT nome FROM clientes WHERE card_id = %s", (card_id,))
-    result = c.fetchone()
-    if result:
-        c.execute("UPDATE clientes SET nome = %s, celular = %s WHERE card_id = %s", (novo_nome, novo_celular, card_id))
-        c.execute("UPDATE pedidos SET nome_cliente = %s WHERE card_id = %s", (novo_nome, card_id))
-        conn.commit()
-        conn.close()
+    c.execute("UPDATE clientes SET nome = %s, celular = %s WHERE card_id = %s", (novo_nome, novo_celular, card_id))
+    atualizado = c.rowcount
+    conn.commit()
+    if atualizado:
+        invalidar_cache_cliente(card_id)
         return "Cliente atualizado com sucesso!"
-    conn.close()
     return "Cliente não encontrado."
 
 def cadastrar_cliente(nome, card_id, celular):
@@ -145,10 +1301,9 @@ def cadastrar_cliente(nome, card_id, celular):
         c.execute("INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular) VALUES (%s, %s, %s, %s, %s, %s)",
                   (nome, card_id, str(hoje), 10, str(expiracao), celular))
         conn.commit()
-        conn.close()
         return "Cliente cadastrado com sucesso! Créditos iniciais: 10. Créditos poderão ser utilizados para descontos de 50% em pizzas da STOUT PIZZA ou alimentos no CHAAAMA CHOPP."
-    except psycopg.errors.UniqueViolation:
-        conn.close()
+    except (psycopg.errors.UniqueViolation, sqlite3.IntegrityError):
+        conn.rollback()
         return "Erro: ID do cartão já existe."
 
 def recarregar_creditos(card_id):
@@ -156,121 +1311,453 @@ def recarregar_creditos(card_id):
     expiracao = hoje + timedelta(days=30)
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT nome FROM clientes WHERE card_id = %s", (card_id,))
+    c.execute("UPDATE clientes SET creditos = %s, ultimo_pagamento = %s, data_expiracao = %s, expirado = false WHERE card_id = %s RETURNING nome, creditos, data_expiracao, expirado",
+              (10, hoje, expiracao, card_id))
     result = c.fetchone()
+    conn.commit()
+    invalidar_cache_cliente(card_id)
     if result:
-        c.execute("UPDATE clientes SET creditos = %s, ultimo_pagamento = %s, data_expiracao = %s WHERE card_id = %s",
-                  (10, str(hoje), str(expiracao), card_id))
-        conn.commit()
-        conn.close()
-        return "Créditos recarregados para 10 (não cumulativos)!"
-    conn.close()
-    return "Cliente não encontrado."
+        return "Créditos recarregados para 10 (não cumulativos)!", formatar_info_cliente(result)
+    return "Cliente não encontrado.", None
 
-def adicionar_credito_manual(card_id, quantidade):
-    try:
-        quantidade = int(quantidade)
-        if quantidade <= 0:
-            return "Erro: A quantidade deve ser maior que zero."
-    except ValueError:
-        return "Erro: Insira um número válido."
-    
+# Recarga em lote: uma lista de cartões, ou todos os que vencem até uma data
+# (incluindo os já expirados), num único UPDATE.
+def recarregar_creditos_em_lote(card_ids=None, vencendo_ate=None):
     hoje = datetime.now().date()
+    expiracao = hoje + timedelta(days=30)
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT creditos, data_expiracao, nome FROM clientes WHERE card_id = %s", (card_id,))
-    result = c.fetchone()
-    if result:
-        creditos = result['creditos']
-        nome_cliente = result['nome']
-        expiracao = result['data_expiracao']
-        expiracao_date = datetime.strptime(str(expiracao), '%Y-%m-%d').date() if expiracao else hoje
-        if hoje > expiracao_date:
-            conn.close()
-            return "Créditos expirados. Necessário recarregar."
-        novo_creditos = creditos + quantidade
-        c.execute("UPDATE clientes SET creditos = %s WHERE card_id = %s", (novo_creditos, card_id))
-        c.execute("INSERT INTO pedidos (card_id, nome_cliente, empresa, quantidade_deduzida) VALUES (%s, %s, %s, %s)",
-                  (card_id, nome_cliente, 'Adição Manual', quantidade))
-        conn.commit()
-        conn.close()
-        return f"{quantidade} crédito(s) adicionado(s) manualmente. Créditos totais: {novo_creditos}"
-    conn.close()
-    return "Cliente não encontrado."
+    if card_ids is not None:
+        c.execute(f"UPDATE clientes SET creditos = %s, ultimo_pagamento = %s, data_expiracao = %s, expirado = false WHERE {banco.condicao_lista('card_id')} RETURNING card_id",
+                  (10, hoje, expiracao, banco.valor_lista(card_ids)))
+    else:
+        c.execute("UPDATE clientes SET creditos = %s, ultimo_pagamento = %s, data_expiracao = %s, expirado = false WHERE data_expiracao <= %s RETURNING card_id",
+                  (10, hoje, expiracao, vencendo_ate))
+    recarregados = [row['card_id'] for row in c.fetchall()]
+    conn.commit()
+    invalidar_cache_cliente()
+    return recarregados
 
-def registrar_pedido(card_id, nome_cliente, empresa, quantidade_deduzida):
-    empresa_historico = 'CHAMA' if empresa == 'CHAAAMA CHOPP' else empresa
+# Marca como expirados, de uma vez, os cartões cuja data de expiração passou
+def varrer_expirados():
+    hoje = datetime.now().date()
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO pedidos (card_id, nome_cliente, empresa, quantidade_deduzida) VALUES (%s, %s, %s, %s)",
-              (card_id, nome_cliente, empresa_historico, quantidade_deduzida))
+    c.execute("UPDATE clientes SET expirado = true WHERE data_expiracao < %s AND NOT expirado", (hoje,))
+    total = c.rowcount
     conn.commit()
-    conn.close()
+    if total:
+        invalidar_cache_cliente()
+    return total
 
-def deduzir_credito(card_id, quantidade, empresa):
+def listar_vencendo(dias):
+    hoje = datetime.now().date()
+    conn = get_db_connection_leitura()
+    c = conn.cursor()
+    c.execute("SELECT card_id, nome, celular, creditos, data_expiracao FROM clientes WHERE NOT expirado AND data_expiracao BETWEEN %s AND %s ORDER BY data_expiracao, id",
+              (hoje, hoje + timedelta(days=dias)))
+    return c.fetchall()
+
+@app.cli.command('varrer-expirados')
+def varrer_expirados_comando():
+    """Marca os cartões expirados (agendar uma vez por dia, após a meia-noite)."""
+    click.echo(f"{varrer_expirados()} cartão(ões) marcado(s) como expirado(s).")
+
+@app.cli.command('recarregar-lote')
+@click.argument('card_ids', nargs=-1)
+@click.option('--vencendo-em', type=int, help='Recarrega os cartões que vencem nos próximos N dias (e os já expirados).')
+def recarregar_lote_comando(card_ids, vencendo_em):
+    """Recarrega os cartões informados, ou os que vencem em N dias."""
+    if card_ids:
+        recarregados = recarregar_creditos_em_lote(card_ids=card_ids)
+    elif vencendo_em is not None:
+        recarregados = recarregar_creditos_em_lote(vencendo_ate=datetime.now().date() + timedelta(days=vencendo_em))
+    else:
+        raise click.UsageError("Informe os cartões ou --vencendo-em.")
+    click.echo(f"{len(recarregados)} cartão(ões) recarregado(s).")
+
+# Atualiza o saldo e grava o pedido num único comando: o UPDATE condicional
+# só altera a linha se o cartão estiver válido (e com saldo, na dedução), e o
+# INSERT em pedidos parte das linhas devolvidas por ele. Como o UPDATE bloqueia
+# a linha do cliente e reavalia a condição, terminais concorrentes não
+# conseguem deixar o saldo negativo nem perder atualizações.
+SQL_MOVIMENTAR_CREDITOS = """
+    WITH atualizado AS (
+        UPDATE clientes SET creditos = creditos + %(quantidade)s
+        WHERE card_id = %(card_id)s
+          AND creditos + %(quantidade)s >= 0
+          AND (NOT expirado OR %(offline)s)
+          AND (data_expiracao IS NULL OR data_expiracao >= %(hoje)s)
+        RETURNING nome, creditos, data_expiracao, expirado
+    ), registro AS (
+        INSERT INTO pedidos (card_id, empresa, quantidade_deduzida, horario)
+        SELECT %(card_id)s, %(empresa)s, %(quantidade)s, COALESCE(%(horario)s::timestamp, LOCALTIMESTAMP) FROM atualizado
+    )
+    SELECT c.nome, c.creditos, c.data_expiracao, c.expirado, a.creditos AS novo_creditos
+    FROM clientes c LEFT JOIN atualizado a ON true
+    WHERE c.card_id = %(card_id)s
+"""
+
+# Uma transação feita offline (com horario) vale se o cartão estava válido no
+# dia em que foi feita, mesmo que tenha vencido antes da sincronização: a
+# validade é conferida contra esse dia, e não contra a marca "expirado", que a
+# varredura grava com a data de hoje. A API só aceita horários dentro da
+# janela de API_OFFLINE_MAX_DIAS (ler_horario_offline).
+def parametros_movimentacao(card_id, quantidade, empresa_historico, horario):
+    return {'card_id': card_id, 'quantidade': quantidade, 'empresa': empresa_historico, 'horario': horario,
+            'hoje': horario.date() if horario else datetime.now().date(), 'offline': horario is not None}
+
+# Com confirmar=False a movimentação fica na transação em aberto, para quem
+# chama (a sincronização em lote) confirmar várias de uma vez.
+def movimentar_creditos(card_id, quantidade, empresa_historico, horario=None, confirmar=True):
+    conn = get_db_connection()
+    c = conn.cursor()
+    parametros = parametros_movimentacao(card_id, quantidade, empresa_historico, horario)
+    result = banco.movimentar_creditos(c, parametros)
+    if confirmar:
+        conn.commit()
+        invalidar_cache_cliente(card_id)
+    return result
+
+def formatar_info_cliente(result):
+    hoje = datetime.now().date()
+    nome = result['nome']
+    creditos = result['creditos']
+    expiracao_date = result['data_expiracao'] or hoje
+    if result['expirado'] or hoje > expiracao_date:
+        dias_restantes = "Expirado"
+    else:
+        dias_restantes = (expiracao_date - hoje).days
+    expiracao_formatada = expiracao_date.strftime('%d/%m/%Y')
+    return nome, creditos, dias_restantes, expiracao_formatada
+
+def ler_quantidade(quantidade):
     try:
         quantidade = int(quantidade)
-        if quantidade <= 0:
-            return "Erro: A quantidade deve ser maior que zero."
-    except ValueError:
-        return "Erro: Insira um número válido."
-    
+    except (TypeError, ValueError):
+        return None, "Erro: Insira um número válido."
+    if quantidade <= 0:
+        return None, "Erro: A quantidade deve ser maior que zero."
+    if quantidade > QUANTIDADE_MAX:
+        return None, f"Erro: A quantidade máxima é {QUANTIDADE_MAX}."
+    return quantidade, ""
+
+# As funções processar_* devolvem (situacao, mensagem, info), com situacao
+# em 'ok', 'invalido', 'nao_encontrado' ou 'recusado'; as telas usam só a
+# mensagem e a info, a API usa também a situação. A validação e a leitura do
+# resultado ficam separadas do acesso ao banco para o modo assíncrono reusar.
+def resultado_adicao(result, quantidade):
+    if not result:
+        return 'nao_encontrado', "Cliente não encontrado.", None
+    if result['novo_creditos'] is None:
+        return 'recusado', "Créditos expirados. Necessário recarregar.", formatar_info_cliente(result)
+    novo_creditos = result['novo_creditos']
+    info = formatar_info_cliente({**result, 'creditos': novo_creditos})
+    return 'ok', f"{quantidade} crédito(s) adicionado(s) manualmente. Créditos totais: {novo_creditos}", info
+
+def processar_adicao(card_id, quantidade, horario=None, confirmar=True):
+    quantidade, erro = ler_quantidade(quantidade)
+    if erro:
+        return 'invalido', erro, None
+    result = movimentar_creditos(card_id, quantidade, 'Adição Manual', horario, confirmar)
+    return resultado_adicao(result, quantidade)
+
+def validar_deducao(quantidade, empresa):
+    quantidade, erro = ler_quantidade(quantidade)
+    if erro:
+        return None, None, erro
     if empresa not in ['STOUT PIZZA', 'CHAAAMA CHOPP']:
-        return "Erro: Empresa inválida."
-    
+        return None, None, "Erro: Empresa inválida."
+    return quantidade, 'CHAMA' if empresa == 'CHAAAMA CHOPP' else empresa, ""
+
+def resultado_deducao(result, quantidade, empresa_historico):
+    if not result:
+        return 'nao_encontrado', "Cliente não encontrado.", None
+    if result['novo_creditos'] is None:
+        info = formatar_info_cliente(result)
+        if info[2] == "Expirado":
+            return 'recusado', "Créditos expirados. Necessário recarregar.", info
+        return 'recusado', f"Erro: Créditos insuficientes. Disponível: {result['creditos']}, solicitado: {quantidade}.", info
+    novo_creditos = result['novo_creditos']
+    info = formatar_info_cliente({**result, 'creditos': novo_creditos})
+    return 'ok', f"{quantidade} crédito(s) deduzido(s) para {empresa_historico}. Créditos restantes: {novo_creditos}", info
+
+def processar_deducao(card_id, quantidade, empresa, horario=None, confirmar=True):
+    quantidade, empresa_historico, erro = validar_deducao(quantidade, empresa)
+    if erro:
+        return 'invalido', erro, None
+    result = movimentar_creditos(card_id, -quantidade, empresa_historico, horario, confirmar)
+    return resultado_deducao(result, quantidade, empresa_historico)
+
+def adicionar_credito_manual(card_id, quantidade):
+    _, mensagem, info = processar_adicao(card_id, quantidade)
+    return mensagem, info
+
+def deduzir_credito(card_id, quantidade, empresa):
+    _, mensagem, info = processar_deducao(card_id, quantidade, empresa)
+    return mensagem, info
+
+# Histórico paginado por keyset em (horario, id), do mais recente ao mais
+# antigo. "antes" é o (horario, id) do último registro da página anterior.
+def obter_historico(card_id, antes=None, limite=TAMANHO_PAGINA_HISTORICO):
+    conn = get_db_connection_leitura()
+    c = conn.cursor()
+    if antes:
+        # "horario <= %s" repete o limite fora da comparação de tuplas para que o
+        # planejador descarte as partições mais novas que a página pedida.
+        c.execute("SELECT id, empresa, quantidade_deduzida, horario FROM pedidos WHERE card_id = %s AND horario <= %s AND (horario, id) < (%s, %s) ORDER BY horario DESC, id DESC LIMIT %s",
+                  (card_id, antes[0], antes[0], antes[1], limite + 1))
+    else:
+        c.execute("SELECT id, empresa, quantidade_deduzida, horario FROM pedidos WHERE card_id = %s ORDER BY horario DESC, id DESC LIMIT %s",
+                  (card_id, limite + 1))
+    result = c.fetchall()
+    proximo = (result[limite - 1]['horario'], result[limite - 1]['id']) if len(result) > limite else None
+    return result[:limite], proximo
+
+# Totais do cartão calculados no banco, sem trazer o histórico para o Python
+def resumir_historico(card_id):
+    conn = get_db_connection_leitura()
+    c = conn.cursor()
+    c.execute("""SELECT
+            COUNT(*) AS registros,
+            COALESCE(-SUM(quantidade_deduzida) FILTER (WHERE empresa = 'STOUT PIZZA'), 0) AS deduzido_stout,
+            COALESCE(-SUM(quantidade_deduzida) FILTER (WHERE empresa = 'CHAMA'), 0) AS deduzido_chama,
+            COUNT(*) FILTER (WHERE empresa = 'Adição Manual') AS adicoes_manuais,
+            COALESCE(SUM(quantidade_deduzida) FILTER (WHERE empresa = 'Adição Manual'), 0) AS creditos_adicionados,
+            COALESCE(-SUM(quantidade_deduzida) FILTER (WHERE quantidade_deduzida < 0 AND horario >= %s), 0) AS deduzido_30_dias
+        FROM pedidos WHERE card_id = %s""", (datetime.now() - timedelta(days=30), card_id))
+    return c.fetchone()
+
+def buscar_info_cliente(card_id):
+    result = cache_obter_cliente(card_id)
+    if result is None:
+        conn = get_db_connection_leitura()
+        c = conn.cursor()
+        c.execute("SELECT nome, creditos, data_expiracao, expirado FROM clientes WHERE card_id = %s", (card_id,))
+        result = c.fetchone()
+        # o que veio de uma réplica pode estar atrasado: só o primário alimenta o cache
+        if result and conn is g.get('db_conn'):
+            cache_guardar_cliente(card_id, result)
+    if result:
+        return formatar_info_cliente(result)
+    return "Cliente não encontrado", None, None, None
+
+# Importação em lote de clientes: as linhas do CSV entram por COPY numa tabela
+# temporária, são validadas de uma vez em SQL e as válidas são inseridas na
+# mesma transação. Devolve a quantidade importada e os erros por linha.
+def importar_clientes(arquivo):
     hoje = datetime.now().date()
+    expiracao = hoje + timedelta(days=30)
+    # A amostra (completada até o fim da linha) volta à frente do restante, sem
+    # seek: a entrada pode ser o stdin de "flask importar -"
+    amostra = arquivo.read(4096) + arquivo.readline()
+    linhas = chain(io.StringIO(amostra), arquivo)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=',;')
+    except csv.Error:
+        dialeto = csv.excel
+    erros = []
+
+    def ler_linhas():
+        for linha, registro in enumerate(csv.reader(linhas, dialeto), start=1):
+            if linha == 1 and registro and registro[0].strip().lower() == 'nome':
+                continue  # cabeçalho
+            if not any(campo.strip() for campo in registro):
+                continue
+            if len(registro) != 3:
+                erros.append({'linha': linha, 'card_id': None, 'erro': "Erro: A linha deve ter 3 colunas (nome, card_id, celular)."})
+                continue
+            yield [linha] + [campo.strip() for campo in registro]
+
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT creditos, data_expiracao, nome FROM clientes WHERE card_id = %s", (card_id,))
-    result = c.fetchone()
-    if result:
-        creditos = result['creditos']
-        expiracao = result['data_expiracao']
-        nome_cliente = result['nome']
-        expiracao_date = datetime.strptime(str(expiracao), '%Y-%m-%d').date() if expiracao else hoje
-        if hoje > expiracao_date:
-            conn.close()
-            return "Créditos expirados. Necessário recarregar."
-        if creditos >= quantidade:
-            novo_creditos = creditos - quantidade
-            c.execute("UPDATE clientes SET creditos = %s WHERE card_id = %s", (novo_creditos, card_id))
-            c.execute("INSERT INTO pedidos (card_id, nome_cliente, empresa, quantidade_deduzida) VALUES (%s, %s, %s, %s)",
-                      (card_id, nome_cliente, 'CHAMA' if empresa == 'CHAAAMA CHOPP' else empresa, -quantidade))
-            conn.commit()
-            conn.close()
-            return f"{quantidade} crédito(s) deduzido(s) para {'CHAMA' if empresa == 'CHAAAMA CHOPP' else empresa}. Créditos restantes: {novo_creditos}"
-        conn.close()
-        return f"Erro: Créditos insuficientes. Disponível: {creditos}, solicitado: {quantidade}."
-    conn.close()
-    return "Cliente não encontrado."
+    banco.carregar_importacao(c, ler_linhas())
+    c.execute("""UPDATE importacao_clientes AS i SET erro = v.erro FROM (
+            SELECT linha, CASE
+                WHEN nome = '' OR card_id = '' OR celular = '' THEN 'Erro: Preencha todos os campos!'
+                WHEN substr(card_id, 1, 4) <> 'CARD' THEN 'Erro: O ID do cartão deve começar com ''CARD''.'
+                WHEN row_number() OVER (PARTITION BY card_id ORDER BY linha) > 1 THEN 'Erro: ID do cartão repetido no arquivo.'
+            END AS erro
+            FROM importacao_clientes
+        ) v WHERE v.linha = i.linha AND v.erro IS NOT NULL""")
+    banco.inserir_importacao(c, hoje, expiracao)
+    c.execute("SELECT linha, card_id, erro FROM importacao_clientes WHERE erro IS NOT NULL")
+    erros.extend(c.fetchall())
+    c.execute("SELECT count(*) AS total FROM importacao_clientes WHERE erro IS NULL")
+    importados = c.fetchone()['total']
+    banco.descartar_importacao(c)
+    conn.commit()
+    erros.sort(key=lambda erro: erro['linha'])
+    return importados, erros
+
+@app.cli.command('importar')
+@click.argument('arquivo', type=click.File('r', encoding='utf-8-sig'))
+def importar_comando(arquivo):
+    """Importa clientes de um CSV com as colunas nome, card_id, celular."""
+    importados, erros = importar_clientes(arquivo)
+    for erro in erros:
+        click.echo(f"Linha {erro['linha']}: {erro['erro']}", err=True)
+    click.echo(f"{importados} cliente(s) importado(s), {len(erros)} linha(s) com erro.")
+
+# Resumo diário por empresa (migrações 0008 e 0012). No Postgres o gatilho só
+# registra as movimentações em resumo_diario_pendente e a consolidação
+# ("flask consolidar-resumo", a cada minuto) as soma em resumo_diario; o
+# painel lê os dois. No SQLite, com um escritor por vez, o gatilho atualiza
+# resumo_diario direto. Recalcular só é necessário para corrigir dias a
+# partir do histórico.
+def consolidar_resumo_diario():
+    return banco.consolidar_resumo_diario(get_db_connection())
+
+def recalcular_resumo_diario(desde):
+    banco.recalcular_resumo_diario(get_db_connection(), desde)
+
+def obter_painel(dias):
+    hoje = datetime.now().date()
+    conn = get_db_connection_leitura()
+    c = conn.cursor()
+    banco.obter_painel(c, hoje - timedelta(days=dias))
+    painel = {}
+    for row in c.fetchall():
+        painel.setdefault(row['dia'], {})[row['empresa']] = row
+    return painel
+
+@app.cli.command('recalcular-resumo')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Primeiro dia a recalcular (AAAA-MM-DD).')
+def recalcular_resumo(desde):
+    """Recalcula o resumo diário a partir dos pedidos."""
+    recalcular_resumo_diario(desde.date())
+    click.echo(f"Resumo diário recalculado desde {desde.date().strftime('%d/%m/%Y')}.")
+
+@app.cli.command('consolidar-resumo')
+def consolidar_resumo():
+    """Soma as movimentações pendentes ao resumo diário (agendar a cada minuto)."""
+    consolidados = consolidar_resumo_diario()
+    click.echo(f"{consolidados} linha(s) do resumo diário atualizada(s).")
 
-def obter_historico(card_id):
+# Manutenção das partições mensais de pedidos: cria os meses seguintes com
+# antecedência e arquiva (CSV gzip) e remove os meses fora da retenção.
+def criar_particoes_futuras(meses=PARTICOES_FUTURAS):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT empresa, quantidade_deduzida, horario FROM pedidos WHERE card_id = %s ORDER BY horario DESC", (card_id,))
-    result = c.fetchall()
-    conn.close()
-    return result
+    c.execute("""SELECT criar_particao_pedidos(mes::date) FROM generate_series(
+            date_trunc('month', LOCALTIMESTAMP), date_trunc('month', LOCALTIMESTAMP) + %s * INTERVAL '1 month', INTERVAL '1 month') AS mes""",
+              (meses,))
+    conn.commit()
 
-def buscar_info_cliente(card_id):
+def listar_particoes_pedidos():
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("""SELECT p.relname AS particao FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+        WHERE i.inhparent = 'pedidos'::regclass AND p.relname ~ '^pedidos_[0-9]{4}_[0-9]{2}$'
+        ORDER BY p.relname""")
+    return [row['particao'] for row in c.fetchall()]
+
+def arquivar_particoes_antigas(retencao_meses=RETENCAO_MESES, destino=ARQUIVO_DIR):
     hoje = datetime.now().date()
+    meses = hoje.year * 12 + hoje.month - 1 - retencao_meses
+    limite = f"pedidos_{meses // 12:04d}_{meses % 12 + 1:02d}"  # primeiro mês mantido
+    os.makedirs(destino, exist_ok=True)
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT nome, creditos, data_expiracao FROM clientes WHERE card_id = %s", (card_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        nome = result['nome']
-        creditos = result['creditos']
-        expiracao = result['data_expiracao']
-        expiracao_date = datetime.strptime(str(expiracao), '%Y-%m-%d').date() if expiracao else hoje
-        if hoje > expiracao_date:
-            dias_restantes = "Expirado"
-        else:
-            dias_restantes = (expiracao_date - hoje).days
-        expiracao_formatada = expiracao_date.strftime('%d/%m/%Y')
-        return nome, creditos, dias_restantes, expiracao_formatada
-    return "Cliente não encontrado", None, None, None
+    arquivadas = []
+    for particao in listar_particoes_pedidos():
+        if particao >= limite:
+            break
+        caminho = os.path.join(destino, particao + '.csv.gz')
+        # Copia primeiro e só então desanexa e remove, na mesma transação: se a
+        # cópia falhar, nada é apagado. O LOCK em SHARE bloqueia só as
+        # gravações nesse mês (uma sincronização offline atrasada, por
+        # exemplo) até o DROP, para que nenhuma linha entre depois da cópia e
+        # se perca; leituras e gravações nos outros meses seguem normalmente.
+        c.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(sql.Identifier(particao)))
+        with gzip.open(caminho + '.tmp', 'wb') as arquivo:
+            with c.copy(sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(particao))) as copia:
+                for bloco in copia:
+                    arquivo.write(bloco)
+        os.replace(caminho + '.tmp', caminho)
+        c.execute(sql.SQL("ALTER TABLE pedidos DETACH PARTITION {}").format(sql.Identifier(particao)))
+        c.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(particao)))
+        conn.commit()
+        arquivadas.append(caminho)
+    return arquivadas
+
+@app.cli.command('manter-particoes')
+@click.option('--meses', type=int, default=PARTICOES_FUTURAS, help='Meses futuros a criar.')
+def manter_particoes(meses):
+    """Cria as partições de pedidos dos próximos meses (agendar diariamente)."""
+    if not banco.particionado:
+        raise click.UsageError("pedidos só é particionada no Postgres.")
+    criar_particoes_futuras(meses)
+    click.echo(f"Partições de pedidos criadas até {meses} mês(es) à frente.")
+
+@app.cli.command('arquivar-pedidos')
+@click.option('--retencao-meses', type=int, default=RETENCAO_MESES, help='Meses completos mantidos no banco.')
+@click.option('--destino', default=ARQUIVO_DIR, type=click.Path(file_okay=False), help='Diretório dos arquivos .csv.gz.')
+def arquivar_pedidos(retencao_meses, destino):
+    """Arquiva em CSV gzip e remove os meses de pedidos fora da retenção."""
+    if not banco.particionado:
+        raise click.UsageError("pedidos só é particionada no Postgres.")
+    for caminho in arquivar_particoes_antigas(retencao_meses, destino):
+        click.echo(f"Arquivado: {caminho}")
+
+# Exportação de clientes e pedidos com COPY ... TO STDOUT: as linhas saem do
+# banco em blocos e são repassadas (opcionalmente compactadas) sem que a
+# tabela inteira seja carregada na memória do worker.
+EXPORTACAO_CONSULTAS = {
+    'clientes': "SELECT id, nome, card_id, ultimo_pagamento, creditos, data_expiracao, expirado, celular FROM clientes",
+    'pedidos': "SELECT p.id, p.card_id, c.nome AS nome_cliente, p.empresa, p.quantidade_deduzida, p.horario FROM pedidos p LEFT JOIN clientes c ON c.card_id = p.card_id",
+}
+EXPORTACAO_BLOCO = 64 * 1024
+
+def montar_consulta_exportacao(tabela, formato='csv', inicio=None, fim=None, empresa=None):
+    filtros = []
+    if tabela == 'pedidos':
+        if inicio:
+            filtros.append(sql.SQL("p.horario >= {}").format(sql.Literal(inicio)))
+        if fim:
+            filtros.append(sql.SQL("p.horario < {}").format(sql.Literal(fim + timedelta(days=1))))
+        if empresa:
+            filtros.append(sql.SQL("p.empresa = {}").format(sql.Literal(empresa)))
+    consulta = sql.SQL(EXPORTACAO_CONSULTAS[tabela])
+    if filtros:
+        consulta += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(filtros)
+    consulta += sql.SQL(" ORDER BY 1")
+    if formato == 'jsonl':
+        # Uma linha JSON por registro; QUOTE/DELIMITER com caracteres que o JSON
+        # nunca contém sem escape fazem o CSV devolver o texto sem alterações.
+        return sql.SQL("COPY (SELECT row_to_json(t) FROM ({}) t) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')").format(consulta)
+    return sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)").format(consulta)
+
+# Booleanos no CSV do SQLite (BancoSQLite.ler_exportacao) como o COPY os escreve
+def valor_csv(valor):
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    return valor
+
+def exportar_dados(tabela, formato='csv', inicio=None, fim=None, empresa=None, compactar=False):
+    compressor = zlib.compressobj(wbits=31) if compactar else None  # wbits=31: formato gzip
+    buffer = bytearray()
+    for linha in banco.ler_exportacao(tabela, formato, inicio, fim, empresa):
+        buffer += linha
+        if len(buffer) >= EXPORTACAO_BLOCO:
+            yield compressor.compress(buffer) if compressor else bytes(buffer)
+            buffer.clear()
+    yield compressor.compress(buffer) + compressor.flush() if compressor else bytes(buffer)
+
+@app.cli.command('exportar')
+@click.option('--tabela', type=click.Choice(['pedidos', 'clientes']), default='pedidos')
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), default='csv')
+@click.option('--inicio', type=click.DateTime(formats=['%Y-%m-%d']), help='Primeiro dia (AAAA-MM-DD), só pedidos.')
+@click.option('--fim', type=click.DateTime(formats=['%Y-%m-%d']), help='Último dia (AAAA-MM-DD), só pedidos.')
+@click.option('--empresa', help="STOUT PIZZA, CHAMA ou 'Adição Manual', só pedidos.")
+@click.option('--gzip', 'compactar', is_flag=True, help='Compacta a saída com gzip.')
+@click.option('--saida', type=click.File('wb'), default='-', help='Arquivo de saída (padrão: stdout).')
+def exportar(tabela, formato, inicio, fim, empresa, compactar, saida):
+    """Exporta clientes ou pedidos em CSV/JSONL."""
+    inicio = inicio.date() if inicio else None
+    fim = fim.date() if fim else None
+    for bloco in exportar_dados(tabela, formato, inicio, fim, empresa, compactar):
+        saida.write(bloco)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -297,6 +1784,17 @@ def primeiro_acesso():
             return redirect(url_for('index'))
     return render_template('primeiro_acesso.html', mensagem=mensagem)
 
+# Com o cabeçalho X-Fragmento (enviado pelo fragmentos.js), só a mensagem e o
+# painel do cliente são renderizados e devolvidos; o resto da página fica
+# no navegador. Usada por index() e index_async().
+def renderizar_index(**contexto):
+    template = 'index_fragmentos.html' if request.headers.get('X-Fragmento') else 'index.html'
+    resposta = make_response(render_template(template, **contexto))
+    if template == 'index_fragmentos.html':
+        resposta.headers['X-Fragmento'] = '1'
+    resposta.vary.add('X-Fragmento')
+    return resposta
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if not usuario_autenticado():
@@ -333,8 +1831,8 @@ def index():
         elif action == 'recarregar':
             senha = request.form.get('senha')
             if senha == "03842789":
-                mensagem = recarregar_creditos(card_id)
-                nome, creditos, dias, expiracao = buscar_info_cliente(card_id)
+                mensagem, info = recarregar_creditos(card_id)
+                nome, creditos, dias, expiracao = info or buscar_info_cliente(card_id)
                 card_id_display = card_id
             else:
                 mensagem = "Senha incorreta!"
@@ -351,8 +1849,8 @@ def index():
                 mensagem = "Senha incorreta!"
         elif action == 'confirmar_adicao':
             quantidade = request.form.get('quantidade')
-            mensagem = adicionar_credito_manual(card_id, quantidade)
-            nome, creditos, dias, expiracao = buscar_info_cliente(card_id)
+            mensagem, info = adicionar_credito_manual(card_id, quantidade)
+            nome, creditos, dias, expiracao = info or buscar_info_cliente(card_id)
             card_id_display = card_id
         elif action == 'mostrar_empresas':
             nome, creditos, dias, expiracao = buscar_info_cliente(card_id)
@@ -375,10 +1873,10 @@ def index():
             if empresa not in ['STOUT PIZZA', 'CHAAAMA CHOPP']:
                 mensagem = "Erro: Empresa inválida!"
             else:
-                mensagem = deduzir_credito(card_id, quantidade, empresa)
-                nome, creditos, dias, expiracao = buscar_info_cliente(card_id)
+                mensagem, info = deduzir_credito(card_id, quantidade, empresa)
+                nome, creditos, dias, expiracao = info or buscar_info_cliente(card_id)
                 card_id_display = card_id
-    return render_template('index.html', mensagem=mensagem, card_id_display=card_id_display, nome=nome, creditos=creditos, dias=dias, expiracao=expiracao, mostrar_empresas=mostrar_empresas, mostrar_quantidade=mostrar_quantidade, empresa_selecionada=empresa_selecionada, mostrar_adicionar_credito=mostrar_adicionar_credito, mostrar_senha_exclusao=mostrar_senha_exclusao)
+    return renderizar_index(mensagem=mensagem, card_id_display=card_id_display, nome=nome, creditos=creditos, dias=dias, expiracao=expiracao, mostrar_empresas=mostrar_empresas, mostrar_quantidade=mostrar_quantidade, empresa_selecionada=empresa_selecionada, mostrar_adicionar_credito=mostrar_adicionar_credito, mostrar_senha_exclusao=mostrar_senha_exclusao)
 
 @app.route('/historico', methods=['GET', 'POST'])
 def historico():
@@ -386,6 +1884,8 @@ def historico():
         return redirect(url_for('login'))
     mensagem = ""
     historico = []
+    resumo = None
+    proximo = None
     card_id_display = ""
     mostrar_formulario = False
     if request.method == 'POST':
@@ -401,11 +1901,20 @@ def historico():
             if not card_id:
                 mensagem = "Erro: ID do cartão é obrigatório!"
             else:
-                historico = obter_historico(card_id)
+                antes = None
+                antes_id = request.form.get('antes_id', type=int)
+                if antes_id is not None:
+                    try:
+                        antes = (datetime.fromisoformat(request.form.get('antes_horario', '')), antes_id)
+                    except ValueError:
+                        antes = None
+                historico, proximo = obter_historico(card_id, antes)
                 card_id_display = card_id
                 if not historico:
                     mensagem = "Nenhum histórico encontrado para este cliente."
-    return render_template('historico.html', mensagem=mensagem, historico=historico, card_id_display=card_id_display, mostrar_formulario=mostrar_formulario)
+                else:
+                    resumo = resumir_historico(card_id)
+    return render_template('historico.html', mensagem=mensagem, historico=historico, resumo=resumo, proximo=proximo, card_id_display=card_id_display, mostrar_formulario=mostrar_formulario)
 
 @app.route('/cadastro', methods=['GET', 'POST'])
 def cadastro():
@@ -429,6 +1938,25 @@ def cadastro():
                     return redirect(url_for('index'))
     return render_template('cadastro.html', mensagem=mensagem, card_id=card_id)
 
+@app.route('/importar', methods=['GET', 'POST'])
+def importar():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    mensagem = ""
+    erros = []
+    if request.method == 'POST':
+        arquivo = request.files.get('arquivo')
+        if not arquivo or not arquivo.filename:
+            mensagem = "Erro: Selecione um arquivo CSV!"
+        else:
+            try:
+                texto = io.TextIOWrapper(arquivo.stream, encoding='utf-8-sig', newline='')
+                importados, erros = importar_clientes(texto)
+                mensagem = f"{importados} cliente(s) importado(s) com sucesso. Linhas com erro: {len(erros)}."
+            except UnicodeDecodeError:
+                mensagem = "Erro: O arquivo deve estar codificado em UTF-8."
+    return render_template('importar.html', mensagem=mensagem, erros=erros)
+
 @app.route('/editar', methods=['GET', 'POST'])
 def editar():
     if not usuario_autenticado():
@@ -469,7 +1997,6 @@ def excluir():
         return redirect(url_for('login'))
     mensagem = ""
     card_id = ""
-    clientes = listar_clientes()
     mostrar_confirmacao = False
     nome_cliente = ""
     if request.method == 'POST':
@@ -488,8 +2015,7 @@ def excluir():
             mensagem = excluir_cliente(card_id)
             if "sucesso" in mensagem.lower():
                 return redirect(url_for('index'))
-            clientes = listar_clientes()
-    return render_template('excluir.html', mensagem=mensagem, card_id=card_id, clientes=clientes, mostrar_confirmacao=mostrar_confirmacao, nome_cliente=nome_cliente)
+    return render_template('excluir.html', mensagem=mensagem, card_id=card_id, mostrar_confirmacao=mostrar_confirmacao, nome_cliente=nome_cliente)
 
 @app.route('/cliente', methods=['GET', 'POST'])
 def cliente():
@@ -497,28 +2023,374 @@ def cliente():
     cliente = None
     if request.method == 'POST':
         celular = request.form['celular'].strip()
+        # Compara só os dígitos: "(11) 98888-7777" e "11988887777" são o mesmo celular
+        digitos = normalizar_celular(celular)
         if not celular:
             mensagem = "Celular não pode estar vazio."
+        elif not digitos:
+            # sem dígitos, a busca acharia os clientes cujo celular também não tem nenhum
+            mensagem = "Nenhum cliente encontrado com esse número de celular."
         else:
-            conn = get_db_connection()
+            conn = get_db_connection_leitura()
             c = conn.cursor()
-            c.execute("SELECT * FROM clientes WHERE celular = %s", (celular,))
+            c.execute("SELECT * FROM clientes WHERE celular_digitos = %s", (digitos,))
             cliente = c.fetchone()
-            conn.close()
             if not cliente:
                 mensagem = "Nenhum cliente encontrado com esse número de celular."
-    return render_template('cliente.html', mensagem=mensagem, cliente=cliente)
+    return render_template('cliente.html', mensagem=mensagem, cliente=cliente, busca_habilitada=usuario_autenticado())
+
+# Autocompletar das telas de clientes: JSON com os primeiros clientes cujo
+# card_id, celular ou nome começam com o termo digitado
+@app.route('/clientes/busca')
+def busca_clientes():
+    if not usuario_autenticado():
+        return jsonify(erro="Não autenticado."), 401
+    termo = request.args.get('q', '').strip()
+    limite = min(max(1, request.args.get('limite', BUSCA_LIMITE, type=int)), BUSCA_LIMITE_MAX)
+    if len(termo) < 2:
+        return jsonify(clientes=[])
+    return jsonify(clientes=buscar_clientes(termo, limite))
 
 @app.route('/consulta')
 def consulta():
     if not usuario_autenticado():
         return redirect(url_for('login'))
+    return renderizar_pagina_clientes('consulta.html')
+
+@app.route('/vencendo', methods=['GET', 'POST'])
+def vencendo():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    mensagem = ""
+    dias = max(0, min(request.values.get('dias', 7, type=int), 366))
+    if request.method == 'POST':
+        if request.form.get('senha') == "03842789":
+            # exatamente os cartões da tabela que o usuário viu
+            recarregados = recarregar_creditos_em_lote(card_ids=request.form.getlist('card_id'))
+            mensagem = f"{len(recarregados)} cartão(ões) recarregado(s) para 10 créditos."
+        else:
+            mensagem = "Senha incorreta!"
+    clientes = listar_vencendo(dias)
+    return render_template('vencendo.html', mensagem=mensagem, dias=dias, clientes=clientes)
+
+@app.route('/painel')
+def painel():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    dias = max(1, min(request.args.get('dias', 30, type=int), 366))
+    return render_template('painel.html', dias=dias, painel=obter_painel(dias))
+
+@app.route('/exportar')
+def exportar_rota():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    tabela = request.args.get('tabela', 'pedidos')
+    formato = request.args.get('formato', 'csv')
+    if tabela not in EXPORTACAO_CONSULTAS or formato not in ['csv', 'jsonl']:
+        return "Erro: Tabela ou formato inválido.", 400
+    try:
+        inicio = datetime.strptime(request.args['inicio'], '%Y-%m-%d').date() if request.args.get('inicio') else None
+        fim = datetime.strptime(request.args['fim'], '%Y-%m-%d').date() if request.args.get('fim') else None
+    except ValueError:
+        return "Erro: Datas devem estar no formato AAAA-MM-DD.", 400
+    empresa = request.args.get('empresa') or None
+    compactar = request.args.get('gzip') == '1'
+    nome_arquivo = f"{tabela}.{formato}" + ('.gz' if compactar else '')
+    mimetype = 'application/gzip' if compactar else ('text/csv' if formato == 'csv' else 'application/x-ndjson')
+    return Response(stream_with_context(exportar_dados(tabela, formato, inicio, fim, empresa, compactar)),
+                    mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'})
+
+# API JSON para os terminais (POS). Reaproveita as mesmas funções das telas;
+# transações com "chave" são idempotentes (tabela transacoes_pos).
+API_STATUS = {'ok': 200, 'invalido': 400, 'nao_encontrado': 404, 'recusado': 422}
+
+def requer_token(view):
+    @wraps(view)
+    def verificar(*args, **kwargs):
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not token or not any(hmac.compare_digest(token, valido) for valido in API_TOKENS):
+            return jsonify(erro="Token inválido."), 401
+        return view(*args, **kwargs)
+    return verificar
+
+def cliente_para_json(card_id, info):
+    if info is None:
+        return None
+    nome, creditos, dias, expiracao = info
+    return {
+        'card_id': card_id,
+        'nome': nome,
+        'creditos': creditos,
+        'expirado': dias == "Expirado",
+        'dias_restantes': None if dias == "Expirado" else dias,
+        'data_expiracao': datetime.strptime(expiracao, '%d/%m/%Y').date().isoformat(),
+    }
+
+# Horário de uma transação feita offline. Fica limitado à janela de
+# API_OFFLINE_MAX_DIAS: como a validade é conferida contra o dia da transação
+# (parametros_movimentacao), um horário retroativo sem limite passaria por
+# cartões vencidos há meses.
+def ler_horario_offline(valor):
+    if not valor:
+        return None, ""
+    try:
+        horario = datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None, "Erro: Horário inválido."
+    if horario.tzinfo:
+        horario = horario.astimezone().replace(tzinfo=None)
+    agora = datetime.now()
+    if horario > agora + timedelta(seconds=API_RELOGIO_TOLERANCIA):
+        return None, "Erro: Horário no futuro. Confira o relógio do terminal."
+    if horario < agora - timedelta(days=API_OFFLINE_MAX_DIAS):
+        return None, f"Erro: Transação offline com mais de {API_OFFLINE_MAX_DIAS} dia(s)."
+    return min(horario, agora), ""
+
+# Aplica uma transação do terminal na transação de banco em aberto, sem
+# confirmar. Reenvios de uma chave já vista devolvem o resultado gravado.
+def aplicar_transacao_pos(transacao):
+    chave = transacao.get('chave')
+    card_id = transacao.get('card_id')
+    if not isinstance(card_id, str) or not card_id:
+        return {'chave': chave, 'situacao': 'invalido', 'mensagem': "Erro: ID do cartão é obrigatório!", 'duplicada': False}
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT card_id, nome, creditos, data_expiracao FROM clientes ORDER BY id ASC")
-    clientes = c.fetchall()
-    conn.close()
-    return render_template('consulta.html', clientes=clientes)
+    if chave:
+        c.execute("INSERT INTO transacoes_pos (chave, card_id) VALUES (%s, %s) ON CONFLICT (chave) DO NOTHING", (str(chave), card_id))
+        if c.rowcount == 0:
+            c.execute("SELECT situacao, mensagem FROM transacoes_pos WHERE chave = %s", (str(chave),))
+            anterior = c.fetchone()
+            return {'chave': chave, 'card_id': card_id, 'situacao': anterior['situacao'], 'mensagem': anterior['mensagem'], 'duplicada': True}
+    horario, erro = ler_horario_offline(transacao.get('horario'))
+    if erro:
+        situacao, mensagem, info = 'invalido', erro, None
+    else:
+        # Um valor que o banco recuse desfaz só esta transação, não o lote
+        try:
+            with ponto_de_salvamento(conn):
+                if transacao.get('tipo') == 'deducao':
+                    situacao, mensagem, info = processar_deducao(card_id, transacao.get('quantidade'), transacao.get('empresa'), horario, confirmar=False)
+                elif transacao.get('tipo') == 'adicao':
+                    situacao, mensagem, info = processar_adicao(card_id, transacao.get('quantidade'), horario, confirmar=False)
+                else:
+                    situacao, mensagem, info = 'invalido', "Erro: Tipo de transação inválido.", None
+        except (psycopg.DataError, sqlite3.DataError, sqlite3.IntegrityError) as erro:
+            app.logger.warning("Transação %s do cartão %s recusada pelo banco: %s", chave, card_id, erro)
+            situacao, mensagem, info = 'invalido', "Erro: Valor fora dos limites.", None
+    if chave:
+        c.execute("UPDATE transacoes_pos SET situacao = %s, mensagem = %s WHERE chave = %s", (situacao, mensagem, str(chave)))
+    return {'chave': chave, 'card_id': card_id, 'situacao': situacao, 'mensagem': mensagem, 'cliente': cliente_para_json(card_id, info), 'duplicada': False}
+
+# SAVEPOINT dentro da transação do lote, que precisa já estar aberta
+# (BancoSQLite.iniciar_transacao)
+@contextmanager
+def ponto_de_salvamento(conn):
+    banco.iniciar_transacao(conn)
+    c = conn.cursor()
+    c.execute("SAVEPOINT transacao_pos")
+    try:
+        yield
+    except Exception:
+        c.execute("ROLLBACK TO SAVEPOINT transacao_pos")
+        raise
+    c.execute("RELEASE SAVEPOINT transacao_pos")
+
+# Confirma as transações aplicadas; num deadlock entre lotes concorrentes tudo
+# é desfeito e o terminal pode reenviar (as chaves tornam o reenvio seguro).
+def confirmar_transacoes_pos(resultados):
+    conn = get_db_connection()
+    conn.commit()
+    for card_id in {resultado['card_id'] for resultado in resultados if resultado.get('card_id')}:
+        invalidar_cache_cliente(card_id)
+
+@app.route('/api/cartoes/<card_id>')
+@requer_token
+def api_cartao(card_id):
+    info = buscar_info_cliente(card_id)
+    if info[1] is None:
+        return jsonify(erro="Cliente não encontrado."), 404
+    return jsonify(cliente_para_json(card_id, info))
+
+@app.route('/api/cartoes/<card_id>/<tipo>', methods=['POST'])
+@requer_token
+def api_movimentar(card_id, tipo):
+    if tipo not in ['deducao', 'adicao']:
+        return jsonify(erro="Tipo de transação inválido."), 404
+    dados = request.get_json(silent=True) or {}
+    if not isinstance(dados, dict):
+        return jsonify(erro="Envie a transação como um objeto JSON."), 400
+    transacao = {**dados, 'card_id': card_id, 'tipo': tipo, 'chave': request.headers.get('Idempotency-Key') or dados.get('chave')}
+    try:
+        resultado = aplicar_transacao_pos(transacao)
+        confirmar_transacoes_pos([resultado])
+    except psycopg.errors.DeadlockDetected:
+        get_db_connection().rollback()
+        return jsonify(erro="Conflito com outra transação, tente novamente."), 503
+    return jsonify(resultado), API_STATUS.get(resultado['situacao'], 200)
+
+@app.route('/api/cartoes/<card_id>/historico')
+@requer_token
+def api_historico(card_id):
+    antes = None
+    if request.args.get('antes_id'):
+        try:
+            antes = (datetime.fromisoformat(request.args['antes_horario']), int(request.args['antes_id']))
+        except (KeyError, ValueError):
+            return jsonify(erro="Cursor de paginação inválido."), 400
+    historico, proximo = obter_historico(card_id, antes)
+    return jsonify(
+        registros=[{'id': row['id'], 'empresa': row['empresa'], 'quantidade': row['quantidade_deduzida'], 'horario': row['horario'].isoformat()} for row in historico],
+        proximo={'antes_horario': proximo[0].isoformat(), 'antes_id': proximo[1]} if proximo else None,
+    )
+
+@app.route('/api/sincronizar', methods=['POST'])
+@requer_token
+def api_sincronizar():
+    dados = request.get_json(silent=True) or {}
+    transacoes = dados.get('transacoes')
+    if not isinstance(transacoes, list) or not all(isinstance(transacao, dict) for transacao in transacoes):
+        return jsonify(erro="Envie uma lista de transações em 'transacoes'."), 400
+    if len(transacoes) > API_LOTE_MAX:
+        return jsonify(erro=f"Máximo de {API_LOTE_MAX} transações por lote."), 400
+    try:
+        resultados = [aplicar_transacao_pos(transacao) for transacao in transacoes]
+        confirmar_transacoes_pos(resultados)
+    except psycopg.errors.DeadlockDetected:
+        get_db_connection().rollback()
+        return jsonify(erro="Conflito com outra transação, tente novamente."), 503
+    return jsonify(resultados=resultados)
+
+@app.route('/estatisticas_pool')
+def estatisticas_pool():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    return jsonify(banco.estatisticas())
+
+@app.route('/metrics')
+def metrics():
+    # O app é público: sem token configurado, as métricas não são servidas
+    if not METRICAS_TOKEN:
+        return Response("Métricas desativadas: defina METRICAS_TOKEN.\n", status=404, mimetype='text/plain')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + METRICAS_TOKEN):
+        return Response("Token inválido.\n", status=401, mimetype='text/plain')
+    return Response(exportar_metricas(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/estatisticas_cache')
+def estatisticas_cache():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    cache = get_cache()
+    with cache_contadores_trava:
+        contadores = dict(cache_contadores)
+    return jsonify(backend=CACHE_BACKEND, itens=cache.tamanho_atual() if cache else 0, **contadores)
+
+# Modo assíncrono (opcional): o servidor ASGI de asgi.py atende as rotas de
+# asgi.ROTAS_ASYNC com as funções abaixo, sobre AsyncConnection, sem ocupar
+# uma thread enquanto esperam o Postgres.
+_pool_async = None
+_pool_async_trava = asyncio.Lock()
+
+# Pool assíncrono do worker, com a mesma configuração DB_POOL_* do síncrono.
+# O pool síncrono continua existindo para as rotas delegadas ao Flask.
+async def get_pool_async():
+    global _pool_async
+    async with _pool_async_trava:
+        if _pool_async is None:
+            pool = AsyncConnectionPool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_idle=DB_POOL_MAX_IDLE,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                check=AsyncConnectionPool.check_connection if DB_POOL_CHECK else None,
+                kwargs={'row_factory': dict_row, 'cursor_factory': CursorMedidoAsync if METRICAS else psycopg.AsyncCursor},
+                name='fidelidade-async',
+                open=False,
+            )
+            await pool.open()
+            _pool_async = pool
+    return _pool_async
+
+async def fechar_pool_async():
+    global _pool_async
+    async with _pool_async_trava:
+        if _pool_async is not None:
+            await _pool_async.close()
+            _pool_async = None
+
+# Equivalente assíncrono de get_db_connection: uma conexão por requisição,
+# devolvida ao pool por asgi.despachar_async.
+async def get_db_connection_async():
+    if 'db_conn_async' not in g:
+        inicio = time.perf_counter()
+        g.db_conn_async = await (await get_pool_async()).getconn()
+        if METRICAS:
+            metricas.observar('fidelidade_conexao_espera_segundos', rotulos_metrica(pool='async'), time.perf_counter() - inicio)
+    return g.db_conn_async
+
+async def movimentar_creditos_async(card_id, quantidade, empresa_historico, horario=None):
+    conn = await get_db_connection_async()
+    c = await conn.execute(SQL_MOVIMENTAR_CREDITOS, parametros_movimentacao(card_id, quantidade, empresa_historico, horario))
+    result = await c.fetchone()
+    await conn.commit()
+    invalidar_cache_cliente(card_id)
+    return result
+
+async def processar_deducao_async(card_id, quantidade, empresa, horario=None):
+    quantidade, empresa_historico, erro = validar_deducao(quantidade, empresa)
+    if erro:
+        return 'invalido', erro, None
+    result = await movimentar_creditos_async(card_id, -quantidade, empresa_historico, horario)
+    return resultado_deducao(result, quantidade, empresa_historico)
+
+async def deduzir_credito_async(card_id, quantidade, empresa):
+    _, mensagem, info = await processar_deducao_async(card_id, quantidade, empresa)
+    return mensagem, info
+
+# O cache é consultado de forma síncrona: no backend local isso é só um
+# acesso a memória; com redis, cada chamada bloqueia o loop por um instante.
+async def buscar_info_cliente_async(card_id):
+    result = cache_obter_cliente(card_id)
+    if result is None:
+        conn = await get_db_connection_async()
+        c = await conn.execute("SELECT nome, creditos, data_expiracao, expirado FROM clientes WHERE card_id = %s", (card_id,))
+        result = await c.fetchone()
+        if result:
+            cache_guardar_cliente(card_id, result)
+    if result:
+        return formatar_info_cliente(result)
+    return "Cliente não encontrado", None, None, None
+
+# Consulta e dedução da tela principal. As demais ações (recarga, adição
+# manual, exclusão) devolvem None e são atendidas pela rota síncrona index().
+ACOES_ASYNC = ['buscar', 'mostrar_empresas', 'selecionar_empresa', 'deduzir']
+
+async def index_async():
+    if not usuario_autenticado():
+        return redirect(url_for('login'))
+    action = request.form.get('action')
+    card_id = request.form.get('card_id')
+    if request.method == 'POST' and (action not in ACOES_ASYNC or not card_id):
+        return None
+    contexto = dict(mensagem="", card_id_display="", nome="", creditos="", dias="", expiracao="", mostrar_empresas=False, mostrar_quantidade=False,
+                    empresa_selecionada="", mostrar_adicionar_credito=False, mostrar_senha_exclusao=False)
+    if request.method == 'POST':
+        empresa = request.form.get('empresa')
+        if action in ['selecionar_empresa', 'deduzir'] and empresa not in ['STOUT PIZZA', 'CHAAAMA CHOPP']:
+            contexto['mensagem'] = "Erro: Empresa inválida!"
+        elif action == 'deduzir':
+            mensagem, info = await deduzir_credito_async(card_id, request.form.get('quantidade'), empresa)
+            nome, creditos, dias, expiracao = info or await buscar_info_cliente_async(card_id)
+            contexto.update(mensagem=mensagem, card_id_display=card_id, nome=nome, creditos=creditos, dias=dias, expiracao=expiracao)
+        else:
+            nome, creditos, dias, expiracao = await buscar_info_cliente_async(card_id)
+            contexto.update(card_id_display=card_id if creditos is not None else "", nome=nome, creditos=creditos, dias=dias, expiracao=expiracao)
+            if creditos is not None and action == 'mostrar_empresas':
+                contexto['mostrar_empresas'] = True
+            elif creditos is not None and action == 'selecionar_empresa':
+                contexto.update(mostrar_quantidade=True, empresa_selecionada=empresa)
+    return renderizar_index(**contexto)
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
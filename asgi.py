@@ -0,0 +1,97 @@
+"""Modo assíncrono (opcional) do app, servido por um servidor ASGI:
+
+    uvicorn asgi:asgi_app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:asgi_app
+
+As rotas de ROTAS_ASYNC rodam no loop de eventos do servidor sobre
+AsyncConnection (as funções *_async de app.py), sem ocupar uma thread enquanto
+esperam o Postgres. As demais rotas, e as ações que as visões assíncronas
+devolvem com None, seguem para o app Flask síncrono, executado pelo
+WSGIMiddleware do a2wsgi num pool de threads.
+"""
+import io
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import g
+
+from app import (DB_POOL_MAX_SIZE, app, banco, devolver_conexao_async, fechar_pool_async, get_pool_async,
+                 index_async)
+
+ROTAS_ASYNC = {'/': index_async} if banco.assincrono else {}
+
+# Uma thread por conexão do pool síncrono
+wsgi_app = WSGIMiddleware(app, workers=DB_POOL_MAX_SIZE)
+
+
+# Executa uma visão assíncrona dentro do contexto de requisição do Flask
+# (sessão, g, url_for, render_template) e devolve a resposta pronta.
+async def despachar_async(visao, environ):
+    with app.request_context(environ):
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await visao()
+            resposta = app.process_response(app.make_response(rv)) if rv is not None else None
+        except Exception as erro:
+            resposta = app.handle_exception(erro)
+        finally:
+            conn = g.pop('db_conn_async', None)
+            if conn is not None:
+                await devolver_conexao_async(await get_pool_async(), conn)
+    return resposta
+
+
+# O corpo já lido para a visão assíncrona é entregue de novo ao app síncrono;
+# depois dele, as mensagens (http.disconnect) vêm do servidor.
+def repetir_corpo(corpo, receive):
+    entregue = False
+
+    async def receber():
+        nonlocal entregue
+        if not entregue:
+            entregue = True
+            return {'type': 'http.request', 'body': corpo, 'more_body': False}
+        return await receive()
+
+    return receber
+
+
+async def ler_corpo(receive):
+    corpo = b''
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            return None
+        corpo += mensagem.get('body', b'')
+        if not mensagem.get('more_body'):
+            return corpo
+
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                if banco.assincrono:
+                    await get_pool_async()
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                await fechar_pool_async()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    visao = ROTAS_ASYNC.get(scope['path']) if scope['type'] == 'http' else None
+    if visao is None:
+        await wsgi_app(scope, receive, send)
+        return
+    corpo = await ler_corpo(receive)
+    if corpo is None:
+        return  # o cliente desistiu antes de enviar o corpo
+    resposta = await despachar_async(visao, build_environ(scope, io.BytesIO(corpo)))
+    if resposta is None:
+        await wsgi_app(scope, repetir_corpo(corpo, receive), send)
+        return
+    await send({'type': 'http.response.start', 'status': resposta.status_code,
+                'headers': [(nome.lower().encode('latin-1'), valor.encode('latin-1'))
+                            for nome, valor in resposta.headers.to_wsgi_list()]})
+    await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else resposta.get_data()})
@@ -0,0 +1,221 @@
+"""Teste de carga da tela principal nos modos síncrono e assíncrono.
+
+Sobe o app duas vezes, com o mesmo número de workers e o mesmo DB_POOL_*:
+no modo síncrono (gunicorn app:app, workers sync) e no assíncrono (uvicorn
+asgi:asgi_app). Em cada um, usuários simultâneos fazem login e repetem o fluxo
+de consulta ("buscar") e dedução ("deduzir") em cartões CARGA*. O relatório
+traz vazão e latências p50/p99 por ação.
+
+Com --latencia-ms, as conexões do app com o Postgres passam por um proxy TCP
+que atrasa cada resposta do banco, simulando um banco lento ou distante; é
+nesse cenário que os workers síncronos ficam parados esperando.
+
+Uso (banco de testes, nunca produção; requer gunicorn e uvicorn):
+    DATABASE_URL=postgresql://... python benchmarks/carga_async.py --latencia-ms 5
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from app import app, aplicar_migracoes, get_db_connection  # noqa: E402
+
+LOGIN = 'CARGA'
+SENHA = 'carga'
+
+
+def preparar(cartoes):
+    with app.app_context():
+        aplicar_migracoes()
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("INSERT INTO usuarios (login, senha) VALUES (%s, %s) ON CONFLICT (login) DO UPDATE SET senha = EXCLUDED.senha",
+                  (LOGIN, SENHA))
+        c.execute("""
+            INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular)
+            SELECT 'Cliente Carga ' || i, 'CARGA' || i, CURRENT_DATE, 1000000000, CURRENT_DATE + 30, lpad(i::text, 11, '8')
+            FROM generate_series(1, %s) AS i
+            ON CONFLICT (card_id) DO UPDATE SET creditos = 1000000000, data_expiracao = CURRENT_DATE + 30, expirado = false
+        """, (cartoes,))
+        conn.commit()
+
+
+async def encaminhar(origem, destino, atraso):
+    try:
+        while dados := await origem.read(65536):
+            if atraso:
+                await asyncio.sleep(atraso)
+            destino.write(dados)
+            await destino.drain()
+    except ConnectionError:
+        pass
+    finally:
+        destino.close()
+
+
+async def servir_proxy(porta, host_banco, porta_banco, atraso):
+    async def conectar(leitor_app, escritor_app):
+        leitor_banco, escritor_banco = await asyncio.open_connection(host_banco, porta_banco)
+        await asyncio.gather(encaminhar(leitor_app, escritor_banco, 0),
+                             encaminhar(leitor_banco, escritor_app, atraso))
+
+    servidor = await asyncio.start_server(conectar, '127.0.0.1', porta)
+    async with servidor:
+        await servidor.serve_forever()
+
+
+def url_do_banco(args):
+    if not args.latencia_ms:
+        return os.environ.get('DATABASE_URL', '')  # vazio no modo SQLite
+    partes = urllib.parse.urlsplit(os.environ['DATABASE_URL'])
+    usuario = partes.netloc.rsplit('@', 1)[0] + '@' if '@' in partes.netloc else ''
+    return urllib.parse.urlunsplit(partes._replace(netloc=f'{usuario}127.0.0.1:{args.porta_proxy}'))
+
+
+def subir_servidor(modo, args):
+    ambiente = dict(os.environ, DATABASE_URL=url_do_banco(args), DB_POOL_MAX_SIZE=str(args.pool),
+                    CACHE_BACKEND=args.cache, PYTHONPATH=RAIZ)
+    if modo == 'sync':
+        comando = ['gunicorn', '-w', str(args.workers), '--threads', str(args.threads), '-b', f'127.0.0.1:{args.porta}',
+                   '--log-level', 'warning', 'app:app']
+    else:
+        comando = ['uvicorn', '--workers', str(args.workers), '--port', str(args.porta), '--log-level', 'warning',
+                   '--no-access-log', 'asgi:asgi_app']
+    processo = subprocess.Popen(comando, cwd=RAIZ, env=ambiente)
+    for _ in range(100):
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', args.porta, timeout=1)
+            conexao.request('GET', '/login')
+            conexao.getresponse().read()
+            return processo
+        except OSError:
+            time.sleep(0.1)
+    processo.terminate()
+    raise SystemExit(f"servidor {modo} não respondeu")
+
+
+class Usuario:
+    def __init__(self, porta):
+        self.conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+        self.cookie = ''
+
+    def requisitar(self, metodo, caminho, dados=None):
+        cabecalhos = {'Cookie': self.cookie}
+        if dados is not None:
+            cabecalhos['Content-Type'] = 'application/x-www-form-urlencoded'
+            dados = urllib.parse.urlencode(dados)
+        self.conexao.request(metodo, caminho, dados, cabecalhos)
+        resposta = self.conexao.getresponse()
+        corpo = resposta.read()
+        cookie = resposta.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return resposta.status, corpo
+
+    def post(self, caminho, dados):
+        return self.requisitar('POST', caminho, dados)
+
+    def get(self, caminho):
+        return self.requisitar('GET', caminho)
+
+
+def executar_usuario(numero, args, fim, latencias, erros):
+    usuario = Usuario(args.porta)
+    usuario.post('/login', {'login': LOGIN, 'senha': SENHA})
+    card_id = f'CARGA{1 + numero % args.cartoes}'
+    acoes = [('buscar', {'action': 'buscar', 'card_id': card_id}),
+             ('deduzir', {'action': 'deduzir', 'card_id': card_id, 'quantidade': '1', 'empresa': 'STOUT PIZZA'})]
+    while time.monotonic() < fim:
+        for acao, dados in acoes:
+            inicio = time.perf_counter()
+            try:
+                status, corpo = usuario.post('/', dados)
+                ok = status == 200 and card_id.encode() in corpo
+            except (OSError, http.client.HTTPException):
+                usuario = Usuario(args.porta)
+                usuario.post('/login', {'login': LOGIN, 'senha': SENHA})
+                ok = False
+            latencias[acao].append(time.perf_counter() - inicio)
+            if not ok:
+                erros[acao] += 1
+
+
+def rodar(args, duracao):
+    latencias = {'buscar': [], 'deduzir': []}
+    erros = {'buscar': 0, 'deduzir': 0}
+    fim = time.monotonic() + duracao
+    with ThreadPoolExecutor(max_workers=args.usuarios) as executor:
+        list(executor.map(lambda numero: executar_usuario(numero, args, fim, latencias, erros), range(args.usuarios)))
+    return latencias, erros
+
+
+def medir(modo, args):
+    processo = subir_servidor(modo, args)
+    try:
+        rodar(args, args.aquecimento)
+        latencias, erros = rodar(args, args.duracao)
+    finally:
+        processo.terminate()
+        processo.wait()
+    resultado = {}
+    for acao, valores in latencias.items():
+        valores.sort()
+        resultado[acao] = {
+            'requisicoes': len(valores),
+            'por_segundo': round(len(valores) / args.duracao, 1),
+            'p50_ms': round(statistics.median(valores) * 1000, 2) if valores else None,
+            'p99_ms': round(valores[int(len(valores) * 0.99) - 1] * 1000, 2) if valores else None,
+            'erros': erros[acao],
+        }
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modos', default='sync,async')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1, help='threads por worker no modo síncrono')
+    parser.add_argument('--pool', type=int, default=10, help='DB_POOL_MAX_SIZE dos dois modos')
+    parser.add_argument('--usuarios', type=int, default=32, help='usuários simultâneos')
+    parser.add_argument('--cartoes', type=int, default=200)
+    parser.add_argument('--duracao', type=float, default=15, help='segundos medidos por modo')
+    parser.add_argument('--aquecimento', type=float, default=3)
+    parser.add_argument('--latencia-ms', type=float, default=0, help='atraso em cada resposta do Postgres')
+    parser.add_argument('--cache', default='desligado', help='CACHE_BACKEND dos servidores')
+    parser.add_argument('--porta', type=int, default=8350)
+    parser.add_argument('--porta-proxy', type=int, default=8351)
+    parser.add_argument('--json', help='grava o resultado neste arquivo')
+    args = parser.parse_args()
+
+    preparar(args.cartoes)
+    if args.latencia_ms:
+        banco = urllib.parse.urlsplit(os.environ['DATABASE_URL'])
+        proxy = threading.Thread(target=asyncio.run, daemon=True,
+                                 args=(servir_proxy(args.porta_proxy, banco.hostname or 'localhost', banco.port or 5432,
+                                                    args.latencia_ms / 1000),))
+        proxy.start()
+
+    resultados = {modo: medir(modo, args) for modo in args.modos.split(',')}
+
+    print(f"{'modo':<6} {'ação':<8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for modo, acoes in resultados.items():
+        for acao, r in acoes.items():
+            print(f"{modo:<6} {acao:<8} {r['por_segundo']:>8} {r['p50_ms']:>8} {r['p99_ms']:>8} {r['erros']:>6}")
+    if args.json:
+        with open(args.json, 'w') as arquivo:
+            json.dump({'parametros': vars(args), 'resultados': resultados}, arquivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
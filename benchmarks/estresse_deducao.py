@@ -0,0 +1,68 @@
+"""Teste de estresse da dedução de créditos.
+
+Dispara centenas de deduções simultâneas contra um único cartão e confere que
+o saldo nunca fica negativo e que o histórico bate com o saldo final.
+
+Uso (banco de testes, nunca produção):
+    DATABASE_URL=postgresql://... DB_POOL_MAX_SIZE=20 python benchmarks/estresse_deducao.py
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, deduzir_credito, get_db_connection  # noqa: E402
+
+CARD_ID = 'CARDESTRESSE'
+
+
+def preparar_cartao(creditos_iniciais):
+    with app.app_context():
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("DELETE FROM pedidos WHERE card_id = %s", (CARD_ID,))
+        c.execute("DELETE FROM clientes WHERE card_id = %s", (CARD_ID,))
+        c.execute("INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular) "
+                  "VALUES (%s, %s, CURRENT_DATE, %s, CURRENT_DATE + 30, %s)",
+                  ('Cliente Estresse', CARD_ID, creditos_iniciais, '00000000000'))
+        conn.commit()
+
+
+def deduzir(quantidade):
+    with app.app_context():
+        mensagem, _ = deduzir_credito(CARD_ID, quantidade, 'STOUT PIZZA')
+        return 'deduzido' in mensagem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--creditos', type=int, default=100)
+    parser.add_argument('--deducoes', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--quantidade', type=int, default=1)
+    args = parser.parse_args()
+
+    preparar_cartao(args.creditos)
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        resultados = list(executor.map(deduzir, [args.quantidade] * args.deducoes))
+    sucessos = sum(resultados)
+
+    with app.app_context():
+        c = get_db_connection().cursor()
+        c.execute("SELECT creditos FROM clientes WHERE card_id = %s", (CARD_ID,))
+        saldo_final = c.fetchone()['creditos']
+        c.execute("SELECT COALESCE(SUM(quantidade_deduzida), 0) AS total FROM pedidos WHERE card_id = %s", (CARD_ID,))
+        total_historico = c.fetchone()['total']
+
+    print(f"deduções aceitas: {sucessos}/{args.deducoes}, saldo final: {saldo_final}")
+    assert saldo_final >= 0, "saldo negativo"
+    assert saldo_final == args.creditos - sucessos * args.quantidade, "atualização perdida"
+    assert total_historico == -sucessos * args.quantidade, "histórico não confere com o saldo"
+    assert sucessos == min(args.deducoes, args.creditos // args.quantidade), "deduções válidas recusadas"
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Compara a tela principal renderizada inteira e em fragmentos, passo a passo.
+
+Repete o fluxo de dedução (buscar, mostrar_empresas, selecionar_empresa,
+deduzir) pelo cliente de testes do Flask, uma vez como o navegador sem
+JavaScript (index.html inteiro a cada passo) e outra como o fragmentos.js
+(cabeçalho X-Fragmento: só a mensagem e o painel do cliente). Para cada passo
+o relatório traz a mediana do tempo no servidor, a do tempo de renderização
+do template e os bytes da resposta. Em seguida lista os arquivos de static/
+usados pela página, com o tamanho enviado com e sem gzip e o Cache-Control.
+
+Uso (banco de testes, nunca produção):
+    DATABASE_URL=postgresql://... python benchmarks/fragmentos.py
+    python benchmarks/fragmentos.py --banco sqlite
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from suite_desempenho import sqlite_temporario  # noqa: E402
+
+LOGIN = 'FRAGMENTO'
+SENHA = 'fragmento'
+CARTAO = 'CARDFRAG1'
+EMPRESA = 'STOUT PIZZA'
+PASSOS = [
+    ('buscar', {'action': 'buscar', 'card_id': CARTAO}),
+    ('mostrar_empresas', {'action': 'mostrar_empresas', 'card_id': CARTAO}),
+    ('selecionar_empresa', {'action': 'selecionar_empresa', 'card_id': CARTAO, 'empresa': EMPRESA}),
+    ('deduzir', {'action': 'deduzir', 'card_id': CARTAO, 'empresa': EMPRESA, 'quantidade': '1'}),
+]
+
+
+def preparar(app, aplicar_migracoes, get_db_connection):
+    with app.app_context():
+        aplicar_migracoes()
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute("INSERT INTO usuarios (login, senha) VALUES (%s, %s) ON CONFLICT (login) DO UPDATE SET senha = excluded.senha",
+                  (LOGIN, SENHA))
+        c.execute("INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular) "
+                  "VALUES ('Cliente Fragmento', %s, %s, 1000000000, %s, '11988887777') "
+                  "ON CONFLICT (card_id) DO UPDATE SET creditos = 1000000000, data_expiracao = excluded.data_expiracao, expirado = false",
+                  (CARTAO, date.today(), date.today() + timedelta(days=30)))
+        conn.commit()
+
+
+def medir(app, cliente, repeticoes, fragmento):
+    from flask import before_render_template, template_rendered
+
+    renderizacoes = []
+
+    def iniciar(sender, template, context, **extra):
+        renderizacoes.append(time.perf_counter())
+
+    def terminar(sender, template, context, **extra):
+        renderizacoes[-1] = time.perf_counter() - renderizacoes[-1]
+
+    cabecalhos = {'X-Fragmento': '1'} if fragmento else {}
+    resultado = {passo: {'servidor': [], 'template': [], 'bytes': 0} for passo, _ in PASSOS}
+    with before_render_template.connected_to(iniciar, app), template_rendered.connected_to(terminar, app):
+        for _ in range(repeticoes):
+            for passo, dados in PASSOS:
+                renderizacoes.clear()
+                inicio = time.perf_counter()
+                resposta = cliente.post('/', data=dados, headers=cabecalhos)
+                resultado[passo]['servidor'].append(time.perf_counter() - inicio)
+                if resposta.status_code != 200 or CARTAO.encode() not in resposta.data:
+                    raise SystemExit(f"resposta inesperada no passo {passo}: {resposta.status_code}")
+                resultado[passo]['template'].append(sum(renderizacoes))
+                resultado[passo]['bytes'] = len(resposta.data)
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--banco', choices=['postgres', 'sqlite'], default='postgres',
+                        help='sqlite usa um arquivo temporário; postgres usa DATABASE_URL')
+    parser.add_argument('--repeticoes', type=int, default=200, help='vezes que o fluxo é repetido em cada modo')
+    args = parser.parse_args()
+
+    if args.banco == 'postgres' and not os.environ.get('DATABASE_URL'):
+        raise SystemExit("defina DATABASE_URL (banco de testes) ou use --banco sqlite")
+    with sqlite_temporario() as arquivo:
+        # Lidas pelo app na importação
+        os.environ.update(BANCO=args.banco, SQLITE_PATH=arquivo, CACHE_BACKEND='desligado', METRICAS='0')
+        from app import app, aplicar_migracoes, get_db_connection
+
+        preparar(app, aplicar_migracoes, get_db_connection)
+        cliente = app.test_client()
+        cliente.post('/login', data={'login': LOGIN, 'senha': SENHA})
+        medir(app, cliente, 5, False)  # aquecimento: templates compilados, conexões abertas
+        completo = medir(app, cliente, args.repeticoes, False)
+        fragmento = medir(app, cliente, args.repeticoes, True)
+        pagina = cliente.get('/').data
+        estaticos = []
+        for url in sorted(set(re.findall(rb'/static/[^\'")\s]+', pagina))):
+            url = url.decode()
+            simples = cliente.get(url)
+            compactado = cliente.get(url, headers={'Accept-Encoding': 'gzip'})
+            estaticos.append((url.split('?')[0], len(simples.data), len(compactado.data),
+                              compactado.headers.get('Cache-Control', '')))
+
+    def ms(valores):
+        return statistics.median(valores) * 1000
+
+    print(f"{'passo':<20} {'servidor ms':>19} {'template ms':>19} {'bytes':>17}")
+    print(f"{'':<20} {'inteira':>9} {'fragm.':>9} {'inteira':>9} {'fragm.':>9} {'inteira':>8} {'fragm.':>8}")
+    for passo, _ in PASSOS:
+        a, b = completo[passo], fragmento[passo]
+        print(f"{passo:<20} {ms(a['servidor']):>9.2f} {ms(b['servidor']):>9.2f} "
+              f"{ms(a['template']):>9.3f} {ms(b['template']):>9.3f} {a['bytes']:>8} {b['bytes']:>8}")
+    print()
+    print(f"{'arquivo':<28} {'bytes':>8} {'gzip':>8}  cache-control")
+    for url, simples, compactado, cache in estaticos:
+        print(f"{url:<28} {simples:>8} {compactado:>8}  {cache}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Planos e tempos das consultas mais frequentes, com e sem os índices.
+
+Popula o banco com clientes e pedidos fictícios (cartões CARDBENCH*, com
+horários concentrados nos meses mais recentes), aplica as migrações e roda
+EXPLAIN (ANALYZE, BUFFERS) em cada consulta duas vezes: com os índices das
+migrações e com eles removidos dentro de uma transação desfeita em seguida.
+
+Uso (banco de testes, nunca produção):
+    DATABASE_URL=postgresql://... python benchmarks/plano_consultas.py --pedidos 1000000
+"""
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import TAMANHO_PAGINA_HISTORICO, app, aplicar_migracoes, get_db_connection  # noqa: E402
+
+CONSULTAS = [
+    # As mesmas duas consultas de obter_historico: a primeira página e as
+    # seguintes, por keyset a partir do último (horario, id) exibido.
+    ('historico, primeira página (obter_historico)',
+     "SELECT id, empresa, quantidade_deduzida, horario FROM pedidos WHERE card_id = %(card_id)s"
+     " ORDER BY horario DESC, id DESC LIMIT %(limite)s"),
+    ('historico, página seguinte (obter_historico)',
+     "SELECT id, empresa, quantidade_deduzida, horario FROM pedidos WHERE card_id = %(card_id)s"
+     " AND horario <= %(antes_horario)s AND (horario, id) < (%(antes_horario)s, %(antes_id)s)"
+     " ORDER BY horario DESC, id DESC LIMIT %(limite)s"),
+    ('cliente por celular (/cliente)',
+     "SELECT * FROM clientes WHERE celular_digitos = %(celular)s"),
+    ('autocompletar por início do nome',
+     "SELECT card_id FROM clientes WHERE nome_busca LIKE %(nome)s ORDER BY nome_busca LIMIT 10"),
+    ('autocompletar por palavra do nome',
+     "SELECT card_id FROM (SELECT nome_busca, card_id FROM clientes"
+     " WHERE to_tsvector('simple', nome_busca) @@ to_tsquery('simple', %(palavras)s) OFFSET 0) AS palavras"
+     " ORDER BY nome_busca LIMIT 10"),
+    ('autocompletar por início do card_id',
+     'SELECT card_id FROM clientes WHERE card_id COLLATE "C" LIKE %(prefixo)s ORDER BY card_id COLLATE "C" LIMIT 10'),
+    ('exclusão do histórico (excluir_cliente)',
+     "DELETE FROM pedidos WHERE card_id = %(card_id)s"),
+]
+
+INDICES = ['pedidos_card_id_horario_id_idx', 'clientes_celular_digitos_idx', 'clientes_nome_busca_idx',
+           'clientes_nome_palavras_idx', 'clientes_card_id_prefixo_idx']
+
+
+def popular(c, clientes, pedidos):
+    c.execute("""
+        INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular)
+        SELECT 'Cliente ' || i, 'CARDBENCH' || i, CURRENT_DATE, 10, CURRENT_DATE + 30, lpad(i::text, 11, '9')
+        FROM generate_series(1, %s) AS i
+        ON CONFLICT (card_id) DO NOTHING
+    """, (clientes,))
+    c.execute("SELECT count(*) AS total FROM pedidos WHERE card_id LIKE 'CARDBENCH%%'")
+    faltando = pedidos - c.fetchone()['total']
+    if faltando > 0:
+        c.execute("""
+            INSERT INTO pedidos (card_id, empresa, quantidade_deduzida, horario)
+            SELECT 'CARDBENCH' || n,
+                   (ARRAY['STOUT PIZZA', 'CHAMA', 'Adição Manual'])[1 + (random() * 2.2)::int],
+                   -1 - (random() * 3)::int,
+                   now() - random() ^ 3 * interval '730 days'
+            FROM (SELECT 1 + (random() * (%s - 1))::int AS n FROM generate_series(1, %s)) AS s
+        """, (clientes, faltando))
+    c.execute("ANALYZE clientes")
+    c.execute("ANALYZE pedidos")
+
+
+def explicar(c, sql, parametros):
+    c.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, parametros)
+    plano = "\n".join(linha['QUERY PLAN'] for linha in c.fetchall())
+    tempo = float(re.search(r'Execution Time: ([\d.]+) ms', plano).group(1))
+    return plano, tempo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clientes', type=int, default=50000)
+    parser.add_argument('--pedidos', type=int, default=1000000)
+    parser.add_argument('--planos', action='store_true', help='imprime os planos completos')
+    args = parser.parse_args()
+
+    with app.app_context():
+        aplicar_migracoes()
+        conn = get_db_connection()
+        c = conn.cursor()
+        popular(c, args.clientes, args.pedidos)
+        conn.commit()
+
+        # Um cartão com histórico típico, o celular e o nome correspondentes.
+        c.execute("SELECT card_id FROM pedidos WHERE card_id LIKE 'CARDBENCH%%' LIMIT 1")
+        card_id = c.fetchone()['card_id']
+        c.execute("SELECT celular_digitos, nome_busca FROM clientes WHERE card_id = %s", (card_id,))
+        cliente = c.fetchone()
+        # O cursor da segunda página do histórico: o último registro da primeira,
+        # ou o do meio se o cartão tiver menos de duas páginas (a consulta ainda
+        # devolve linhas).
+        c.execute("SELECT horario, id FROM pedidos WHERE card_id = %s ORDER BY horario DESC, id DESC", (card_id,))
+        historico = c.fetchall()
+        antes = historico[max(1, min(TAMANHO_PAGINA_HISTORICO, len(historico) // 2)) - 1]
+        parametros = {'card_id': card_id, 'celular': cliente['celular_digitos'], 'nome': cliente['nome_busca'] + '%',
+                      'palavras': ' & '.join(palavra + ':*' for palavra in cliente['nome_busca'].split()[1:]),
+                      'prefixo': card_id[:-1] + '%', 'limite': TAMANHO_PAGINA_HISTORICO + 1,
+                      'antes_horario': antes['horario'], 'antes_id': antes['id']}
+
+        resultados = []
+        for nome, sql in CONSULTAS:
+            # Cada execução é desfeita para que o DELETE encontre as mesmas linhas.
+            explicar(c, sql, parametros)  # aquece o cache
+            conn.rollback()
+            plano_com, com_indice = explicar(c, sql, parametros)
+            conn.rollback()
+            for indice in INDICES:
+                c.execute(f"DROP INDEX IF EXISTS {indice}")
+            plano_sem, sem_indice = explicar(c, sql, parametros)
+            conn.rollback()
+            resultados.append((nome, com_indice, sem_indice))
+            if args.planos:
+                print(f"== {nome} (com índices)\n{plano_com}\n== {nome} (sem índices)\n{plano_sem}\n")
+
+    print(f"{'consulta':45} {'com índices':>14} {'sem índices':>14}")
+    for nome, com_indice, sem_indice in resultados:
+        print(f"{nome:45} {com_indice:>11.3f} ms {sem_indice:>11.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Verifica o roteamento de leituras para réplicas contra um par local descartável.
+
+Cria um Postgres primário temporário (como a suíte de desempenho; defina
+PG_BIN se initdb/pg_ctl/pg_basebackup não estiverem no PATH) e uma réplica em
+streaming dele (pg_basebackup -R) na porta seguinte, sobe o app com
+DATABASE_REPLICAS apontando para a réplica e confere, pelo cliente de testes
+do Flask e pelas estatísticas dos pools:
+
+- /consulta e /historico são lidos da réplica;
+- uma dedução e as leituras seguintes do mesmo usuário, dentro de
+  REPLICA_ATRASO_MAX, ficam no primário;
+- com a réplica parada, as mesmas páginas continuam respondendo pelo primário.
+
+O relatório traz o atraso medido da réplica e o tempo de cada leitura.
+
+Uso (o initdb não roda como root):
+    python benchmarks/replicas_locais.py
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from suite_desempenho import postgres_temporario  # noqa: E402
+
+LOGIN = 'REPLICA'
+SENHA = 'replica'
+CARTAO = 'CARDREPLICA1'
+
+
+@contextmanager
+def replica_temporaria(porta_primario, porta):
+    pg_bin = os.environ.get('PG_BIN')
+    pg_basebackup = os.path.join(pg_bin, 'pg_basebackup') if pg_bin else shutil.which('pg_basebackup')
+    if not pg_basebackup or not os.path.exists(pg_basebackup):
+        raise SystemExit("pg_basebackup não encontrado: defina PG_BIN")
+    pg_ctl = os.path.join(os.path.dirname(pg_basebackup), 'pg_ctl')
+    diretorio = tempfile.mkdtemp(prefix='fidelidade-replica-')
+    dados = os.path.join(diretorio, 'dados')
+    try:
+        subprocess.run([pg_basebackup, '-D', dados, '-R', '-X', 'stream', '-h', '127.0.0.1', '-p', str(porta_primario),
+                        '-U', 'postgres'], check=True)
+        log = os.path.join(diretorio, 'postgres.log')
+        inicio = subprocess.run([pg_ctl, '-D', dados, '-l', log, '-w',
+                                 '-o', f'-p {porta} -k {diretorio} -c listen_addresses=127.0.0.1 -c max_connections=200', 'start'],
+                                stdout=subprocess.DEVNULL)
+        if inicio.returncode != 0:
+            with open(log) as arquivo:
+                raise SystemExit("a réplica temporária não iniciou:\n" + arquivo.read())
+
+        def parar():
+            subprocess.run([pg_ctl, '-D', dados, '-m', 'immediate', '-w', 'stop'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            yield f'postgresql://postgres@127.0.0.1:{porta}/postgres', parar
+        finally:
+            parar()
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def aguardar(condicao, descricao, limite=30):
+    fim = time.monotonic() + limite
+    while not condicao():
+        if time.monotonic() > fim:
+            raise SystemExit(f"tempo esgotado esperando: {descricao}")
+        time.sleep(0.1)
+
+
+def pedidos_ao_pool(pool):
+    return pool.get_stats().get('requests_num', 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--porta', type=int, default=5460, help='porta do primário; a réplica usa a seguinte')
+    parser.add_argument('--atraso-max', type=float, default=3, help='REPLICA_ATRASO_MAX do app, em segundos')
+    args = parser.parse_args()
+
+    with postgres_temporario(args.porta) as url_primario, \
+            replica_temporaria(args.porta, args.porta + 1) as (url_replica, parar_replica):
+        # Lidas pelo app na importação
+        os.environ.update(DATABASE_URL=url_primario, DATABASE_REPLICAS=url_replica, BANCO='postgres',
+                          CACHE_BACKEND='desligado', REPLICA_ATRASO_MAX=str(args.atraso_max),
+                          REPLICA_VERIFICACAO='0.5', DB_POOL_TIMEOUT='2')
+        from app import app, aplicar_migracoes, get_db_connection, get_pool, get_replicas
+
+        with app.app_context():
+            aplicar_migracoes()
+            conn = get_db_connection()
+            c = conn.cursor()
+            c.execute("INSERT INTO usuarios (login, senha) VALUES (%s, %s)", (LOGIN, SENHA))
+            c.execute("INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular) "
+                      "VALUES ('Cliente Réplica', %s, CURRENT_DATE, 10, CURRENT_DATE + 30, '11999990000')", (CARTAO,))
+            c.execute("INSERT INTO pedidos (card_id, empresa, quantidade_deduzida) VALUES (%s, 'STOUT PIZZA', -1)",
+                      (CARTAO,))
+            conn.commit()
+
+        replica = get_replicas()[0]
+        aguardar(lambda: replica.saudavel, "réplica saudável")
+
+        def cartao_na_replica():
+            with replica.pool.connection() as conn_replica:
+                return conn_replica.execute("SELECT 1 FROM clientes WHERE card_id = %s", (CARTAO,)).fetchone()
+        aguardar(cartao_na_replica, "cartão replicado")
+
+        cliente = app.test_client()
+        cliente.post('/login', data={'login': LOGIN, 'senha': SENHA})
+
+        def liberar_janela():
+            with cliente.session_transaction() as sessao:
+                sessao.pop('primario_ate', None)
+
+        def ler(descricao, metodo, caminho, esperado, dados=None):
+            primario, secundario = pedidos_ao_pool(get_pool()), pedidos_ao_pool(replica.pool)
+            inicio = time.perf_counter()
+            resposta = cliente.open(caminho, method=metodo, data=dados)
+            duracao = (time.perf_counter() - inicio) * 1000
+            if pedidos_ao_pool(replica.pool) > secundario:
+                origem = 'réplica'
+            elif pedidos_ao_pool(get_pool()) > primario:
+                origem = 'primário'
+            else:
+                origem = 'nenhum'
+            ok = resposta.status_code == 200 and origem == esperado
+            print(f"{'ok ' if ok else 'ERRO'} {descricao:<42} {resposta.status_code} {origem:<9} {duracao:>7.1f} ms")
+            return ok
+
+        consulta = ('GET', '/consulta')
+        historico = ('POST', '/historico', {'action': 'buscar_historico', 'card_id': CARTAO})
+        deduzir = ('POST', '/', {'action': 'deduzir', 'card_id': CARTAO, 'quantidade': '1', 'empresa': 'STOUT PIZZA'})
+
+        liberar_janela()  # o login marcou a sessão
+        resultados = [
+            ler('consulta', *consulta[:2], 'réplica'),
+            ler('histórico', *historico[:2], 'réplica', historico[2]),
+            ler('dedução', *deduzir[:2], 'primário', deduzir[2]),
+            ler('histórico logo após a dedução', *historico[:2], 'primário', historico[2]),
+            ler('consulta logo após a dedução', *consulta[:2], 'primário'),
+        ]
+        time.sleep(args.atraso_max)
+        resultados.append(ler(f'histórico {args.atraso_max:g} s após a dedução', *historico[:2], 'réplica', historico[2]))
+        print(f"atraso da réplica: {replica.atraso} s")
+
+        parar_replica()
+        aguardar(lambda: not replica.saudavel, "réplica marcada como indisponível")
+        resultados += [
+            ler('consulta com a réplica parada', *consulta[:2], 'primário'),
+            ler('histórico com a réplica parada', *historico[:2], 'primário', historico[2]),
+        ]
+
+    if not all(resultados):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""Suíte de desempenho reproduzível contra um banco local descartável.
+
+Cria um cluster Postgres temporário (initdb/pg_ctl; defina PG_BIN se não
+estiverem no PATH) ou, com --banco sqlite, um arquivo SQLite temporário,
+aplica as migrações, popula clientes e pedidos fictícios (cartões CARDBENCH*,
+com horários concentrados nos meses recentes), sobe o app com gunicorn e mede
+cada cenário com usuários simultâneos: login, buscar e deduzir em /,
+/historico, /consulta e /cliente (busca por celular). Os mesmos cenários, com
+as mesmas verificações das respostas, rodam nos dois bancos; comparar as duas
+execuções mostra qual atende melhor uma loja.
+
+Para cada cenário o relatório traz vazão, latências p50/p95/p99, erros e
+consultas ao banco por requisição (lidas de /metrics). Com --baseline, o
+resultado é comparado ao arquivo JSON indicado e o script sai com código 1
+se houver regressão; se o arquivo não existir (ou com --salvar), o resultado
+atual é gravado nele como nova referência.
+
+Uso (o initdb não roda como root):
+    python benchmarks/suite_desempenho.py --baseline benchmarks/baseline.json
+    python benchmarks/suite_desempenho.py --database-url postgresql://.../banco_de_testes
+    python benchmarks/suite_desempenho.py --banco sqlite --baseline benchmarks/baseline_sqlite.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+LOGIN = 'BENCH'
+SENHA = 'bench'
+EMPRESAS = ['STOUT PIZZA', 'CHAAAMA CHOPP']
+
+
+# Cada cenário recebe o usuário (já logado), o número do cartão sorteado e
+# devolve se a resposta é a esperada.
+def cenario_login(usuario, numero):
+    status, _ = usuario.post('/login', {'login': LOGIN, 'senha': SENHA})
+    return status == 302
+
+
+def cenario_buscar(usuario, numero):
+    status, corpo = usuario.post('/', {'action': 'buscar', 'card_id': f'CARDBENCH{numero}'})
+    return status == 200 and f'CARDBENCH{numero}'.encode() in corpo
+
+
+def cenario_deduzir(usuario, numero):
+    status, corpo = usuario.post('/', {'action': 'deduzir', 'card_id': f'CARDBENCH{numero}', 'quantidade': '1',
+                                       'empresa': EMPRESAS[numero % 2]})
+    return status == 200 and 'deduzido(s)'.encode() in corpo
+
+
+def cenario_historico(usuario, numero):
+    status, corpo = usuario.post('/historico', {'action': 'buscar_historico', 'card_id': f'CARDBENCH{numero}'})
+    return status == 200 and (b'<td' in corpo or 'Nenhum histórico'.encode() in corpo)
+
+
+def cenario_consulta(usuario, numero):
+    status, corpo = usuario.get('/consulta')
+    return status == 200 and b'CARDBENCH' in corpo
+
+
+def cenario_cliente(usuario, numero):
+    # lpad com '9' repete celulares (9, 99, 999...), então basta achar algum cartão
+    status, corpo = usuario.post('/cliente', {'celular': str(numero).rjust(11, '9')})
+    return status == 200 and b'CARDBENCH' in corpo
+
+
+CENARIOS = {
+    'login': cenario_login,
+    'buscar': cenario_buscar,
+    'deduzir': cenario_deduzir,
+    'historico': cenario_historico,
+    'consulta': cenario_consulta,
+    'cliente': cenario_cliente,
+}
+
+
+@contextmanager
+def postgres_temporario(porta):
+    pg_bin = os.environ.get('PG_BIN')
+    initdb = os.path.join(pg_bin, 'initdb') if pg_bin else shutil.which('initdb')
+    if not initdb or not os.path.exists(initdb):
+        raise SystemExit("initdb não encontrado: defina PG_BIN ou use --database-url")
+    pg_ctl = os.path.join(os.path.dirname(initdb), 'pg_ctl')
+    diretorio = tempfile.mkdtemp(prefix='fidelidade-bench-')
+    dados = os.path.join(diretorio, 'dados')
+    try:
+        subprocess.run([initdb, '-D', dados, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--no-locale'],
+                       check=True, stdout=subprocess.DEVNULL)
+        log = os.path.join(diretorio, 'postgres.log')
+        inicio = subprocess.run([pg_ctl, '-D', dados, '-l', log, '-w',
+                                 '-o', f'-p {porta} -k {diretorio} -c listen_addresses=127.0.0.1 -c max_connections=200', 'start'],
+                                stdout=subprocess.DEVNULL)
+        if inicio.returncode != 0:
+            with open(log) as arquivo:
+                raise SystemExit("o Postgres temporário não iniciou:\n" + arquivo.read())
+        try:
+            yield f'postgresql://postgres@127.0.0.1:{porta}/postgres'
+        finally:
+            subprocess.run([pg_ctl, '-D', dados, '-m', 'fast', '-w', 'stop'], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+@contextmanager
+def sqlite_temporario():
+    diretorio = tempfile.mkdtemp(prefix='fidelidade-bench-')
+    try:
+        yield os.path.join(diretorio, 'fidelidade.db')
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+# Mesmos dados de plano_consultas.popular, sorteados em Python (o SQLite não
+# tem generate_series nem random() com semente).
+def popular_sqlite(c, clientes, pedidos, semente):
+    sorteio = random.Random(semente)
+    hoje = date.today()
+    agora = datetime.now()
+    c.executemany("INSERT INTO clientes (nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular) "
+                  "VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (card_id) DO NOTHING",
+                  ((f'Cliente {i}', f'CARDBENCH{i}', hoje, 10, hoje + timedelta(days=30), str(i).rjust(11, '9'))
+                   for i in range(1, clientes + 1)))
+    c.executemany("INSERT INTO pedidos (card_id, empresa, quantidade_deduzida, horario) VALUES (%s, %s, %s, %s)",
+                  ((f'CARDBENCH{sorteio.randint(1, clientes)}',
+                    sorteio.choices(['STOUT PIZZA', 'CHAMA', 'Adição Manual'], [0.23, 0.45, 0.32])[0],
+                    -1 - round(sorteio.random() * 3),
+                    agora - timedelta(days=730 * sorteio.random() ** 3))
+                   for _ in range(pedidos)))
+    c.execute("ANALYZE")
+
+
+def preparar(clientes, pedidos, semente):
+    from app import BANCO, app, aplicar_migracoes, get_db_connection
+    from plano_consultas import popular
+
+    with app.app_context():
+        aplicar_migracoes()
+        conn = get_db_connection()
+        c = conn.cursor()
+        if BANCO == 'sqlite':
+            popular_sqlite(c, clientes, pedidos, semente)
+        else:
+            c.execute("SELECT setseed(%s)", (semente % 1000 / 1000,))  # mesmos dados a cada execução
+            popular(c, clientes, pedidos)
+        # Saldo alto para que as deduções da medição nunca sejam recusadas
+        c.execute("UPDATE clientes SET creditos = 1000000000, data_expiracao = %s, expirado = false "
+                  "WHERE card_id LIKE 'CARDBENCH%%'", (date.today() + timedelta(days=30),))
+        c.execute("INSERT INTO usuarios (login, senha) VALUES (%s, %s) ON CONFLICT (login) DO UPDATE SET senha = EXCLUDED.senha",
+                  (LOGIN, SENHA))
+        conn.commit()
+        c.execute("SELECT 'SQLite ' || sqlite_version() AS versao" if BANCO == 'sqlite' else "SELECT version() AS versao")
+        return c.fetchone()['versao']
+
+
+# Totais acumulados de consultas e requisições em /metrics (sem as de
+# verificação do pool e sem as requisições ao próprio /metrics)
+def raspar_metricas(porta):
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    conexao.request('GET', '/metrics', headers={'Authorization': 'Bearer ' + os.environ['METRICAS_TOKEN']})
+    corpo = conexao.getresponse().read()
+    consultas = requisicoes = 0
+    for linha in corpo.decode().splitlines():
+        if linha.startswith('fidelidade_consulta_segundos_count') and 'verificacao_pool' not in linha:
+            consultas += float(linha.rsplit(' ', 1)[1])
+        elif linha.startswith('fidelidade_requisicoes_total{') and 'rota="/metrics"' not in linha:
+            requisicoes += float(linha.rsplit(' ', 1)[1])
+    return consultas, requisicoes
+
+
+def percentil(valores, fracao):
+    return round(valores[max(0, int(len(valores) * fracao) - 1)] * 1000, 2)
+
+
+def medir_cenario(nome, args):
+    from carga_async import Usuario
+
+    funcao = CENARIOS[nome]
+    usuarios = []
+    for _ in range(args.usuarios):
+        usuario = Usuario(args.porta)
+        usuario.post('/login', {'login': LOGIN, 'senha': SENHA})
+        usuarios.append(usuario)
+    latencias = []
+    erros = 0
+    trava = threading.Lock()
+
+    def executar(indice, fim):
+        nonlocal erros
+        sorteio = random.Random(args.semente * 1000 + indice)
+        while time.monotonic() < fim:
+            numero = sorteio.randint(1, args.clientes)
+            inicio = time.perf_counter()
+            try:
+                ok = funcao(usuarios[indice], numero)
+            except OSError:
+                usuarios[indice] = Usuario(args.porta)
+                usuarios[indice].post('/login', {'login': LOGIN, 'senha': SENHA})
+                ok = False
+            duracao = time.perf_counter() - inicio
+            with trava:
+                latencias.append(duracao)
+                erros += not ok
+
+    def rodar(duracao):
+        fim = time.monotonic() + duracao
+        with ThreadPoolExecutor(max_workers=args.usuarios) as executor:
+            list(executor.map(lambda indice: executar(indice, fim), range(args.usuarios)))
+
+    rodar(args.aquecimento)
+    latencias.clear()
+    erros = 0
+    time.sleep(1.2)  # os workers gravam as métricas a cada segundo
+    consultas_antes, requisicoes_antes = raspar_metricas(args.porta)
+    rodar(args.duracao)
+    time.sleep(1.2)
+    consultas_depois, requisicoes_depois = raspar_metricas(args.porta)
+
+    latencias.sort()
+    requisicoes_servidor = requisicoes_depois - requisicoes_antes
+    return {
+        'requisicoes': len(latencias),
+        'por_segundo': round(len(latencias) / args.duracao, 1),
+        'p50_ms': percentil(latencias, 0.50),
+        'p95_ms': percentil(latencias, 0.95),
+        'p99_ms': percentil(latencias, 0.99),
+        'erros': erros,
+        'consultas_por_requisicao': round((consultas_depois - consultas_antes) / requisicoes_servidor, 2) if requisicoes_servidor else None,
+    }
+
+
+# Regressão: vazão ou p95 piores que a tolerância, qualquer aumento de
+# consultas por requisição (que não depende da máquina) ou erros novos.
+def comparar(resultados, referencia, tolerancia):
+    regressoes = []
+    for nome, atual in resultados.items():
+        base = referencia.get(nome)
+        if not base:
+            continue
+        if atual['por_segundo'] < base['por_segundo'] * (1 - tolerancia):
+            regressoes.append(f"{nome}: vazão {atual['por_segundo']} req/s (referência {base['por_segundo']})")
+        if atual['p95_ms'] > base['p95_ms'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p95 {atual['p95_ms']} ms (referência {base['p95_ms']})")
+        if (atual['consultas_por_requisicao'] or 0) > (base['consultas_por_requisicao'] or 0) + 0.05:
+            regressoes.append(f"{nome}: {atual['consultas_por_requisicao']} consultas por requisição "
+                              f"(referência {base['consultas_por_requisicao']})")
+        if atual['erros'] > base['erros']:
+            regressoes.append(f"{nome}: {atual['erros']} erros (referência {base['erros']})")
+    return regressoes
+
+
+# "ambiente" traz as variáveis que escolhem o banco (DATABASE_URL ou
+# BANCO/SQLITE_PATH), valendo para a preparação e para o servidor.
+def executar_suite(args, ambiente):
+    os.environ.update(ambiente)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from carga_async import subir_servidor
+
+    versao_banco = preparar(args.clientes, args.pedidos, args.semente)
+    metricas_dir = tempfile.mkdtemp(prefix='fidelidade-metricas-')
+    os.environ.update(METRICAS='1', METRICAS_DIR=metricas_dir, METRICAS_TOKEN=secrets.token_hex(16))
+    cache = args.cache or ('desligado' if args.banco == 'sqlite' else 'local')  # o padrão do app em cada banco
+    servidor = argparse.Namespace(porta=args.porta, workers=args.workers, threads=args.threads, pool=args.pool,
+                                  cache=cache, latencia_ms=0)
+    processo = subir_servidor('sync', servidor)
+    try:
+        resultados = {nome: medir_cenario(nome, args) for nome in args.cenarios.split(',')}
+    finally:
+        processo.terminate()
+        processo.wait()
+        shutil.rmtree(metricas_dir, ignore_errors=True)
+    return versao_banco, resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--banco', choices=['postgres', 'sqlite'], default='postgres')
+    parser.add_argument('--database-url', help='usa este banco em vez de um Postgres temporário')
+    parser.add_argument('--porta-postgres', type=int, default=55432)
+    parser.add_argument('--clientes', type=int, default=5000)
+    parser.add_argument('--pedidos', type=int, default=200000)
+    parser.add_argument('--cenarios', default=','.join(CENARIOS))
+    parser.add_argument('--usuarios', type=int, default=16, help='usuários simultâneos por cenário')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos medidos por cenário')
+    parser.add_argument('--aquecimento', type=float, default=2)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--pool', type=int, default=5, help='DB_POOL_MAX_SIZE do app')
+    parser.add_argument('--cache', help='CACHE_BACKEND do app (padrão: o do banco escolhido)')
+    parser.add_argument('--porta', type=int, default=8360)
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--baseline', help='arquivo JSON de referência')
+    parser.add_argument('--salvar', action='store_true', help='grava o resultado como nova referência')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='variação aceita em vazão e p95')
+    args = parser.parse_args()
+
+    if args.banco == 'sqlite':
+        with sqlite_temporario() as caminho:
+            versao_banco, resultados = executar_suite(args, {'BANCO': 'sqlite', 'SQLITE_PATH': caminho})
+    elif args.database_url:
+        versao_banco, resultados = executar_suite(args, {'DATABASE_URL': args.database_url})
+    else:
+        with postgres_temporario(args.porta_postgres) as database_url:
+            versao_banco, resultados = executar_suite(args, {'DATABASE_URL': database_url})
+
+    print(f"{'cenário':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6} {'cons/req':>9}")
+    for nome, r in resultados.items():
+        print(f"{nome:<10} {r['por_segundo']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['erros']:>6} "
+              f"{r['consultas_por_requisicao']:>9}")
+
+    if not args.baseline:
+        return
+    parametros = {chave: valor for chave, valor in vars(args).items()
+                  if chave not in ['database_url', 'baseline', 'salvar', 'tolerancia']}
+    if args.salvar or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as arquivo:
+            json.dump({'parametros': parametros, 'ambiente': {'python': platform.python_version(), 'banco': versao_banco,
+                                                              'maquina': platform.node()},
+                       'resultados': resultados}, arquivo, indent=2, ensure_ascii=False)
+        print(f"referência gravada em {args.baseline}")
+        return
+    with open(args.baseline) as arquivo:
+        referencia = json.load(arquivo)
+    if referencia['parametros'] != parametros:
+        print("aviso: parâmetros diferentes dos da referência; a comparação pode não ser válida")
+    regressoes = comparar(resultados, referencia['resultados'], args.tolerancia)
+    for regressao in regressoes:
+        print("REGRESSÃO", regressao)
+    if regressoes:
+        sys.exit(1)
+    print("sem regressões em relação a", args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+-- Tabelas originais do sistema (antes criadas na importação do app.py).
+CREATE TABLE IF NOT EXISTS clientes (
+    id SERIAL PRIMARY KEY,
+    nome TEXT NOT NULL,
+    card_id TEXT UNIQUE NOT NULL,
+    ultimo_pagamento DATE,
+    creditos INTEGER NOT NULL,
+    data_expiracao DATE,
+    celular TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pedidos (
+    id SERIAL PRIMARY KEY,
+    card_id TEXT NOT NULL,
+    nome_cliente TEXT NOT NULL,
+    empresa TEXT NOT NULL,
+    quantidade_deduzida INTEGER NOT NULL,
+    horario TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id SERIAL PRIMARY KEY,
+    login TEXT UNIQUE NOT NULL,
+    senha TEXT
+);
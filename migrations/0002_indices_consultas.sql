@@ -0,0 +1,8 @@
+-- Histórico por cartão (obter_historico) e exclusão do histórico
+-- (excluir_cliente): o índice cobre o WHERE card_id, a ordenação por horario
+-- e as colunas exibidas, permitindo index-only scan.
+CREATE INDEX IF NOT EXISTS pedidos_card_id_horario_idx
+    ON pedidos (card_id, horario DESC) INCLUDE (empresa, quantidade_deduzida);
+
+-- Consulta por celular (/cliente).
+CREATE INDEX IF NOT EXISTS clientes_celular_idx ON clientes (celular);
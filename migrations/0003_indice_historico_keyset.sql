@@ -0,0 +1,7 @@
+-- Paginação do histórico por (horario, id): o id entra na chave do índice para
+-- que "(horario, id) < (?, ?) ORDER BY horario DESC, id DESC" seja resolvido
+-- direto no índice, que continua cobrindo as colunas exibidas e os totais.
+CREATE INDEX IF NOT EXISTS pedidos_card_id_horario_id_idx
+    ON pedidos (card_id, horario DESC, id DESC) INCLUDE (empresa, quantidade_deduzida);
+
+DROP INDEX IF EXISTS pedidos_card_id_horario_idx;
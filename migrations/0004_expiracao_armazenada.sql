@@ -0,0 +1,9 @@
+-- Expiração passa a ser um estado gravado, atualizado em lote pela varredura
+-- ("flask --app app varrer-expirados") e desfeito pela recarga.
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS expirado BOOLEAN NOT NULL DEFAULT false;
+
+UPDATE clientes SET expirado = true WHERE data_expiracao < CURRENT_DATE AND NOT expirado;
+
+-- Atende a varredura e o relatório de cartões vencendo em N dias, que só
+-- olham para os cartões ainda não expirados.
+CREATE INDEX IF NOT EXISTS clientes_data_expiracao_idx ON clientes (data_expiracao) WHERE NOT expirado;
@@ -0,0 +1,23 @@
+-- Avisa os workers (LISTEN cache_clientes) quando um cliente muda, para que
+-- invalidem o cache local. Gatilhos por comando: atualizações em massa
+-- (varredura de expirados, recarga em lote) geram um único aviso '*'.
+CREATE OR REPLACE FUNCTION notificar_cache_clientes() RETURNS trigger AS $$
+BEGIN
+    IF (SELECT count(*) FROM linhas_antigas) > 100 THEN
+        PERFORM pg_notify('cache_clientes', '*');
+    ELSE
+        PERFORM pg_notify('cache_clientes', card_id) FROM linhas_antigas;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS clientes_cache_update ON clientes;
+CREATE TRIGGER clientes_cache_update AFTER UPDATE ON clientes
+    REFERENCING OLD TABLE AS linhas_antigas
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cache_clientes();
+
+DROP TRIGGER IF EXISTS clientes_cache_delete ON clientes;
+CREATE TRIGGER clientes_cache_delete AFTER DELETE ON clientes
+    REFERENCING OLD TABLE AS linhas_antigas
+    FOR EACH STATEMENT EXECUTE FUNCTION notificar_cache_clientes();
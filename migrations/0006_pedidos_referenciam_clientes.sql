@@ -0,0 +1,11 @@
+-- O nome do cliente passa a existir só em clientes: renomear não reescreve
+-- mais o histórico. pedidos referencia o cliente pelo card_id (único e
+-- imutável), e excluir um cliente apaga o histórico em cascata, usando o
+-- índice (card_id, horario, id) de pedidos.
+ALTER TABLE pedidos DROP COLUMN IF EXISTS nome_cliente;
+
+-- NOT VALID: vale para os pedidos novos sem varrer o histórico existente
+-- (nem falhar por algum pedido antigo sem cliente).
+ALTER TABLE pedidos DROP CONSTRAINT IF EXISTS pedidos_card_id_fkey;
+ALTER TABLE pedidos ADD CONSTRAINT pedidos_card_id_fkey
+    FOREIGN KEY (card_id) REFERENCES clientes (card_id) ON DELETE CASCADE NOT VALID;
@@ -0,0 +1,66 @@
+-- pedidos passa a ser particionada por mês de horario. Consultas com filtro
+-- de data (históricos recentes, exportações, relatórios) só leem as
+-- partições do período, e meses antigos podem ser arquivados e removidos
+-- inteiros ("flask --app app arquivar-pedidos").
+ALTER TABLE pedidos RENAME TO pedidos_legado;
+ALTER SEQUENCE pedidos_id_seq OWNED BY NONE;
+
+CREATE TABLE pedidos (
+    id INTEGER NOT NULL DEFAULT nextval('pedidos_id_seq'),
+    card_id TEXT NOT NULL,
+    empresa TEXT NOT NULL,
+    quantidade_deduzida INTEGER NOT NULL,
+    horario TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (horario);
+
+-- Rede de segurança: se faltar a partição de um mês, o pedido cai aqui em vez
+-- de falhar. criar_particao_pedidos move essas linhas ao criar o mês.
+CREATE TABLE pedidos_padrao PARTITION OF pedidos DEFAULT;
+
+CREATE OR REPLACE FUNCTION criar_particao_pedidos(mes DATE) RETURNS void AS $$
+DECLARE
+    inicio DATE := date_trunc('month', mes);
+    fim DATE := date_trunc('month', mes) + INTERVAL '1 month';
+    nome TEXT := 'pedidos_' || to_char(mes, 'YYYY_MM');
+BEGIN
+    IF to_regclass(nome) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE pedidos INCLUDING DEFAULTS)', nome);
+    EXECUTE format('WITH movidos AS (DELETE FROM pedidos_padrao WHERE horario >= %L AND horario < %L RETURNING *) '
+                   'INSERT INTO %I SELECT * FROM movidos', inicio, fim, nome);
+    EXECUTE format('ALTER TABLE pedidos ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', nome, inicio, fim);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT criar_particao_pedidos(mes::date)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT min(horario) FROM pedidos_legado), LOCALTIMESTAMP)),
+    date_trunc('month', LOCALTIMESTAMP) + INTERVAL '3 months',
+    INTERVAL '1 month'
+) AS mes;
+
+INSERT INTO pedidos (id, card_id, empresa, quantidade_deduzida, horario)
+SELECT l.id, l.card_id, l.empresa, l.quantidade_deduzida, l.horario
+FROM pedidos_legado l
+WHERE EXISTS (SELECT 1 FROM clientes c WHERE c.card_id = l.card_id);
+
+-- Pedidos antigos de cartões que não existem mais não podem entrar na tabela
+-- com chave estrangeira; se houver algum, fica guardado à parte.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pedidos_legado l WHERE NOT EXISTS (SELECT 1 FROM clientes c WHERE c.card_id = l.card_id)) THEN
+        CREATE TABLE pedidos_sem_cliente AS
+            SELECT * FROM pedidos_legado l WHERE NOT EXISTS (SELECT 1 FROM clientes c WHERE c.card_id = l.card_id);
+    END IF;
+END;
+$$;
+
+DROP TABLE pedidos_legado;
+ALTER SEQUENCE pedidos_id_seq OWNED BY pedidos.id;
+
+ALTER TABLE pedidos ADD CONSTRAINT pedidos_pkey PRIMARY KEY (id, horario);
+ALTER TABLE pedidos ADD CONSTRAINT pedidos_card_id_fkey
+    FOREIGN KEY (card_id) REFERENCES clientes (card_id) ON DELETE CASCADE;
+CREATE INDEX pedidos_card_id_horario_id_idx
+    ON pedidos (card_id, horario DESC, id DESC) INCLUDE (empresa, quantidade_deduzida);
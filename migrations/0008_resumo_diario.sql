@@ -0,0 +1,44 @@
+-- Resumo por (dia, empresa) para o painel: créditos movimentados, número de
+-- registros e cartões distintos. Mantido por um gatilho por comando em
+-- pedidos, na mesma transação de cada dedução/adição, então o painel nunca
+-- precisa agregar o histórico. Exclusões e arquivamento de pedidos não
+-- alteram o resumo, que funciona como registro histórico.
+CREATE TABLE IF NOT EXISTS resumo_diario (
+    dia DATE NOT NULL,
+    empresa TEXT NOT NULL,
+    registros INTEGER NOT NULL,
+    creditos INTEGER NOT NULL,
+    cartoes INTEGER NOT NULL,
+    PRIMARY KEY (dia, empresa)
+);
+
+CREATE OR REPLACE FUNCTION atualizar_resumo_diario() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO resumo_diario AS r (dia, empresa, registros, creditos, cartoes)
+    SELECT n.horario::date, n.empresa, count(*), sum(abs(n.quantidade_deduzida)),
+           -- cartões que ainda não tinham movimento nesse dia e empresa
+           count(DISTINCT n.card_id) FILTER (WHERE NOT EXISTS (
+               SELECT 1 FROM pedidos p
+               WHERE p.card_id = n.card_id AND p.empresa = n.empresa
+                 AND p.horario >= n.horario::date AND p.horario < n.horario::date + 1
+                 AND NOT EXISTS (SELECT 1 FROM novos_pedidos x WHERE x.id = p.id)))
+    FROM novos_pedidos n
+    GROUP BY 1, 2
+    ON CONFLICT (dia, empresa) DO UPDATE SET
+        registros = r.registros + EXCLUDED.registros,
+        creditos = r.creditos + EXCLUDED.creditos,
+        cartoes = r.cartoes + EXCLUDED.cartoes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS pedidos_resumo_diario ON pedidos;
+CREATE TRIGGER pedidos_resumo_diario AFTER INSERT ON pedidos
+    REFERENCING NEW TABLE AS novos_pedidos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_resumo_diario();
+
+INSERT INTO resumo_diario (dia, empresa, registros, creditos, cartoes)
+SELECT horario::date, empresa, count(*), sum(abs(quantidade_deduzida)), count(DISTINCT card_id)
+FROM pedidos
+GROUP BY 1, 2
+ON CONFLICT (dia, empresa) DO NOTHING;
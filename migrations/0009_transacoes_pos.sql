@@ -0,0 +1,11 @@
+-- Chaves de idempotência das transações enviadas pelos terminais (API). A
+-- chave primária detecta reenvios sem consultar pedidos, e o resultado da
+-- primeira tentativa é devolvido de novo ao terminal. Fica fora de pedidos
+-- porque, particionada, ela não aceita unicidade sem incluir horario.
+CREATE TABLE IF NOT EXISTS transacoes_pos (
+    chave TEXT PRIMARY KEY,
+    card_id TEXT NOT NULL,
+    situacao TEXT,
+    mensagem TEXT,
+    criada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
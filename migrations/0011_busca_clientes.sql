@@ -0,0 +1,22 @@
+-- Busca de clientes (/clientes/busca, /cliente, /editar e /excluir).
+-- celular_digitos guarda só os dígitos do celular, para que "(11) 99999-0000"
+-- e "11999990000" sejam o mesmo número; nome_busca guarda o nome sem acentos e
+-- em minúsculas (a mesma normalização de normalizar_nome no app). As duas
+-- colunas usam a collation "C" para que os índices b-tree atendam LIKE 'x%'
+-- já na ordem do ORDER BY. O índice GIN de to_tsvector cobre a busca pelo
+-- início de qualquer palavra do nome (sobrenomes), sem depender de pg_trgm.
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS celular_digitos TEXT COLLATE "C"
+    GENERATED ALWAYS AS (regexp_replace(celular, '[^0-9]', '', 'g')) STORED;
+
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS nome_busca TEXT COLLATE "C"
+    GENERATED ALWAYS AS (lower(translate(nome,
+        'ÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑáàâãäéèêëíìîïóòôõöúùûüçñ',
+        'AAAAAEEEEIIIIOOOOOUUUUCNaaaaaeeeeiiiiooooouuuucn'))) STORED;
+
+CREATE INDEX IF NOT EXISTS clientes_celular_digitos_idx ON clientes (celular_digitos);
+CREATE INDEX IF NOT EXISTS clientes_nome_busca_idx ON clientes (nome_busca);
+CREATE INDEX IF NOT EXISTS clientes_nome_palavras_idx ON clientes USING gin (to_tsvector('simple', nome_busca));
+CREATE INDEX IF NOT EXISTS clientes_card_id_prefixo_idx ON clientes (card_id COLLATE "C");
+
+-- Substituído por clientes_celular_digitos_idx
+DROP INDEX IF EXISTS clientes_celular_idx;
@@ -0,0 +1,74 @@
+-- O gatilho da migração 0008 descobria os cartões novos no dia com um NOT
+-- EXISTS na tabela de transição, que não tem índice: um INSERT com N linhas
+-- custava O(N²) (minutos para cargas de centenas de milhares). Ele também
+-- fazia o upsert na linha (dia, empresa) de resumo_diario dentro da transação
+-- de cada dedução: todas as deduções de uma empresa no dia esperavam pelo
+-- mesmo lock de linha, e um lote de /api/sincronizar (que segura esse lock
+-- até o fim) podia travar em deadlock com uma dedução da tela principal
+-- esperando o lock na ordem inversa. Além disso, duas transações simultâneas
+-- com o mesmo cartão podiam contá-lo duas vezes em "cartoes".
+--
+-- Agora o gatilho só acrescenta as movimentações do comando em
+-- resumo_diario_pendente, sem conflito entre transações, e a função
+-- consolidar_resumo_diario() (comando "flask consolidar-resumo", agendado a
+-- cada minuto) as move para resumo_diario. Os cartões já contados em cada
+-- (dia, empresa) ficam em resumo_diario_cartoes, cuja chave primária garante
+-- que cada um entra uma vez só. O painel soma resumo_diario e as pendências.
+CREATE TABLE resumo_diario_pendente (
+    dia DATE NOT NULL,
+    empresa TEXT NOT NULL,
+    card_id TEXT NOT NULL,
+    registros INTEGER NOT NULL,
+    creditos INTEGER NOT NULL
+);
+
+CREATE TABLE resumo_diario_cartoes (
+    dia DATE NOT NULL,
+    empresa TEXT NOT NULL,
+    card_id TEXT NOT NULL,
+    PRIMARY KEY (dia, empresa, card_id)
+);
+
+INSERT INTO resumo_diario_cartoes (dia, empresa, card_id)
+SELECT DISTINCT horario::date, empresa, card_id FROM pedidos;
+
+CREATE OR REPLACE FUNCTION atualizar_resumo_diario() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO resumo_diario_pendente (dia, empresa, card_id, registros, creditos)
+    SELECT horario::date, empresa, card_id, count(*), sum(abs(quantidade_deduzida))
+    FROM novos_pedidos
+    GROUP BY 1, 2, 3;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- O LOCK serializa as consolidações (e o recálculo, que usa o mesmo lock) sem
+-- bloquear as deduções, que só escrevem em resumo_diario_pendente, nem as
+-- leituras do painel. Pendências de transações ainda abertas não são vistas
+-- pelo DELETE e ficam para a próxima consolidação.
+CREATE OR REPLACE FUNCTION consolidar_resumo_diario() RETURNS integer AS $$
+DECLARE
+    consolidados integer;
+BEGIN
+    LOCK TABLE resumo_diario IN EXCLUSIVE MODE;
+    WITH pendentes AS (
+        DELETE FROM resumo_diario_pendente RETURNING *
+    ), cartoes_novos AS (
+        INSERT INTO resumo_diario_cartoes (dia, empresa, card_id)
+        SELECT DISTINCT dia, empresa, card_id FROM pendentes
+        ON CONFLICT DO NOTHING
+        RETURNING dia, empresa
+    )
+    INSERT INTO resumo_diario AS r (dia, empresa, registros, creditos, cartoes)
+    SELECT p.dia, p.empresa, p.registros, p.creditos, coalesce(n.cartoes, 0)
+    FROM (SELECT dia, empresa, sum(registros) AS registros, sum(creditos) AS creditos
+          FROM pendentes GROUP BY 1, 2) p
+    LEFT JOIN (SELECT dia, empresa, count(*) AS cartoes FROM cartoes_novos GROUP BY 1, 2) n USING (dia, empresa)
+    ON CONFLICT (dia, empresa) DO UPDATE SET
+        registros = r.registros + EXCLUDED.registros,
+        creditos = r.creditos + EXCLUDED.creditos,
+        cartoes = r.cartoes + EXCLUDED.cartoes;
+    GET DIAGNOSTICS consolidados = ROW_COUNT;
+    RETURN consolidados;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,96 @@
+-- Esquema do modo SQLite (BANCO=sqlite), equivalente ao das migrações do
+-- Postgres até a 0011. Novas migrações do Postgres que mudem o esquema
+-- precisam da sua correspondente aqui.
+--
+-- Diferenças: pedidos não é particionada (uma loja só não acumula volume para
+-- isso), não há gatilhos de LISTEN/NOTIFY (o cache fica desligado), o resumo
+-- diário é mantido por um gatilho por linha e celular_digitos e nome_busca
+-- usam as funções normalizar_celular e normalizar_nome, registradas pelo app
+-- em cada conexão.
+
+-- O fidelidade.db antigo já tem clientes com as colunas originais: a tabela é
+-- recriada com o esquema atual, preservando as linhas.
+CREATE TABLE IF NOT EXISTS clientes (
+    id INTEGER PRIMARY KEY,
+    nome TEXT NOT NULL,
+    card_id TEXT UNIQUE NOT NULL,
+    ultimo_pagamento DATE,
+    creditos INTEGER NOT NULL,
+    data_expiracao DATE,
+    celular TEXT NOT NULL
+);
+
+CREATE TABLE clientes_nova (
+    id INTEGER PRIMARY KEY,
+    nome TEXT NOT NULL,
+    card_id TEXT UNIQUE NOT NULL,
+    ultimo_pagamento DATE,
+    creditos INTEGER NOT NULL,
+    data_expiracao DATE,
+    celular TEXT NOT NULL,
+    expirado BOOLEAN NOT NULL DEFAULT false,
+    celular_digitos TEXT GENERATED ALWAYS AS (normalizar_celular(celular)) STORED,
+    nome_busca TEXT GENERATED ALWAYS AS (normalizar_nome(nome)) STORED
+);
+
+INSERT INTO clientes_nova (id, nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular, expirado)
+SELECT id, nome, card_id, ultimo_pagamento, creditos, data_expiracao, celular,
+       data_expiracao < date('now', 'localtime')
+FROM clientes;
+
+DROP TABLE clientes;
+ALTER TABLE clientes_nova RENAME TO clientes;
+
+CREATE INDEX clientes_data_expiracao_idx ON clientes (data_expiracao) WHERE NOT expirado;
+CREATE INDEX clientes_celular_digitos_idx ON clientes (celular_digitos);
+CREATE INDEX clientes_nome_busca_idx ON clientes (nome_busca);
+
+-- Sem INCLUDE no SQLite: empresa e quantidade entram na chave para que o
+-- histórico e os totais do cartão sejam lidos só do índice.
+CREATE TABLE pedidos (
+    id INTEGER PRIMARY KEY,
+    card_id TEXT NOT NULL REFERENCES clientes (card_id) ON DELETE CASCADE,
+    empresa TEXT NOT NULL,
+    quantidade_deduzida INTEGER NOT NULL,
+    horario TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE INDEX pedidos_card_id_horario_id_idx
+    ON pedidos (card_id, horario DESC, id DESC, empresa, quantidade_deduzida);
+
+CREATE TABLE usuarios (
+    id INTEGER PRIMARY KEY,
+    login TEXT UNIQUE NOT NULL,
+    senha TEXT
+);
+
+CREATE TABLE resumo_diario (
+    dia DATE NOT NULL,
+    empresa TEXT NOT NULL,
+    registros INTEGER NOT NULL,
+    creditos INTEGER NOT NULL,
+    cartoes INTEGER NOT NULL,
+    PRIMARY KEY (dia, empresa)
+);
+
+CREATE TRIGGER pedidos_resumo_diario AFTER INSERT ON pedidos
+BEGIN
+    INSERT INTO resumo_diario (dia, empresa, registros, creditos, cartoes)
+    VALUES (date(NEW.horario), NEW.empresa, 1, abs(NEW.quantidade_deduzida),
+            -- o cartão ainda não tinha movimento nesse dia e empresa
+            NOT EXISTS (SELECT 1 FROM pedidos p
+                        WHERE p.card_id = NEW.card_id AND p.empresa = NEW.empresa AND p.id <> NEW.id
+                          AND p.horario >= date(NEW.horario) AND p.horario < date(NEW.horario, '+1 day')))
+    ON CONFLICT (dia, empresa) DO UPDATE SET
+        registros = registros + 1,
+        creditos = creditos + excluded.creditos,
+        cartoes = cartoes + excluded.cartoes;
+END;
+
+CREATE TABLE transacoes_pos (
+    chave TEXT PRIMARY KEY,
+    card_id TEXT NOT NULL,
+    situacao TEXT,
+    mensagem TEXT,
+    criada_em TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
@@ -0,0 +1,52 @@
+// Autocompletar de clientes: todo <input data-busca-clientes="URL"> ganha uma
+// <datalist> preenchida com /clientes/busca enquanto se digita. A opção
+// escolhida grava no campo o atributo indicado em data-busca-valor
+// (card_id por padrão).
+(function () {
+    var ESPERA_MS = 150;
+
+    function ligar(campo) {
+        var lista = document.createElement('datalist');
+        lista.id = campo.id + '_sugestoes';
+        campo.setAttribute('list', lista.id);
+        campo.setAttribute('autocomplete', 'off');
+        campo.after(lista);
+        var valor = campo.dataset.buscaValor || 'card_id';
+        var temporizador = null;
+        var ultimoTermo = '';
+        var controlador = null;
+
+        function buscar() {
+            var termo = campo.value.trim();
+            if (termo.length < 2 || termo === ultimoTermo) {
+                return;
+            }
+            ultimoTermo = termo;
+            if (controlador) {
+                controlador.abort();
+            }
+            controlador = new AbortController();
+            fetch(campo.dataset.buscaClientes + '?q=' + encodeURIComponent(termo), {
+                credentials: 'same-origin',
+                signal: controlador.signal
+            })
+                .then(function (resposta) { return resposta.ok ? resposta.json() : {clientes: []}; })
+                .then(function (dados) {
+                    lista.replaceChildren.apply(lista, dados.clientes.map(function (cliente) {
+                        var opcao = document.createElement('option');
+                        opcao.value = cliente[valor];
+                        opcao.label = cliente.card_id + ' - ' + cliente.nome + ' - ' + cliente.celular;
+                        return opcao;
+                    }));
+                })
+                .catch(function () {});
+        }
+
+        campo.addEventListener('input', function () {
+            clearTimeout(temporizador);
+            temporizador = setTimeout(buscar, ESPERA_MS);
+        });
+    }
+
+    document.querySelectorAll('input[data-busca-clientes]').forEach(ligar);
+})();
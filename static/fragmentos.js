@@ -0,0 +1,58 @@
+// Envio em fragmentos: os <form data-fragmento> são enviados com fetch e o
+// cabeçalho X-Fragmento, e a resposta (só as áreas que mudam a cada passo)
+// substitui os elementos de mesmo id na página. Sem fetch, o formulário segue
+// o envio normal, com a página inteira.
+(function () {
+    if (!window.fetch || !window.URLSearchParams) {
+        return;
+    }
+
+    function trocar(html) {
+        var modelo = document.createElement('template');
+        modelo.innerHTML = html;
+        Array.prototype.forEach.call(modelo.content.children, function (novo) {
+            var atual = novo.id && document.getElementById(novo.id);
+            if (atual) {
+                atual.replaceWith(novo);
+            }
+        });
+        // a busca de um cartão inexistente limpa o campo, como na página inteira
+        var painel = document.getElementById('painel-cliente');
+        var campo = document.getElementById('card_id');
+        if (painel && campo) {
+            campo.value = painel.dataset.cardId;
+        }
+    }
+
+    document.addEventListener('submit', function (evento) {
+        var form = evento.target;
+        if (!form.hasAttribute('data-fragmento')) {
+            return;
+        }
+        evento.preventDefault();
+        var dados = new FormData(form);
+        var botao = evento.submitter;
+        if (botao && botao.name) {
+            dados.set(botao.name, botao.value);
+        }
+        fetch(form.action, {
+            method: 'POST',
+            body: new URLSearchParams(dados),
+            headers: {'X-Fragmento': '1'},
+            credentials: 'same-origin'
+        })
+            .then(function (resposta) {
+                // redirecionamentos (exclusão, sessão expirada) e erros vão para a página inteira
+                if (!resposta.ok || !resposta.headers.has('X-Fragmento')) {
+                    window.location.href = resposta.url;
+                    return;
+                }
+                return resposta.text().then(trocar);
+            })
+            .catch(function () {
+                // sem reenviar: a dedução pode ter sido gravada antes da falha
+                trocar('<div id="area-mensagem"><div class="alert alert-danger">' +
+                       'Falha de conexão. Busque o cartão antes de repetir a operação.</div></div>');
+            });
+    });
+})();
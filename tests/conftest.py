@@ -0,0 +1,60 @@
+"""Fixtures dos testes, que rodam nos dois bancos.
+
+Cada teste roda uma vez com o SQLite, num arquivo temporário, e outra com o
+Postgres de TESTES_DATABASE_URL (pulada se ela não estiver definida). Esse
+banco é esvaziado antes de cada teste: use um banco só para os testes, nunca
+o de produção.
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+    TESTES_DATABASE_URL=postgresql://localhost/fidelidade_testes python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TESTES_DATABASE_URL = os.environ.get('TESTES_DATABASE_URL')
+
+# Lidas pelo app na importação
+os.environ.update(CACHE_BACKEND='desligado', METRICAS='0', DATABASE_REPLICAS='')
+if TESTES_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TESTES_DATABASE_URL
+
+import app as modulo_app  # noqa: E402
+
+TABELAS = ['transacoes_pos', 'resumo_diario_pendente', 'resumo_diario_cartoes', 'resumo_diario', 'pedidos', 'clientes', 'usuarios']
+
+
+# O banco do teste troca o objeto "banco" do app; o teste roda dentro de um
+# contexto da aplicação, com a conexão da requisição em g.
+@pytest.fixture(params=['sqlite', 'postgres'])
+def banco(request, tmp_path, monkeypatch):
+    if request.param == 'sqlite':
+        banco = modulo_app.BancoSQLite(str(tmp_path / 'fidelidade.db'))
+    elif TESTES_DATABASE_URL:
+        banco = modulo_app.BancoPostgres()
+    else:
+        pytest.skip("defina TESTES_DATABASE_URL para testar com o Postgres")
+    monkeypatch.setattr(modulo_app, 'banco', banco)
+    with modulo_app.app.app_context():
+        modulo_app.aplicar_migracoes()
+        if banco.nome == 'postgres':
+            conn = modulo_app.get_db_connection()
+            conn.execute(f"TRUNCATE {', '.join(TABELAS)} RESTART IDENTITY")
+            conn.commit()
+        yield banco
+
+
+@pytest.fixture
+def cliente(banco):
+    modulo_app.cadastrar_cliente('Ana Souza', 'CARD1', '(11) 99999-0000')
+    return 'CARD1'
+
+
+def contar_pedidos(card_id):
+    c = modulo_app.get_db_connection().cursor()
+    c.execute("SELECT count(*) AS total FROM pedidos WHERE card_id = %s", (card_id,))
+    return c.fetchone()['total']
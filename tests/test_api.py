@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as modulo_app
+
+TOKEN = {'Authorization': 'Bearer token-testes'}
+
+
+@pytest.fixture
+def api(banco, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'API_TOKENS', ['token-testes'])
+    return modulo_app.app.test_client()
+
+
+@pytest.mark.parametrize('corpo', [[1], 'texto', 5])
+def test_movimentar_exige_objeto(api, cliente, corpo):
+    resposta = api.post(f'/api/cartoes/{cliente}/deducao', json=corpo, headers=TOKEN)
+    assert resposta.status_code == 400
+    assert resposta.get_json() == {'erro': "Envie a transação como um objeto JSON."}
+
+
+def test_movimentar(api, cliente):
+    resposta = api.post(f'/api/cartoes/{cliente}/deducao', json={'quantidade': 2, 'empresa': 'STOUT PIZZA'}, headers=TOKEN)
+    assert resposta.status_code == 200
+    assert resposta.get_json()['cliente']['creditos'] == 8
+
+
+def sincronizar(api, *transacoes):
+    resposta = api.post('/api/sincronizar', json={'transacoes': list(transacoes)}, headers=TOKEN)
+    assert resposta.status_code == 200
+    return [(resultado['situacao'], resultado['mensagem']) for resultado in resposta.get_json()['resultados']]
+
+
+def test_sincronizar_horario_offline(api, cliente):
+    agora = datetime.now()
+    deducao = {'tipo': 'deducao', 'card_id': cliente, 'quantidade': 1, 'empresa': 'STOUT PIZZA'}
+    assert sincronizar(api, {**deducao, 'horario': (agora - timedelta(days=1)).isoformat()},
+                       {**deducao, 'horario': (agora + timedelta(hours=1)).isoformat()},
+                       {**deducao, 'horario': (agora - timedelta(days=modulo_app.API_OFFLINE_MAX_DIAS, minutes=1)).isoformat()},
+                       {**deducao, 'horario': 'ontem'}) == [
+        ('ok', "1 crédito(s) deduzido(s) para STOUT PIZZA. Créditos restantes: 9"),
+        ('invalido', "Erro: Horário no futuro. Confira o relógio do terminal."),
+        ('invalido', f"Erro: Transação offline com mais de {modulo_app.API_OFFLINE_MAX_DIAS} dia(s)."),
+        ('invalido', "Erro: Horário inválido."),
+    ]
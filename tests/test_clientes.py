@@ -0,0 +1,59 @@
+from datetime import date, timedelta
+
+import app as modulo_app
+
+
+def test_cadastrar_cliente(banco):
+    mensagem = modulo_app.cadastrar_cliente('Ana Souza', 'CARD1', '(11) 99999-0000')
+    assert mensagem.startswith("Cliente cadastrado com sucesso!")
+    expiracao = (date.today() + timedelta(days=30)).strftime('%d/%m/%Y')
+    assert modulo_app.buscar_info_cliente('CARD1') == ('Ana Souza', 10, 30, expiracao)
+
+
+def test_cadastrar_cliente_repetido(cliente):
+    assert modulo_app.cadastrar_cliente('Outra Pessoa', cliente, '11911112222') == "Erro: ID do cartão já existe."
+    # o erro desfaz só o INSERT: a conexão continua utilizável
+    assert modulo_app.cadastrar_cliente('Outra Pessoa', 'CARD2', '11911112222').startswith("Cliente cadastrado")
+    assert modulo_app.buscar_info_cliente(cliente)[0] == 'Ana Souza'
+
+
+def cadastrar_varios():
+    for nome, card_id, celular in [('Ana Souza', 'CARD1', '(11) 99999-0000'), ('Bruno Silva', 'CARD2', '11988887777'),
+                                   ('João da Silva', 'CARD10', '21977776666'), ('Érika Lima', 'CARDX%', '31966665555')]:
+        modulo_app.cadastrar_cliente(nome, card_id, celular)
+
+
+def cartoes(termo):
+    return [cliente['card_id'] for cliente in modulo_app.buscar_clientes(termo)]
+
+
+def test_buscar_clientes_por_card_id(banco):
+    cadastrar_varios()
+    assert cartoes('CARD1') == ['CARD1', 'CARD10']
+    assert cartoes('card1') == []  # card_id diferencia maiúsculas
+    # % e _ do termo são literais, não curingas do LIKE
+    assert cartoes('CARDX%') == ['CARDX%']
+    assert cartoes('CARD_') == []
+
+
+def test_buscar_clientes_por_celular(banco):
+    cadastrar_varios()
+    assert cartoes('(11) 9') == ['CARD2', 'CARD1']  # na ordem dos dígitos
+    assert cartoes('21977') == ['CARD10']
+
+
+def test_buscar_clientes_por_nome(banco):
+    cadastrar_varios()
+    assert cartoes('erika') == ['CARDX%']  # sem acento e sem diferenciar maiúsculas
+    # início de qualquer palavra do nome, depois das buscas por prefixo
+    assert cartoes('Bruno') == ['CARD2']
+    assert cartoes('silva') == ['CARD2', 'CARD10']
+    assert cartoes('sil') == ['CARD2', 'CARD10']
+    assert cartoes('si') == []  # termos curtos só buscam o início do nome
+
+
+def test_buscar_clientes_limite(banco):
+    for numero in range(15):
+        modulo_app.cadastrar_cliente(f'Cliente {numero:02d}', f'CARD{numero:02d}', '11900000000')
+    assert len(modulo_app.buscar_clientes('CARD')) == modulo_app.BUSCA_LIMITE
+    assert cartoes('CARD0')[:3] == ['CARD00', 'CARD01', 'CARD02']
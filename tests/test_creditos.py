@@ -0,0 +1,111 @@
+import threading
+from datetime import date, datetime, timedelta
+
+import app as modulo_app
+from conftest import contar_pedidos
+
+
+def alterar_cliente(card_id, **colunas):
+    conn = modulo_app.get_db_connection()
+    atribuicoes = ', '.join(f"{coluna} = %({coluna})s" for coluna in colunas)
+    conn.execute(f"UPDATE clientes SET {atribuicoes} WHERE card_id = %(card_id)s", {**colunas, 'card_id': card_id})
+    conn.commit()
+
+
+def test_deduzir_credito(cliente):
+    mensagem, info = modulo_app.deduzir_credito(cliente, '3', 'CHAAAMA CHOPP')
+    assert mensagem == "3 crédito(s) deduzido(s) para CHAMA. Créditos restantes: 7"
+    assert info[:3] == ('Ana Souza', 7, 30)
+    assert modulo_app.buscar_info_cliente(cliente)[1] == 7
+    historico, _ = modulo_app.obter_historico(cliente)
+    assert [(pedido['empresa'], pedido['quantidade_deduzida']) for pedido in historico] == [('CHAMA', -3)]
+
+
+def test_deduzir_credito_sem_saldo(cliente):
+    mensagem, info = modulo_app.deduzir_credito(cliente, '11', 'STOUT PIZZA')
+    assert mensagem == "Erro: Créditos insuficientes. Disponível: 10, solicitado: 11."
+    assert info[1] == 10
+    assert contar_pedidos(cliente) == 0
+
+
+def test_deduzir_credito_invalido(cliente):
+    assert modulo_app.deduzir_credito(cliente, 'abc', 'STOUT PIZZA') == ("Erro: Insira um número válido.", None)
+    assert modulo_app.deduzir_credito(cliente, '0', 'STOUT PIZZA') == ("Erro: A quantidade deve ser maior que zero.", None)
+    assert modulo_app.deduzir_credito(cliente, str(modulo_app.QUANTIDADE_MAX + 1), 'STOUT PIZZA')[1] is None
+    assert modulo_app.deduzir_credito(cliente, '1', 'OUTRA') == ("Erro: Empresa inválida.", None)
+    assert modulo_app.deduzir_credito('CARD999', '1', 'STOUT PIZZA') == ("Cliente não encontrado.", None)
+    assert contar_pedidos(cliente) == 0
+
+
+def test_deduzir_credito_expirado(cliente):
+    alterar_cliente(cliente, data_expiracao=date.today() - timedelta(days=1))
+    mensagem, info = modulo_app.deduzir_credito(cliente, '1', 'STOUT PIZZA')
+    assert mensagem == "Créditos expirados. Necessário recarregar."
+    assert info[2] == "Expirado"
+    assert contar_pedidos(cliente) == 0
+
+
+def test_movimentar_creditos_offline_vale_pelo_dia_da_transacao(cliente):
+    ontem = datetime.now() - timedelta(days=1)
+    alterar_cliente(cliente, data_expiracao=ontem.date(), expirado=True)
+    result = modulo_app.movimentar_creditos(cliente, -2, 'STOUT PIZZA', ontem)
+    assert result['novo_creditos'] == 8
+    # sem horario, a mesma dedução é conferida contra hoje
+    assert modulo_app.movimentar_creditos(cliente, -2, 'STOUT PIZZA')['novo_creditos'] is None
+    historico, _ = modulo_app.obter_historico(cliente)
+    assert [pedido['horario'] for pedido in historico] == [ontem]
+
+
+def test_movimentar_creditos_sem_confirmar(cliente):
+    modulo_app.movimentar_creditos(cliente, -4, 'STOUT PIZZA', confirmar=False)
+    modulo_app.get_db_connection().rollback()
+    assert modulo_app.buscar_info_cliente(cliente)[1] == 10
+    assert contar_pedidos(cliente) == 0
+
+
+# Cada thread usa a própria conexão (um contexto da aplicação por thread): só
+# as deduções que cabem no saldo passam, sem deixá-lo negativo.
+def test_deducoes_concorrentes(cliente):
+    app = modulo_app.app
+    largada = threading.Barrier(20)
+    mensagens = []
+
+    def deduzir():
+        with app.app_context():
+            largada.wait()
+            mensagens.append(modulo_app.deduzir_credito(cliente, '1', 'STOUT PIZZA')[0])
+
+    threads = [threading.Thread(target=deduzir) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(mensagem.startswith("1 crédito(s) deduzido(s)") for mensagem in mensagens) == 10
+    assert sum(mensagem.startswith("Erro: Créditos insuficientes.") for mensagem in mensagens) == 10
+    modulo_app.get_db_connection().rollback()  # retrato novo, com as deduções das threads
+    assert modulo_app.buscar_info_cliente(cliente)[1] == 0
+    assert contar_pedidos(cliente) == 10
+
+
+def test_obter_historico_paginas(cliente):
+    inicio = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    # dois pedidos em cada horário: o id desempata a ordem
+    for minuto in range(4):
+        for empresa in ['STOUT PIZZA', 'CHAMA']:
+            modulo_app.movimentar_creditos(cliente, -1, empresa, inicio + timedelta(minutes=minuto))
+    modulo_app.cadastrar_cliente('Outro', 'CARD2', '11911112222')
+    modulo_app.movimentar_creditos('CARD2', -1, 'STOUT PIZZA')
+
+    paginas = []
+    antes = None
+    while True:
+        pagina, antes = modulo_app.obter_historico(cliente, antes, limite=3)
+        paginas.append(pagina)
+        if antes is None:
+            break
+    assert [len(pagina) for pagina in paginas] == [3, 3, 2]
+    pedidos = [(pedido['horario'], pedido['id']) for pagina in paginas for pedido in pagina]
+    assert pedidos == sorted(pedidos, reverse=True)
+    assert len(set(pedidos)) == 8
+    assert pedidos[0][0] == inicio + timedelta(minutes=3)
+    assert modulo_app.obter_historico(cliente, limite=8)[1] is None
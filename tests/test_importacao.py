@@ -0,0 +1,88 @@
+import csv
+import gzip
+import io
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import app as modulo_app
+
+CSV_CLIENTES = """nome,card_id,celular
+Ana Souza,CARD1,11999990000
+Bruno Silva,CARD2,11988887777
+,CARD3,11977776666
+Carla Dias,XPTO4,11966665555
+Davi Rocha,CARD2,11955554444
+Eva Costa,CARD5
+
+Fábio Melo,CARD6,11944443333
+"""
+
+
+def test_importar_clientes(banco):
+    modulo_app.cadastrar_cliente('Já Cadastrado', 'CARD6', '11900000000')
+    importados, erros = modulo_app.importar_clientes(io.StringIO(CSV_CLIENTES))
+    assert importados == 2
+    assert [(erro['linha'], erro['erro']) for erro in erros] == [
+        (4, "Erro: Preencha todos os campos!"),
+        (5, "Erro: O ID do cartão deve começar com 'CARD'."),
+        (6, "Erro: ID do cartão repetido no arquivo."),
+        (7, "Erro: A linha deve ter 3 colunas (nome, card_id, celular)."),
+        (9, "Erro: Este ID já está cadastrado."),
+    ]
+    assert modulo_app.buscar_info_cliente('CARD2')[:2] == ('Bruno Silva', 10)
+    assert modulo_app.buscar_info_cliente('CARD6')[0] == 'Já Cadastrado'
+    assert modulo_app.buscar_clientes('11999')[0]['card_id'] == 'CARD1'
+
+
+def test_importar_clientes_separados_por_ponto_e_virgula(banco):
+    importados, erros = modulo_app.importar_clientes(io.StringIO("Ana Souza;CARD1;11999990000\nSilva, Bruno;CARD2;11988887777\n"))
+    assert (importados, erros) == (2, [])
+    assert modulo_app.buscar_info_cliente('CARD2')[0] == 'Silva, Bruno'
+
+
+# "flask importar -": a amostra lida para detectar o formato não pode ser
+# relida com seek
+def test_importar_clientes_de_entrada_sem_seek(banco):
+    linhas = ''.join(f"Cliente {numero},CARD{numero},119{numero:08d}\n" for numero in range(3000))
+    leitura, escrita = os.pipe()
+    with os.fdopen(escrita, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(linhas[:60000])  # cabe no buffer do pipe
+    with os.fdopen(leitura, encoding='utf-8') as arquivo:
+        assert not arquivo.seekable()
+        importados, erros = modulo_app.importar_clientes(arquivo)
+    assert erros == []
+    assert importados == linhas[:60000].count('\n')
+    assert modulo_app.buscar_info_cliente('CARD0')[0] == 'Cliente 0'
+
+
+def exportar(tabela, **filtros):
+    return b''.join(modulo_app.exportar_dados(tabela, **filtros))
+
+
+def test_exportar_clientes(cliente):
+    linhas = list(csv.reader(io.StringIO(exportar('clientes').decode())))
+    assert linhas[0] == ['id', 'nome', 'card_id', 'ultimo_pagamento', 'creditos', 'data_expiracao', 'expirado', 'celular']
+    assert linhas[1][1:] == ['Ana Souza', cliente, date.today().isoformat(), '10',
+                             (date.today() + timedelta(days=30)).isoformat(), 'f', '(11) 99999-0000']
+    assert len(linhas) == 2
+
+    registros = [json.loads(linha) for linha in exportar('clientes', formato='jsonl').decode().splitlines()]
+    assert registros == [{'id': registros[0]['id'], 'nome': 'Ana Souza', 'card_id': cliente, 'ultimo_pagamento': date.today().isoformat(),
+                          'creditos': 10, 'data_expiracao': (date.today() + timedelta(days=30)).isoformat(), 'expirado': False,
+                          'celular': '(11) 99999-0000'}]
+
+
+def test_exportar_pedidos_com_filtros(cliente):
+    ontem = datetime.now().replace(microsecond=0) - timedelta(days=1)
+    modulo_app.movimentar_creditos(cliente, -1, 'STOUT PIZZA', ontem)
+    modulo_app.movimentar_creditos(cliente, -2, 'CHAMA')
+    modulo_app.movimentar_creditos(cliente, 3, 'Adição Manual')
+
+    linhas = list(csv.DictReader(io.StringIO(exportar('pedidos').decode())))
+    assert [(linha['empresa'], linha['quantidade_deduzida'], linha['nome_cliente']) for linha in linhas] == [
+        ('STOUT PIZZA', '-1', 'Ana Souza'), ('CHAMA', '-2', 'Ana Souza'), ('Adição Manual', '3', 'Ana Souza')]
+    hoje = list(csv.DictReader(io.StringIO(exportar('pedidos', inicio=date.today(), fim=date.today()).decode())))
+    assert [linha['empresa'] for linha in hoje] == ['CHAMA', 'Adição Manual']
+    assert [linha['empresa'] for linha in csv.DictReader(io.StringIO(exportar('pedidos', empresa='STOUT PIZZA').decode()))] == ['STOUT PIZZA']
+    assert gzip.decompress(exportar('pedidos', compactar=True)) == exportar('pedidos')
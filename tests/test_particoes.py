@@ -0,0 +1,52 @@
+import gzip
+import threading
+import time
+from datetime import datetime
+
+import psycopg
+import pytest
+
+import app as modulo_app
+from conftest import TESTES_DATABASE_URL
+
+
+# Uma gravação no mês sendo arquivado espera o arquivamento terminar (e então
+# falha, sem partição para o horário) em vez de entrar depois da cópia e sumir
+# junto com a partição.
+def test_arquivar_nao_perde_gravacao_concorrente(banco, cliente, tmp_path, monkeypatch):
+    if not banco.particionado:
+        pytest.skip("pedidos só é particionada no Postgres")
+    conn = modulo_app.get_db_connection()
+    conn.execute("SELECT criar_particao_pedidos('2000-01-01')")
+    conn.commit()
+    modulo_app.movimentar_creditos(cliente, -1, 'STOUT PIZZA', datetime(2000, 1, 10))
+    monkeypatch.setattr(modulo_app, 'listar_particoes_pedidos', lambda: ['pedidos_2000_01'])
+
+    copia_original = psycopg.Cursor.copy
+    resultado = {}
+
+    def gravar_atrasada():
+        with psycopg.connect(TESTES_DATABASE_URL) as outra:
+            try:
+                outra.execute("INSERT INTO pedidos (card_id, empresa, quantidade_deduzida, horario) VALUES (%s, 'STOUT PIZZA', -1, '2000-01-20')",
+                              (cliente,))
+                outra.commit()
+                resultado['gravou'] = True
+            except psycopg.Error as erro:
+                resultado['erro'] = erro
+
+    def copiar_devagar(cursor, *args, **kwargs):
+        gravacao = threading.Thread(target=gravar_atrasada)
+        gravacao.start()
+        time.sleep(0.5)  # a gravação chega durante a cópia
+        resultado['esperando'] = gravacao.is_alive()
+        resultado['thread'] = gravacao
+        return copia_original(cursor, *args, **kwargs)
+
+    monkeypatch.setattr(psycopg.Cursor, 'copy', copiar_devagar)
+    arquivadas = modulo_app.arquivar_particoes_antigas(destino=str(tmp_path))
+    resultado['thread'].join()
+    assert resultado['esperando']
+    assert 'gravou' not in resultado
+    with gzip.open(arquivadas[0], 'rt') as arquivo:
+        assert len(arquivo.read().splitlines()) == 2  # cabeçalho e o pedido anterior
@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+import pytest
+
+import app as modulo_app
+
+
+@pytest.fixture
+def navegador(banco):
+    cliente = modulo_app.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['login'] = 'HUGO'
+    return cliente
+
+
+def test_vencendo_recarrega_os_cartoes_listados(navegador):
+    hoje = date.today()
+    for card_id, expiracao, expirado in [('CARD1', hoje + timedelta(days=2), False), ('CARD2', hoje + timedelta(days=20), False),
+                                         ('CARD3', hoje - timedelta(days=40), True)]:
+        modulo_app.cadastrar_cliente(card_id, card_id, '11900000000')
+        conn = modulo_app.get_db_connection()
+        conn.execute("UPDATE clientes SET creditos = 1, data_expiracao = %s, expirado = %s WHERE card_id = %s", (expiracao, expirado, card_id))
+        conn.commit()
+    pagina = navegador.get('/vencendo?dias=7').get_data(as_text=True)
+    assert 'value="CARD1"' in pagina and 'CARD2' not in pagina and 'CARD3' not in pagina
+
+    resposta = navegador.post('/vencendo', data={'dias': '7', 'senha': '03842789', 'card_id': ['CARD1']})
+    assert "1 cartão(ões) recarregado(s)" in resposta.get_data(as_text=True)
+    assert [modulo_app.buscar_info_cliente(card_id)[1] for card_id in ['CARD1', 'CARD2', 'CARD3']] == [10, 1, 1]
+
+
+def test_vencendo_limita_os_dias(navegador):
+    assert navegador.get('/vencendo?dias=4000000').status_code == 200
+
+
+# A listagem completa é renderizada em partes e precisa dos mesmos sinais de
+# render_template, que alimentam a métrica do tempo de template
+def test_listagem_em_partes_envia_sinais_do_template(navegador, cliente):
+    from flask import before_render_template, template_rendered
+
+    sinais = []
+    with before_render_template.connected_to(lambda sender, template, context: sinais.append(('antes', template.name)), modulo_app.app), \
+            template_rendered.connected_to(lambda sender, template, context: sinais.append(('depois', template.name)), modulo_app.app):
+        resposta = navegador.get('/consulta?completo=1')
+        assert cliente in resposta.get_data(as_text=True)
+    assert sinais == [('antes', 'consulta.html'), ('depois', 'consulta.html')]
+
+
+def test_metrics_exige_token(navegador, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'METRICAS_TOKEN', None)
+    assert navegador.get('/metrics').status_code == 404
+    monkeypatch.setattr(modulo_app, 'METRICAS_TOKEN', 'segredo')
+    assert navegador.get('/metrics').status_code == 401
+    assert navegador.get('/metrics', headers={'Authorization': 'Bearer errado'}).status_code == 401
+    assert navegador.get('/metrics', headers={'Authorization': 'Bearer segredo'}).status_code == 200